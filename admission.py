@@ -0,0 +1,111 @@
+# admission.py
+# -*- coding: utf-8 -*-
+"""
+基于估计开销的准入控制 (与 Web 框架无关)。
+每个渲染任务在提交到工作池之前按 render_service.estimate_render_cost 的估计值预留内存:
+- 估计峰值内存超过单个工作线程/进程的预算 (或估计 CPU 时间超过上限) 的任务永远无法接受，由调用者降低分辨率或拒绝；
+- 所有已接受任务 (排队中 + 执行中) 的预留总量不超过 预算 × 工作线程/进程数，超出时按到达顺序排队等待；
+- 等待的任务过多或等待超时时抛出 AdmissionTimeoutError (调用者返回 503)。
+因此负载突增时内存占用有上界，吞吐量可预测。所有方法都只能在事件循环线程中调用。
+"""
+
+import asyncio
+import collections
+
+
+class CostTooHighError(Exception):
+    """任务的估计开销超出单个工作线程/进程的预算"""
+
+
+class AdmissionTimeoutError(Exception):
+    """等待准入的任务过多或等待超时"""
+
+
+class AdmissionController:
+    def __init__(self, worker_budget_bytes: int, workers: int, max_render_seconds: float = 0.0,
+                 max_waiting: int = 64, wait_timeout: float = 30.0):
+        """
+        worker_budget_bytes: 单个工作线程/进程的内存预算；workers: 工作线程/进程数。
+        max_render_seconds: 单个任务估计 CPU 时间的上限 (0 为不限制)。
+        max_waiting: 同时等待准入的任务数上限；wait_timeout: 单个任务的最长等待时间 (秒)。
+        """
+        self.worker_budget_bytes = max(1, worker_budget_bytes)
+        self.capacity_bytes = self.worker_budget_bytes * max(1, workers)
+        self.max_render_seconds = max(0.0, max_render_seconds)
+        self.max_waiting = max(0, max_waiting)
+        self.wait_timeout = wait_timeout
+        self.reserved_bytes = 0
+        self._waiters = collections.deque() # [(cost, future)]，按到达顺序
+        self._counts = {"admitted": 0, "queued": 0, "timeouts": 0, "oversized": 0, "downscaled": 0}
+
+    def fits(self, cost) -> bool:
+        """任务的估计开销是否在单个工作线程/进程的预算之内"""
+        if cost.peak_bytes > self.worker_budget_bytes:
+            return False
+        return not self.max_render_seconds or cost.cpu_seconds <= self.max_render_seconds
+
+    def add(self, **counts):
+        for name, value in counts.items():
+            self._counts[name] += value
+
+    def _wake_waiters(self):
+        # 严格按到达顺序: 队首放不下时后面的任务也继续等待，大任务不会被小任务饿死
+        while self._waiters:
+            cost, future = self._waiters[0]
+            if future.done(): # 已超时或被取消
+                self._waiters.popleft()
+                continue
+            if self.reserved_bytes + cost.peak_bytes > self.capacity_bytes:
+                return
+            self._waiters.popleft()
+            self.reserved_bytes += cost.peak_bytes
+            future.set_result(None)
+
+    async def acquire(self, cost):
+        """为任务预留内存，必要时排队等待。开销超出预算时抛出 CostTooHighError。"""
+        if not self.fits(cost):
+            self.add(oversized=1)
+            raise CostTooHighError(f"预计需要 {cost.peak_bytes / 2**20:.0f} MB 内存、{cost.cpu_seconds:.1f} 秒 CPU 时间")
+        if not self._waiters and self.reserved_bytes + cost.peak_bytes <= self.capacity_bytes:
+            self.reserved_bytes += cost.peak_bytes
+            self.add(admitted=1)
+            return
+        if len(self._waiters) >= self.max_waiting:
+            self.add(timeouts=1)
+            raise AdmissionTimeoutError(f"等待准入的任务已达上限 ({self.max_waiting} 个)")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((cost, future))
+        self.add(queued=1)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.wait_timeout)
+        except asyncio.TimeoutError:
+            if future.cancel(): # 仍在等待 (否则超时的同时已获得预留，照常执行)
+                self._wake_waiters()
+                self.add(timeouts=1)
+                raise AdmissionTimeoutError(f"等待准入超时 ({self.wait_timeout:g} 秒)")
+        except asyncio.CancelledError:
+            if future.cancel():
+                self._wake_waiters()
+            else:
+                self.release(cost) # 已获得预留但调用者被取消
+            raise
+        self.add(admitted=1)
+
+    def release(self, cost):
+        """
+        释放 acquire() 预留的内存，并唤醒可以接受的等待任务。
+        应在任务真正结束时调用 (例如作为 RenderPool.run 的 release)，而不是在等待方被取消时。
+        """
+        self.reserved_bytes = max(0, self.reserved_bytes - cost.peak_bytes)
+        self._wake_waiters()
+
+    def stats(self) -> dict:
+        waiting = sum(1 for _, future in self._waiters if not future.done())
+        return {
+            "worker_budget_bytes": self.worker_budget_bytes,
+            "capacity_bytes": self.capacity_bytes,
+            "reserved_bytes": self.reserved_bytes,
+            "waiting": waiting,
+            "max_render_seconds": self.max_render_seconds,
+            **self._counts,
+        }
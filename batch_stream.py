@@ -0,0 +1,119 @@
+# batch_stream.py
+# -*- coding: utf-8 -*-
+"""
+批量生成结果的流式封装 (与 Web 框架无关)。
+每个任务完成后立即编码为一个独立的分段/归档条目，调用者可以边渲染边发送，无需先缓冲整个批次。
+
+两种写入器接口相同:
+    content_type                          响应的 Content-Type
+    add_image(index, filename, etag, body, content_type) -> bytes
+    add_error(index, payload)              -> bytes
+    close()                                -> bytes
+每个方法返回可以立即写入响应的字节块。
+"""
+
+import json
+import secrets
+import time
+import zipfile
+
+
+class MultipartWriter:
+    """
+    multipart/mixed 编码器: 每个分段带有自己的头部 (Content-Type、Content-Disposition 等)，
+    X-Batch-Index 头为任务在请求中的序号。
+    """
+
+    def __init__(self, boundary: str | None = None):
+        self.boundary = boundary or f"border-batch-{secrets.token_hex(12)}"
+
+    @property
+    def content_type(self) -> str:
+        return f'multipart/mixed; boundary="{self.boundary}"'
+
+    def part(self, headers: dict, body: bytes) -> bytes:
+        """编码一个分段 (分隔行 + 头部 + 空行 + 内容)"""
+        lines = [f"--{self.boundary}"]
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        lines.append(f"Content-Length: {len(body)}")
+        head = ("\r\n".join(lines) + "\r\n\r\n").encode('utf-8')
+        return head + body + b"\r\n"
+
+    def add_image(self, index: int, filename: str, etag: str, body: bytes, content_type: str = "image/png") -> bytes:
+        return self.part({
+            "Content-Type": content_type,
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "ETag": etag,
+            "X-Batch-Index": str(index),
+        }, body)
+
+    def add_error(self, index: int, payload: dict) -> bytes:
+        """单个任务的错误信息 (JSON 分段)"""
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        return self.part({"Content-Type": "application/json; charset=utf-8", "X-Batch-Index": str(index)}, body)
+
+    def close(self) -> bytes:
+        """结束分隔行"""
+        return f"--{self.boundary}--\r\n".encode('ascii')
+
+
+class _ChunkSink:
+    """
+    只追加、不可回退的输出流。zipfile 检测到不支持 seek/tell 时改为流式写法
+    (本地文件头之后附加数据描述符)，写入的数据由 drain() 取走。
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class ZipStreamWriter:
+    """
+    流式 ZIP 编码器: 每个图像作为一个条目立即写出，内存中只保留中央目录 (每个条目几十字节)，
+    因此峰值内存与批次大小无关。PNG 本身已经压缩，使用 ZIP_STORED 存储；SVG 为文本，使用 ZIP_DEFLATED。
+    失败的任务写为 "<序号>_error.json" 条目；归档末尾附带 manifest.json，列出每个任务的结果。
+    """
+
+    content_type = "application/zip"
+
+    def __init__(self):
+        self._sink = _ChunkSink()
+        self._zip = zipfile.ZipFile(self._sink, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True)
+        self._manifest = []
+
+    def _add(self, filename: str, body: bytes, compress_type: int) -> bytes:
+        info = zipfile.ZipInfo(filename, date_time=time.localtime()[:6])
+        info.compress_type = compress_type
+        self._zip.writestr(info, body)
+        return self._sink.drain()
+
+    def add_image(self, index: int, filename: str, etag: str, body: bytes, content_type: str = "image/png") -> bytes:
+        self._manifest.append({"index": index, "filename": filename, "etag": etag, "bytes": len(body)})
+        compress_type = zipfile.ZIP_DEFLATED if content_type.startswith("image/svg") else zipfile.ZIP_STORED
+        return self._add(filename, body, compress_type)
+
+    def add_error(self, index: int, payload: dict) -> bytes:
+        filename = f"{index:03d}_error.json"
+        self._manifest.append({"index": index, "filename": filename, "error": payload})
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        return self._add(filename, body, zipfile.ZIP_DEFLATED)
+
+    def close(self) -> bytes:
+        """写出 manifest.json 和中央目录"""
+        manifest = sorted(self._manifest, key=lambda entry: entry["index"])
+        data = self._add("manifest.json", json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8'),
+                         zipfile.ZIP_DEFLATED)
+        self._zip.close()
+        return data + self._sink.drain()
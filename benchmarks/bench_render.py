@@ -0,0 +1,252 @@
+# bench_render.py
+# -*- coding: utf-8 -*-
+"""
+单张图像渲染基准: 遍历样式1/样式2、外框/内框形状 (矩形/椭圆)、圆角半径和 DPI，
+经 render_service.render_png (create_bordered_image + PNG 编码) 生成名片，
+记录每个组合的耗时 (中位数/最小值，以及生成与编码各自的耗时)、峰值 RSS 和输出字节数。
+
+结果可保存为 JSON，并与保存的基线比较，出现回归时退出码为 1:
+- 耗时: 各组合 (最小值) 与基线之比的几何平均超过 1 + threshold，或单个组合超过 1 + case-threshold
+  (单个组合的耗时受系统噪声影响较大，因此整体比较更严格，单个组合更宽松)；
+- 内存: 单个组合的 RSS 增长超过基线的 1 + threshold 倍。
+基线记录了生成时的 Python 和 Pillow 版本；Python 的主/次版本 (例如 3.13) 或 Pillow 的完整版本与当前不同时
+不做比较 (退出码为 2)，除非指定 --allow-version-mismatch (此时只输出警告)。
+Pillow 版本会改变绘制/压缩的耗时和输出字节数；Python 的修订版本之间差别不大，不要求一致。
+
+用法:
+    python benchmarks/bench_render.py --json results.json
+    python benchmarks/bench_render.py --baseline benchmarks/baseline_render.json --threshold 0.15
+    python benchmarks/bench_render.py --baseline benchmarks/baseline_render.json --update-baseline
+"""
+
+import argparse
+import gc
+import itertools
+import json
+import logging
+import math
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import PIL
+
+import task_metrics
+from image_generator import MASK_CACHE, STYLE1_PARAMS, STYLE2_PARAMS
+from render_service import render_png, uses_strip_encoder
+from scene import build_scene
+
+STYLES = {"style1": STYLE1_PARAMS, "style2": STYLE2_PARAMS}
+SHAPES = ("rectangle", "ellipse")
+# 前端默认的名片尺寸 (mm)
+OUTER_SIZE_MM = (60.0, 92.0)
+INNER_SIZE_MM = (54.0, 86.0)
+CORNER_RADII_MM = (0.0, 3.18)
+# 影响渲染路径的环境变量，随结果一起记录
+ENV_KNOBS = ("BORDER_PNG_PROFILE", "BORDER_PALETTE_OUTPUT", "BORDER_PATTERN_TILING", "BORDER_CHECKERBOARD_ENGINE",
+             "BORDER_STRIP_MIN_PIXELS", "BORDER_STRIP_ROWS")
+
+
+def cases(styles, dpis):
+    """所有 (名称, 样式名, 外框形状, 内框形状, 圆角, DPI) 组合，顺序固定；圆角只对矩形内框有意义"""
+    for style, dpi, outer_shape, inner_shape in itertools.product(styles, dpis, SHAPES, SHAPES):
+        for radius in (CORNER_RADII_MM if inner_shape == 'rectangle' else (0.0,)):
+            yield f"{style}/{outer_shape}-{inner_shape}/r{radius:g}/{dpi}dpi", style, outer_shape, inner_shape, radius, dpi
+
+
+def reset_peak_rss() -> bool:
+    """把当前进程的峰值 RSS (VmHWM) 重置为当前 RSS (Linux)。不支持时返回 False。"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def rss_bytes(field: str = 'VmRSS') -> int:
+    """当前 (VmRSS) 或峰值 (VmHWM) RSS。无 /proc 时回退为进程生命周期内的峰值 (ru_maxrss)。"""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def run_case(style, outer_shape, inner_shape, radius, dpi, repeat):
+    """渲染 repeat 次 (另有一次不计入的预热)，返回该组合的测量结果"""
+    scene = build_scene(STYLES[style], *OUTER_SIZE_MM, outer_shape, *INNER_SIZE_MM, inner_shape, radius)
+    render_png(scene, dpi) # 预热: 图案图块等进程级缓存
+    seconds, encode_seconds, stage_totals = [], [], {}
+    peak_rss = rss_growth = 0
+    body = b""
+    for _ in range(repeat):
+        MASK_CACHE.clear() # 每次都重新生成遮罩，测量不受缓存命中影响
+        body = None
+        gc.collect()
+        task_metrics.drain()
+        before = rss_bytes()
+        reset_peak_rss()
+        started = time.perf_counter()
+        body = render_png(scene, dpi)
+        seconds.append(time.perf_counter() - started)
+        peak = rss_bytes('VmHWM')
+        peak_rss, rss_growth = max(peak_rss, peak), max(rss_growth, peak - before)
+        encoded = 0.0
+        for name, fields in task_metrics.drain():
+            if name == "png_encode":
+                encoded += fields["seconds"]
+            elif name == "render_stage":
+                stage_totals.setdefault(fields["stage"], []).append(fields["seconds"])
+        encode_seconds.append(encoded)
+    geometry = scene.rasterize(dpi)
+    median = statistics.median(seconds)
+    return {
+        "style": style, "outer_shape": outer_shape, "inner_shape": inner_shape, "corner_radius_mm": radius, "dpi": dpi,
+        "pixels": geometry.outer_width_px * geometry.outer_height_px,
+        "strip": uses_strip_encoder(geometry),
+        "seconds": round(median, 6),
+        "seconds_min": round(min(seconds), 6),
+        "render_seconds": round(median - statistics.median(encode_seconds), 6),
+        "encode_seconds": round(statistics.median(encode_seconds), 6),
+        "stages": {name: round(statistics.median(values), 6) for name, values in sorted(stage_totals.items())},
+        "peak_rss_bytes": peak_rss,
+        "rss_growth_bytes": rss_growth,
+        "bytes": len(body),
+    }
+
+
+def compare(results, baseline, threshold, case_threshold, min_seconds, min_rss_bytes):
+    """
+    与基线比较，返回 (耗时比的几何平均, 回归列表, 改善列表)。
+    单个组合的耗时 (最小值) 超过基线的 (1 + case_threshold) 倍、或 RSS 增长超过基线的 (1 + threshold) 倍，
+    且绝对差值超过 min_seconds / min_rss_bytes 时视为回归。
+    """
+    regressions, improvements, log_ratios = [], [], []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        if base["seconds_min"] > 0 and result["seconds_min"] > 0:
+            log_ratios.append(math.log(result["seconds_min"] / base["seconds_min"]))
+        for metric, limit, floor in (("seconds_min", case_threshold, min_seconds), ("rss_growth_bytes", threshold, min_rss_bytes)):
+            old, new = base[metric], result[metric]
+            if new > old * (1 + limit) and new - old > floor:
+                regressions.append((name, metric, old, new))
+            elif new < old * (1 - limit) and old - new > floor:
+                improvements.append((name, metric, old, new))
+    geomean = math.exp(sum(log_ratios) / len(log_ratios)) if log_ratios else 1.0
+    return geomean, regressions, improvements
+
+
+def _format_change(name, metric, old, new):
+    change = (new / old - 1) * 100 if old else float('inf')
+    if metric == "seconds_min":
+        return f"  {name:<44} {metric:<16} {old * 1000:>9.2f} ms -> {new * 1000:>9.2f} ms ({change:+.1f}%)"
+    return f"  {name:<44} {metric:<16} {old / 2**20:>9.1f} MB -> {new / 2**20:>9.1f} MB ({change:+.1f}%)"
+
+
+def version_key(name: str, version: str | None):
+    """比较基线时使用的版本: Python 只比较主/次版本，Pillow 比较完整版本"""
+    if name == "python" and version:
+        return tuple(version.split('.')[:2])
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="单张图像渲染基准 (样式 × 形状 × 圆角 × DPI)")
+    parser.add_argument('--styles', default='style1,style2', help="逗号分隔: style1, style2")
+    parser.add_argument('--dpi', default='72,150,300,600,1200', help="逗号分隔的 DPI 列表")
+    parser.add_argument('--repeat', type=int, default=5, help="每个组合的测量次数 (报告中位数和最小值)")
+    parser.add_argument('--json', dest='json_path', help="把结果另存为 JSON 文件")
+    parser.add_argument('--baseline', help="基线 JSON 文件: 与之比较，出现回归时退出码为 1")
+    parser.add_argument('--update-baseline', action='store_true', help="把本次结果写入 --baseline 文件 (不比较)")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="回归阈值: 耗时比的几何平均和单个组合的 RSS 增长 (相对变化，默认 0.15 即 15%%)")
+    parser.add_argument('--case-threshold', type=float, default=0.5, help="单个组合耗时的回归阈值 (默认 0.5 即 50%%)")
+    parser.add_argument('--min-ms', type=float, default=5.0, help="耗时的绝对差值低于该毫秒数时不视为回归")
+    parser.add_argument('--min-rss-mb', type=float, default=4.0, help="RSS 增长的绝对差值低于该 MB 数时不视为回归")
+    parser.add_argument('--allow-version-mismatch', action='store_true',
+                        help="基线的 Python/Pillow 版本与当前不同时仍然比较 (只输出警告)")
+    args = parser.parse_args()
+    if args.update_baseline and not args.baseline:
+        parser.error("--update-baseline 需要同时指定 --baseline")
+
+    logging.getLogger().setLevel(logging.WARNING)
+    styles = [style.strip() for style in args.styles.split(',')]
+    dpis = [int(dpi) for dpi in args.dpi.split(',')]
+    results = {}
+    print(f"{'case':<44} {'pixels':>10} {'median ms':>10} {'render ms':>10} {'encode ms':>10} {'RSS +MB':>8} {'bytes':>9}")
+    for name, style, outer_shape, inner_shape, radius, dpi in cases(styles, dpis):
+        result = results[name] = run_case(style, outer_shape, inner_shape, radius, dpi, max(1, args.repeat))
+        print(f"{name:<44} {result['pixels']:>10} {result['seconds'] * 1000:>10.2f} {result['render_seconds'] * 1000:>10.2f} "
+              f"{result['encode_seconds'] * 1000:>10.2f} {result['rss_growth_bytes'] / 2**20:>8.1f} {result['bytes']:>9}")
+
+    report = {
+        "meta": {
+            "python": platform.python_version(), "pillow": PIL.__version__, "platform": platform.platform(),
+            "machine": platform.machine(), "cpu_count": os.cpu_count(), "repeat": args.repeat,
+            "env": {knob: os.environ[knob] for knob in ENV_KNOBS if knob in os.environ},
+        },
+        "results": results,
+    }
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"基线已写入 {args.baseline}")
+        return 0
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    mismatched = [f"{key} {baseline.get('meta', {}).get(key)} (本次 {report['meta'][key]})"
+                  for key in ("python", "pillow") if version_key(key, baseline.get("meta", {}).get(key))
+                  != version_key(key, report["meta"][key])]
+    if mismatched:
+        if not args.allow_version_mismatch:
+            print(f"错误: 基线来自不同的版本: {', '.join(mismatched)}。请在相同的环境中运行，"
+                  f"或用 --update-baseline 重新生成基线 (--allow-version-mismatch 可强制比较)")
+            return 2
+        print(f"警告: 基线来自不同的版本: {', '.join(mismatched)}，比较结果仅供参考")
+    if baseline.get("meta", {}).get("platform") != report["meta"]["platform"]:
+        print(f"注意: 基线来自不同的平台 ({baseline.get('meta', {}).get('platform')})，耗时的比较仅供参考")
+    if baseline.get("meta", {}).get("env", {}) != report["meta"]["env"]:
+        print(f"注意: 基线的渲染相关环境变量不同 (基线: {baseline.get('meta', {}).get('env')}, 本次: {report['meta']['env']})")
+    geomean, regressions, improvements = compare(results, baseline.get("results", {}), args.threshold, args.case_threshold,
+                                                  args.min_ms / 1000.0, args.min_rss_mb * 2**20)
+    missing = sorted(set(results) - set(baseline.get("results", {})))
+    if missing:
+        print(f"基线中没有的组合 ({len(missing)} 个) 未比较")
+    failed = False
+    print(f"耗时与基线之比的几何平均: {geomean:.3f} (阈值 {1 + args.threshold:.2f})")
+    if geomean > 1 + args.threshold:
+        print("回归: 整体耗时超过阈值")
+        failed = True
+    if improvements:
+        print(f"改善 ({len(improvements)} 项):")
+        for change in improvements:
+            print(_format_change(*change))
+    if regressions:
+        print(f"回归 ({len(regressions)} 项):")
+        for change in regressions:
+            print(_format_change(*change))
+        failed = True
+    if not failed:
+        print("没有超过阈值的回归")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
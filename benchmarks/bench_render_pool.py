@@ -0,0 +1,97 @@
+# bench_render_pool.py
+# -*- coding: utf-8 -*-
+"""
+渲染工作池吞吐量基准: 在不同工作进程/线程数下并发渲染一批名片，输出每秒生成的图像数。
+
+用法:
+    python benchmarks/bench_render_pool.py --dpi 300 --jobs 24 --workers 1,2,4,8 --backend process,thread
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from image_generator import STYLE1_PARAMS, STYLE2_PARAMS
+from render_pool import RenderPool
+from render_service import render_png, warm_up
+from scene import build_scene
+
+
+def quiet_warm_up():
+    """工作进程初始化: 屏蔽每张图像的 INFO 日志后再预热"""
+    logging.getLogger().setLevel(logging.WARNING)
+    warm_up()
+
+
+def job_args(index, dpi):
+    """第 index 个任务的 render_png 参数: 交替使用样式1/样式2，尺寸略有不同以避开遮罩缓存"""
+    style = STYLE1_PARAMS if index % 2 == 0 else STYLE2_PARAMS
+    outer_w, outer_h = 60.0 + index % 7, 92.0 + index % 5
+    return (build_scene(style, outer_w, outer_h, 'rectangle', outer_w - 10.0, outer_h - 10.0, 'rectangle', 3.0), dpi)
+
+
+async def run_batch(pool, jobs, dpi):
+    """并发提交 jobs 个任务，返回耗时 (秒) 和输出总字节数"""
+    started = time.perf_counter()
+    results = await asyncio.gather(*(pool.run(render_png, *job_args(i, dpi)) for i in range(jobs)))
+    return time.perf_counter() - started, sum(len(body) for body in results)
+
+
+def bench(backend, workers, jobs, dpi):
+    pool = RenderPool(backend=backend, max_workers=workers, max_queue=jobs,
+                      preload=('render_service',), initializer=quiet_warm_up)
+    try:
+        pool.warm_up() # 进程启动和预热不计入测量时间
+        elapsed, total_bytes = asyncio.run(run_batch(pool, jobs, dpi))
+        stats = pool.stats()
+    finally:
+        pool.shutdown()
+    return {
+        "backend": backend,
+        "workers": workers,
+        "jobs": jobs,
+        "dpi": dpi,
+        "seconds": round(elapsed, 3),
+        "images_per_second": round(jobs / elapsed, 2),
+        "bytes": total_bytes,
+        "shm_transfers": stats["shm_transfers"],
+    }
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    default_workers = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+    parser = argparse.ArgumentParser(description="渲染工作池吞吐量基准")
+    parser.add_argument('--backend', default='process,thread', help="逗号分隔: process, thread")
+    parser.add_argument('--workers', default=','.join(map(str, default_workers)), help="逗号分隔的工作数列表")
+    parser.add_argument('--jobs', type=int, default=24, help="每轮渲染的图像数")
+    parser.add_argument('--dpi', type=int, default=300)
+    parser.add_argument('--json', dest='json_path', help="把结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    results = []
+    print(f"CPU 核心数: {cpu_count}, 每轮 {args.jobs} 张, DPI={args.dpi}")
+    print(f"{'backend':<8} {'workers':>7} {'seconds':>9} {'images/s':>9} {'speedup':>8}")
+    for backend in args.backend.split(','):
+        baseline = None
+        for workers in (int(w) for w in args.workers.split(',')):
+            result = bench(backend.strip(), workers, args.jobs, args.dpi)
+            baseline = baseline or result["images_per_second"]
+            result["speedup"] = round(result["images_per_second"] / baseline, 2)
+            results.append(result)
+            print(f"{result['backend']:<8} {workers:>7} {result['seconds']:>9.3f} "
+                  f"{result['images_per_second']:>9.2f} {result['speedup']:>7.2f}x")
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"cpu_count": cpu_count, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+# check_pattern_tiling.py
+# -*- coding: utf-8 -*-
+"""
+图案平铺的一致性检查: 对随机的画布尺寸、区域、间距和线宽 (含大线宽，例如样式1在高 DPI 下的斜线)，
+比较 render_pattern_layer 在 PATTERN_TILING 开启和关闭时的输出，任何像素不同时退出码为 1。
+参数由 --seed 决定，可复现。
+
+用法:
+    python benchmarks/check_pattern_tiling.py
+    python benchmarks/check_pattern_tiling.py --cases 2000 --max-line-width 40 --seed 7
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import ImageChops
+
+import image_generator
+from image_generator import render_pattern_layer
+
+# RGBA 颜色和调色板下标两种图层 (见 image_generator._layer_mode)
+COLORS = [((255, 0, 0, 255), None), ((0, 0, 255, 128), (0, 0, 0, 0)), (1, None), (1, 2)]
+
+
+def random_case(rng: random.Random, max_size: int, max_line_width: int) -> tuple:
+    """(图案, 画布尺寸, 颜色1, 颜色2, 间距, 线宽, 区域)；一半的用例取整张画布，其余取随机的子区域"""
+    width, height = rng.randint(1, max_size), rng.randint(1, max_size)
+    pattern = rng.choice(('diagonal', 'checkerboard'))
+    line_width = rng.randint(1, max_line_width)
+    spacing = rng.randint(line_width, 4 * line_width + 8) if pattern == 'diagonal' else rng.randint(1, 40)
+    color1, color2 = rng.choice(COLORS)
+    box = None
+    if rng.random() < 0.5:
+        x0, y0 = rng.randrange(width), rng.randrange(height)
+        box = (x0, y0, rng.randint(x0 + 1, width), rng.randint(y0 + 1, height))
+    return pattern, (width, height), color1, color2, spacing, line_width, box
+
+
+def render(tiling: bool, case: tuple):
+    pattern, image_size, color1, color2, spacing, line_width, box = case
+    image_generator.PATTERN_TILING = tiling
+    try:
+        return render_pattern_layer(pattern, image_size, color1, color2, spacing, line_width, box=box)
+    finally:
+        image_generator.PATTERN_TILING = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="比较图案平铺与整幅绘制的输出")
+    parser.add_argument('--cases', type=int, default=400, help="随机用例数")
+    parser.add_argument('--seed', type=int, default=0, help="随机种子")
+    parser.add_argument('--max-size', type=int, default=300, help="画布的最大宽/高 (像素)")
+    parser.add_argument('--max-line-width', type=int, default=24, help="斜线的最大线宽 (像素)")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    rng = random.Random(args.seed)
+    failures = 0
+    for index in range(args.cases):
+        case = random_case(rng, args.max_size, args.max_line_width)
+        tiled, drawn = render(True, case), render(False, case)
+        diff = ImageChops.difference(tiled, drawn).getbbox() if tiled.size == drawn.size else (0, 0) + drawn.size
+        if diff is not None:
+            failures += 1
+            pattern, image_size, color1, color2, spacing, line_width, box = case
+            print(f"不一致 #{index}: {pattern} 画布={image_size} 区域={box} 间距={spacing} 线宽={line_width} "
+                  f"颜色={color1}/{color2} 差异范围={diff}")
+    print(f"{args.cases} 个用例，{failures} 个不一致")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# load_test.py
+# -*- coding: utf-8 -*-
+"""
+HTTP 负载测试: 重放前端 (static/script.js) 的请求模式 —— 每次提交表单时并行发出样式1和样式2的一对 POST
+(multipart/form-data，字段与表单一致)。默认在本地启动 uvicorn，全程离线，只使用标准库作为客户端。
+
+每个虚拟用户依次发出请求对，报告单个请求和请求对 (用户看到两张图都返回的时间) 的 p50/p95/p99 延迟、
+吞吐量和错误率，以及服务端 /stats 中的工作池和缓存计数，用于在上线前端到端验证工作数、队列大小和缓存的调整。
+
+用法:
+    python benchmarks/load_test.py --concurrency 8 --duration 30
+    python benchmarks/load_test.py --mode full --dpi 300 --distinct 0 --server-env BORDER_RENDER_WORKERS=4
+    python benchmarks/load_test.py --url http://127.0.0.1:8000 --concurrency 16   # 使用已启动的服务
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STYLES = ("style1", "style2")
+
+
+def form_fields(index: int, distinct: int, mode: str, dpi: int, preview_max_px: int) -> dict:
+    """
+    第 index 个请求对的表单字段 (与 index.html 的表单一致)。distinct 个参数组合循环使用，
+    distinct=0 时每个请求对的参数都不同 (响应缓存总是未命中)。
+    """
+    variant = index % distinct if distinct else index
+    outer_width, outer_height = 50 + variant % 40, 80 + (variant // 40) % 40 + (variant // 1600) * 0.5
+    fields = {
+        "dpi": dpi,
+        "outer_width_mm": outer_width, "outer_height_mm": outer_height, "outer_shape_type": "rectangle",
+        "inner_width_mm": outer_width - 6, "inner_height_mm": outer_height - 6, "inner_shape_type": "rectangle",
+        "inner_corner_radius_mm": 3.18,
+    }
+    if mode == "preview": # 提交表单时前端只请求预览
+        fields.update(preview="true", preview_max_px=preview_max_px)
+    return fields
+
+
+def multipart_body(fields: dict) -> tuple:
+    """编码为 multipart/form-data，返回 (body, content_type)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n')
+    parts.append(f'--{boundary}--\r\n')
+    return "".join(parts).encode(), f"multipart/form-data; boundary={boundary}"
+
+
+class Client:
+    """一个 keep-alive 连接 (断开后自动重连)"""
+
+    def __init__(self, host: str, port: int, timeout: float):
+        self.host, self.port, self.timeout = host, port, timeout
+        self.connection = None
+
+    def post(self, path: str, body: bytes, content_type: str) -> tuple:
+        """返回 (状态码, 响应字节数)；连接错误时状态码为 0"""
+        for attempt in range(2):
+            if self.connection is None:
+                self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self.connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+                response = self.connection.getresponse()
+                size = len(response.read())
+                return response.status, size
+            except (http.client.HTTPException, OSError):
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    return 0, 0
+        return 0, 0
+
+
+class Recorder:
+    """线程安全地收集样本"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = [] # (延迟, 状态码, 字节数)
+        self.pairs = [] # 延迟
+
+    def add(self, pair_latency: float, results: list):
+        with self._lock:
+            self.pairs.append(pair_latency)
+            self.requests.extend(results)
+
+
+def percentile(values: list, fraction: float) -> float:
+    """最近秩法百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))]
+
+
+def run_user(host, port, args, counter, deadline, recorder, warmup_until):
+    """一个虚拟用户: 两个连接，每次并行发出样式1/样式2的请求"""
+    clients = {style: Client(host, port, args.timeout) for style in STYLES}
+    with ThreadPoolExecutor(max_workers=1) as helper: # 样式2的请求在辅助线程中与样式1并行发出
+        while time.monotonic() < deadline:
+            index = counter()
+            if args.pairs and index >= args.pairs:
+                return
+            body, content_type = multipart_body(form_fields(index, args.distinct, args.mode, args.dpi, args.preview_max_px))
+
+            def send(style):
+                started = time.perf_counter()
+                status, size = clients[style].post(f"/generate_image_{style}/", body, content_type)
+                return time.perf_counter() - started, status, size
+
+            started = time.perf_counter()
+            second = helper.submit(send, STYLES[1])
+            results = [send(STYLES[0]), second.result()]
+            if time.monotonic() >= warmup_until:
+                recorder.add(time.perf_counter() - started, results)
+            if args.think_ms:
+                time.sleep(args.think_ms / 1000.0)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, server_env: list, log_path: str = None, timeout: float = 60.0):
+    """在本地启动 uvicorn (项目根目录)，等待 /stats 可访问。服务端日志写入 log_path (省略时丢弃)。"""
+    env = dict(os.environ)
+    for item in server_env:
+        key, _, value = item.partition("=")
+        env[key] = value
+    log = open(log_path, 'ab') if log_path else subprocess.DEVNULL
+    try:
+        process = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port),
+                                    "--log-level", "warning", "--no-access-log"],
+                                   cwd=ROOT, env=env, stdout=log, stderr=log)
+    finally:
+        if log_path:
+            log.close()
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"uvicorn 启动失败 (退出码 {process.returncode})")
+        try:
+            fetch_stats("127.0.0.1", port)
+            return process
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("等待 uvicorn 启动超时")
+
+
+def fetch_stats(host: str, port: int) -> dict:
+    connection = http.client.HTTPConnection(host, port, timeout=5)
+    try:
+        connection.request("GET", "/stats")
+        response = connection.getresponse()
+        if response.status != 200:
+            raise http.client.HTTPException(f"/stats 返回 {response.status}")
+        return json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def summarize(recorder: Recorder, elapsed: float) -> dict:
+    latencies = [latency for latency, status, _ in recorder.requests if 200 <= status < 400]
+    statuses = {}
+    for _, status, _ in recorder.requests:
+        statuses[str(status or "connection_error")] = statuses.get(str(status or "connection_error"), 0) + 1
+    total = len(recorder.requests)
+    errors = total - len(latencies)
+
+    def latency_summary(values):
+        return {f"p{int(q * 100)}_ms": round(percentile(values, q) * 1000, 2) for q in (0.5, 0.95, 0.99)} | \
+               {"max_ms": round(max(values, default=0.0) * 1000, 2)}
+
+    return {
+        "seconds": round(elapsed, 3),
+        "requests": total,
+        "pairs": len(recorder.pairs),
+        "requests_per_second": round(total / elapsed, 2) if elapsed else 0.0,
+        "pairs_per_second": round(len(recorder.pairs) / elapsed, 2) if elapsed else 0.0,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "statuses": statuses,
+        "bytes": sum(size for _, _, size in recorder.requests),
+        "request_latency": latency_summary(latencies),
+        "pair_latency": latency_summary(recorder.pairs),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="重放前端样式1/样式2成对请求的 HTTP 负载测试")
+    parser.add_argument('--url', help="目标服务地址 (例如 http://127.0.0.1:8000)；省略时在本地启动 uvicorn")
+    parser.add_argument('--server-env', action='append', default=[], metavar='KEY=VALUE',
+                        help="本地启动 uvicorn 时附加的环境变量 (可重复，例如 BORDER_RENDER_WORKERS=4)")
+    parser.add_argument('--server-log', help="本地启动的 uvicorn 的日志文件 (省略时丢弃)")
+    parser.add_argument('--concurrency', type=int, default=8, help="虚拟用户数 (同时进行的请求对数)")
+    parser.add_argument('--duration', type=float, default=20.0, help="测量时长 (秒，不含预热)")
+    parser.add_argument('--warmup', type=float, default=2.0, help="预热时长 (秒，不计入结果)")
+    parser.add_argument('--pairs', type=int, default=0, help="请求对总数上限 (0 为只按时长)")
+    parser.add_argument('--mode', choices=("preview", "full"), default="preview",
+                        help="preview: 提交表单时的预览请求；full: 点击下载时的完整分辨率请求")
+    parser.add_argument('--dpi', type=int, default=300, help="full 模式的 DPI")
+    parser.add_argument('--preview-max-px', type=int, default=800, help="preview 模式的 preview_max_px")
+    parser.add_argument('--distinct', type=int, default=50, help="循环使用的参数组合数 (0 为每次都不同，缓存总是未命中)")
+    parser.add_argument('--think-ms', type=float, default=0.0, help="每个用户两次请求对之间的间隔 (毫秒)")
+    parser.add_argument('--timeout', type=float, default=60.0, help="单个请求的超时 (秒)")
+    parser.add_argument('--json', dest='json_path', help="把结果另存为 JSON 文件")
+    args = parser.parse_args()
+
+    process = None
+    if args.url:
+        parsed = urllib.parse.urlsplit(args.url)
+        host, port = parsed.hostname, parsed.port or 80
+    else:
+        host, port = "127.0.0.1", free_port()
+        process = start_server(port, args.server_env, args.server_log)
+    try:
+        indexes, index_lock = itertools.count(), threading.Lock()
+
+        def next_index():
+            with index_lock:
+                return next(indexes)
+
+        recorder = Recorder()
+        started = time.monotonic()
+        warmup_until = started + args.warmup
+        deadline = warmup_until + args.duration
+        print(f"目标 http://{host}:{port}，{args.concurrency} 个虚拟用户，模式 {args.mode}，"
+              f"预热 {args.warmup:g} 秒 + 测量 {args.duration:g} 秒")
+        threads = [threading.Thread(target=run_user, args=(host, port, args, next_index, deadline, recorder, warmup_until))
+                   for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = max(0.0, time.monotonic() - warmup_until)
+        summary = summarize(recorder, elapsed)
+        server_stats = fetch_stats(host, port)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    request_latency, pair_latency = summary["request_latency"], summary["pair_latency"]
+    print(f"请求: {summary['requests']} 个 ({summary['requests_per_second']:.1f}/s)，请求对: {summary['pairs']} 个 "
+          f"({summary['pairs_per_second']:.1f}/s)，错误率 {summary['error_rate']:.2%}，状态码 {summary['statuses']}")
+    print(f"{'latency (ms)':<14} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+    for label, latency in (("request", request_latency), ("pair", pair_latency)):
+        print(f"{label:<14} {latency['p50_ms']:>9.2f} {latency['p95_ms']:>9.2f} {latency['p99_ms']:>9.2f} {latency['max_ms']:>9.2f}")
+    pool, cache = server_stats.get("render_pool", {}), server_stats.get("response_cache", {})
+    admission = server_stats.get("admission", {})
+    print(f"服务端 (含预热): 工作池 {pool.get('backend')} × {pool.get('max_workers')}，完成 {pool.get('completed')}，"
+          f"拒绝 {pool.get('rejected')}，平均排队 {pool.get('wait_seconds_avg', 0) * 1000:.1f} ms；"
+          f"准入排队 {admission.get('queued')}，超时 {admission.get('timeouts')}；"
+          f"响应缓存命中 {cache.get('memory_hits', 0) + cache.get('disk_hits', 0)}，未命中 {cache.get('misses')}")
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump({"config": vars(args), "summary": summary, "server_stats": server_stats}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,11 +6,38 @@
 """
 
 from PIL import Image, ImageDraw
+import functools
 import math
+import os
 import logging # 使用 logging 记录服务器端信息，替代 print
 
-# 配置基础日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+import task_metrics
+from mask_cache import MaskCache
+
+try:
+    import numpy as np # 可选依赖: 用于向量化的棋盘格绘制
+except ImportError: # 未安装 numpy 时回退到逐格绘制
+    np = None
+
+# 棋盘格绘制引擎: 'numpy' (向量化, 默认) 或 'legacy' (逐格调用 draw.rectangle)
+# 可通过环境变量 BORDER_CHECKERBOARD_ENGINE 切换，便于线上对比两条路径
+CHECKERBOARD_ENGINE = os.environ.get("BORDER_CHECKERBOARD_ENGINE", "numpy").strip().lower()
+
+# 周期图案 (斜线/棋盘格) 是否只绘制一个重复图块再平铺到整个画布
+# 设置 BORDER_PATTERN_TILING=0 可回退到在整张画布上逐条/逐格绘制
+PATTERN_TILING = os.environ.get("BORDER_PATTERN_TILING", "1").strip().lower() not in ('0', 'false', 'off', 'no')
+
+# 遮罩缓存: 几何参数相同的请求 (例如同一表单的样式1和样式2) 共享边框/内框遮罩
+# BORDER_MASK_CACHE_BYTES 为缓存总字节数上限，设为 0 关闭缓存
+MASK_CACHE = MaskCache(int(os.environ.get("BORDER_MASK_CACHE_BYTES", str(256 * 1024 * 1024))))
+
+# 边框/内框填充按水平带逐条生成并粘贴，峰值内存与带高 (而不是画布高度) 成正比
+FILL_BAND_ROWS = 256
+
+# 样式的可见颜色不超过 255 种时 (例如样式1/样式2 都只有一种颜色) 总是在单通道的调色板下标上绘制，
+# 颜色只在编码时附加。PALETTE_OUTPUT 决定编码格式: 带 tRNS 的索引 PNG (默认)，
+# 或者设置 BORDER_PALETTE_OUTPUT=0 展开为与以往一致的 RGBA PNG
+PALETTE_OUTPUT = os.environ.get("BORDER_PALETTE_OUTPUT", "1").strip().lower() not in ('0', 'false', 'off', 'no')
 
 # --- 辅助函数 (大部分不变, 移除了输入函数) ---
 
@@ -18,44 +45,356 @@ def mm_to_pixels(mm, dpi):
     """将毫米转换为像素"""
     if mm is None: return 0
     try: return round(float(mm) / 25.4 * float(dpi))
-    except ValueError: logging.error(f"无效的毫米值: '{mm}'"); return 0
+    except ValueError: logging.error("无效的毫米值: '%s'", mm); return 0
 
 def pt_to_pixels(pt, dpi):
     """将磅 (points) 转换为像素"""
     if pt is None: return 0
     try: return max(1, math.ceil(float(pt) / 72.0 * float(dpi))) # 至少为1像素
-    except ValueError: logging.error(f"无效的磅值: '{pt}'"); return 1
+    except ValueError: logging.error("无效的磅值: '%s'", pt); return 1
 
 # --- 图案绘制函数 (不变) ---
-def draw_diagonal_lines(draw_context, image_size, color1, color2, spacing_px, line_width_px):
-    """绘制斜线图案"""
+def draw_diagonal_lines(draw_context, image_size, color1, color2, spacing_px, line_width_px, regions=None, offset=(0, 0)):
+    """
+    绘制斜线图案 (45° 线 x - y = d，d ≡ -2 * height (mod spacing))。
+    只遍历与画布相交的线，并把每条线段裁剪到可见范围 (外扩一个线宽余量，避免线端截断)。
+    regions: 可选的感兴趣区域列表 [(x0, y0, x1, y1), ...] (画布坐标，右/下边界不含)，
+             只保证区域内的像素与整幅绘制一致，例如只绘制边框带。
+    offset: draw_context 左上角在画布中的坐标，用于只绘制画布局部的小图层。
+    """
     width, height = image_size
     line_width_px = max(1, line_width_px) # 确保线宽至少为1
     spacing_px = max(line_width_px, spacing_px) # 确保间距不小于线宽
     if width <= 0 or height <= 0: return
     # 确保 color1 是有效的 RGBA 元组
-    if color1 and isinstance(color1, tuple) and len(color1) == 4 and color1[3] > 0:
-        for k in range(0 - height, width + height, spacing_px):
-             draw_context.line([ (k-height, 0) , (width, width-k+height) ], fill=color1, width=line_width_px)
+    if not _is_drawable_color(color1): return
+    if regions is None:
+        regions = [(0, 0, width, height)]
+    margin = line_width_px + 2
+    for x0, y0, x1, y1 in regions:
+        x0, y0, x1, y1 = max(0, x0), max(0, y0), min(width, x1), min(height, y1)
+        if x0 >= x1 or y0 >= y1: continue
+        # 与区域 (含余量) 相交的线: d ∈ [x0 - y1 - margin, x1 - y0 + margin]
+        d_min = x0 - y1 - margin
+        d_max = min(width - 1, x1 - y0 + margin)
+        first = d_min + (-2 * height - d_min) % spacing_px
+        for d in range(first, d_max + 1, spacing_px):
+            # 原始线段从 (d, 0) 到 (width, width - d)，按区域裁剪其 y 范围
+            y_start = max(0, y0 - margin, x0 - margin - d)
+            y_end = min(width - d, y1 + margin, x1 + margin - d)
+            if y_start < y_end:
+                draw_context.line([(d + y_start - offset[0], y_start - offset[1]), (d + y_end - offset[0], y_end - offset[1])],
+                                  fill=color1, width=line_width_px)
     # 注意：原始脚本的此函数似乎未使用 color2
 
-def draw_checkerboard(draw_context, image_size, color1, color2, check_size_px):
-    """绘制棋盘格图案"""
+def draw_checkerboard(draw_context, image_size, color1, color2, check_size_px, offset=(0, 0)):
+    """绘制棋盘格图案; offset 为图层左上角在画布中的坐标 (格子始终以画布原点为基准)"""
     width, height = image_size
     check_size_px = max(1, check_size_px) # 确保格子尺寸至少为1
     if width <= 0 or height <= 0: return
-    for r in range(0, height, check_size_px):
-        for c in range(0, width, check_size_px):
+    ox, oy = offset
+    # 从与图层相交的第一个格子开始 (包括右/下边线恰好落在图层首行/首列上的格子)
+    r_first = max(0, (oy // check_size_px - 1) * check_size_px)
+    c_first = max(0, (ox // check_size_px - 1) * check_size_px)
+    for r in range(r_first, oy + height, check_size_px):
+        for c in range(c_first, ox + width, check_size_px):
             row_idx = r // check_size_px
             col_idx = c // check_size_px
             # 交替使用 color1 和 color2
             current_color = color1 if (row_idx + col_idx) % 2 == 0 else color2
             # 确保颜色有效且透明度大于0才绘制
-            if current_color and isinstance(current_color, tuple) and len(current_color) == 4 and current_color[3] > 0:
-                c_end = min(c + check_size_px, width) # 防止超出图像边界
-                r_end = min(r + check_size_px, height) # 防止超出图像边界
-                draw_context.rectangle([(c, r), (c_end, r_end)], fill=current_color, outline=None)
+            if _is_drawable_color(current_color):
+                c_end = min(c + check_size_px, ox + width) # 防止超出图像边界
+                r_end = min(r + check_size_px, oy + height) # 防止超出图像边界
+                draw_context.rectangle([(c - ox, r - oy), (c_end - ox, r_end - oy)], fill=current_color, outline=None)
+
+def _is_drawable_color(color):
+    """
+    颜色是否需要绘制: RGBA 元组且透明度大于0，或者非0的调色板下标 (下标0表示透明)。
+    """
+    if isinstance(color, int):
+        return color > 0
+    return bool(color) and isinstance(color, tuple) and len(color) == 4 and color[3] > 0
+
+def _is_color(color):
+    """是否为 RGBA 元组或调色板下标"""
+    return isinstance(color, int) or (isinstance(color, tuple) and len(color) == 4)
+
+def _layer_mode(color):
+    """颜色对应的图层模式: 调色板下标绘制在单通道 'L' 图层上，RGBA 元组绘制在 'RGBA' 图层上"""
+    return 'L' if isinstance(color, int) else 'RGBA'
 
+def render_checkerboard_array(image_size, color1, color2, check_size_px, offset=(0, 0)):
+    """
+    使用 numpy 一次性生成棋盘格图层 (RGBA Image，颜色为调色板下标时为 'L' Image)。
+    输出与在透明图层上调用 draw_checkerboard 的结果逐像素一致 (offset 含义相同)。
+    """
+    width, height = image_size
+    check_size_px = max(1, check_size_px)
+    draw1 = _is_drawable_color(color1)
+    draw2 = _is_drawable_color(color2)
+    if width <= 0 or height <= 0 or not (draw1 or draw2):
+        return Image.new(_layer_mode(color1), (max(0, width), max(0, height)), 0)
+
+    xs = np.arange(offset[0], offset[0] + width)
+    ys = np.arange(offset[1], offset[1] + height)
+    # 每个像素所在格子的行列奇偶性: 0 -> color1, 1 -> color2
+    row_parity = ((ys // check_size_px) & 1).astype(np.uint8)
+    col_parity = ((xs // check_size_px) & 1).astype(np.uint8)
+    parity = row_parity[:, None] ^ col_parity[None, :]
+    if draw1 and draw2:
+        palette = np.array([color1, color2], dtype=np.uint8)
+        return Image.fromarray(palette[parity])
+
+    # 只绘制一种颜色时: Pillow 的 rectangle 包含右/下边界，
+    # 因此每个已绘制的格子还会覆盖右侧和下方相邻格子的首列/首行
+    col_edge = (xs % check_size_px == 0) & (xs >= check_size_px)
+    row_edge = (ys % check_size_px == 0) & (ys >= check_size_px)
+    target_parity = 0 if draw1 else 1
+    covered = (parity == target_parity) | row_edge[:, None] | col_edge[None, :]
+    transparent = 0 if isinstance(color1, int) else (0, 0, 0, 0)
+    palette = np.array([transparent, color1 if draw1 else color2], dtype=np.uint8)
+    return Image.fromarray(palette[covered.view(np.uint8)])
+
+def render_checkerboard_layer(image_size, color1, color2, check_size_px, offset=(0, 0)):
+    """按 CHECKERBOARD_ENGINE 选择引擎，返回透明背景上的棋盘格图层 (模式见 _layer_mode)"""
+    if CHECKERBOARD_ENGINE != 'legacy' and np is not None:
+        return render_checkerboard_array(image_size, color1, color2, check_size_px, offset)
+    layer = Image.new(_layer_mode(color1), image_size, 0)
+    draw_checkerboard(ImageDraw.Draw(layer), image_size, color1, color2, check_size_px, offset)
+    return layer
+
+def crop_image(image, box):
+    """
+    与 Image.crop 相同 (超出部分为0)，但通过 paste 实现。
+    Image.crop 会对超大尺寸做解压炸弹检查，而画布本身由本模块创建，无需该检查。
+    """
+    region = Image.new(image.mode, (box[2] - box[0], box[3] - box[1]))
+    region.paste(image, (-box[0], -box[1]))
+    return region
+
+# --- 周期图案: 单个重复图块 + 平铺 ---
+
+@functools.lru_cache(maxsize=64)
+def get_pattern_tile(pattern_type, spacing_px, line_width_px, color1, color2):
+    """
+    渲染一个周期图案的最小重复图块 (模式见 _layer_mode)，按参数缓存。
+    返回的图块会被多个请求共享，调用者不得修改。
+    斜线图块为 spacing x spacing，图块内的线满足 u - v ≡ 0 (mod spacing)。
+    棋盘格图块为 2*check x 2*check，对应画布上从 (check, check) 开始的一个周期。
+    """
+    if pattern_type == 'diagonal':
+        line_width_px = max(1, line_width_px)
+        spacing_px = max(line_width_px, spacing_px)
+        # 在带边距的画布上绘制，裁掉边缘以避免线端截断
+        margin = line_width_px + 2
+        size = spacing_px + 2 * margin
+        canvas = Image.new(_layer_mode(color1), (size, size), 0)
+        canvas_draw = ImageDraw.Draw(canvas)
+        reach = size + margin
+        for d in range(-(reach // spacing_px + 1) * spacing_px, reach + 1, spacing_px):
+            # 直线 x - y = d，两端都延伸到画布之外
+            canvas_draw.line([(d - margin, -margin), (d + size + margin, size + margin)], fill=color1, width=line_width_px)
+        return canvas.crop((margin, margin, margin + spacing_px, margin + spacing_px))
+    if pattern_type == 'checkerboard':
+        check_size_px = max(1, spacing_px)
+        period = 2 * check_size_px
+        # x, y >= check 之后棋盘格严格按 2*check 重复
+        layer = render_checkerboard_layer((3 * check_size_px, 3 * check_size_px), color1, color2, check_size_px)
+        return layer.crop((check_size_px, check_size_px, check_size_px + period, check_size_px + period))
+    raise ValueError(f"不支持的图案类型: {pattern_type}")
+
+def tile_image(tile, image_size, origin=(0, 0)):
+    """
+    用图块平铺出 image_size 大小的图层。origin 为画布 (0, 0) 在图块中对应的坐标。
+    先铺一行再逐次倍增复制，只需 O(log n) 次 C 层面的 paste 调用。
+    """
+    width, height = image_size
+    tile_w, tile_h = tile.size
+    layer = Image.new(tile.mode, image_size)
+    if width <= 0 or height <= 0 or tile_w <= 0 or tile_h <= 0:
+        return layer
+    ox, oy = origin[0] % tile_w, origin[1] % tile_h
+    # 带相位偏移的首个图块，覆盖 [0, tile_w) x [0, tile_h)
+    for x in (-ox, tile_w - ox):
+        for y in (-oy, tile_h - oy):
+            layer.paste(tile, (x, y))
+    band_h = min(tile_h, height)
+    filled = tile_w
+    while filled < width: # 横向倍增
+        layer.paste(crop_image(layer, (0, 0, filled, band_h)), (filled, 0))
+        filled *= 2
+    filled = tile_h
+    while filled < height: # 纵向倍增
+        layer.paste(crop_image(layer, (0, 0, width, filled)), (0, filled))
+        filled *= 2
+    return layer
+
+def render_pattern_layer(pattern_type, image_size, color1, color2, spacing_px, line_width_px, box=None):
+    """
+    返回画布上 box 区域 (x0, y0, x1, y1) 内的图案图层，box 默认为整张画布。
+    颜色为 RGBA 元组时返回 RGBA 图层，为调色板下标时返回 'L' 图层。
+    PATTERN_TILING 开启时渲染一个缓存的重复图块并平铺，否则直接绘制该区域。
+    """
+    width, height = image_size
+    box = box or (0, 0, width, height)
+    box_x0, box_y0, box_x1, box_y1 = box
+    box_size = (box_x1 - box_x0, box_y1 - box_y0)
+    spacing_px = max(1, spacing_px)
+    line_width_px = max(1, line_width_px)
+    mode = _layer_mode(color1)
+    if pattern_type == 'diagonal':
+        # 确保 color2 也是有效的颜色或 None
+        color2 = color2 if _is_color(color2) else None
+        if not PATTERN_TILING:
+            layer = Image.new(mode, box_size, 0)
+            draw_diagonal_lines(ImageDraw.Draw(layer), image_size, color1, color2, spacing_px, line_width_px,
+                                regions=[box], offset=(box_x0, box_y0))
+            return layer
+        if not _is_drawable_color(color1):
+            return Image.new(mode, box_size, 0)
+        tile = get_pattern_tile('diagonal', spacing_px, line_width_px, color1, color2)
+        # 与 draw_diagonal_lines 相位一致: 画布上的线满足 x - y ≡ -2 * height (mod spacing)
+        layer = tile_image(tile, box_size, origin=(2 * height + box_x0, box_y0))
+        # draw_diagonal_lines 的每条线从 y=0 开始、到 x=width 结束，方形线端会在顶部几行和右侧几列留下缺口
+        # (线宽较大时可见)。这部分不属于周期图案，清空顶部和右侧的窄带后按原端点重新绘制
+        margin = line_width_px + 2
+        edges = [(box_x0, box_y0, box_x1, min(height, margin, box_y1)),
+                 (max(box_x0, width - margin), box_y0, box_x1, box_y1)]
+        draw = None
+        for x0, y0, x1, y1 in edges:
+            if x0 < x1 and y0 < y1:
+                layer.paste(0, (x0 - box_x0, y0 - box_y0, x1 - box_x0, y1 - box_y0))
+                draw = draw or ImageDraw.Draw(layer)
+                draw_diagonal_lines(draw, image_size, color1, color2, spacing_px, line_width_px,
+                                    regions=[(x0, y0, x1, y1)], offset=(box_x0, box_y0))
+        return layer
+    if pattern_type == 'checkerboard':
+        color2 = color2 if _is_color(color2) else (0 if mode == 'L' else (0, 0, 0, 0))
+        if not PATTERN_TILING:
+            return render_checkerboard_layer(box_size, color1, color2, spacing_px, offset=(box_x0, box_y0))
+        if not (_is_drawable_color(color1) or _is_drawable_color(color2)):
+            return Image.new(mode, box_size, 0)
+        tile = get_pattern_tile('checkerboard', spacing_px, 1, color1, color2)
+        layer = tile_image(tile, box_size, origin=(spacing_px + box_x0, spacing_px + box_y0))
+        if not (_is_drawable_color(color1) and _is_drawable_color(color2)):
+            # 只绘制一种颜色时，首行/首列没有来自左侧/上方格子的边线溢出，不属于周期部分，单独绘制
+            if box_x0 <= 0 < box_x1:
+                column = render_checkerboard_layer((1, box_size[1]), color1, color2, spacing_px, offset=(0, box_y0))
+                layer.paste(column, (-box_x0, 0))
+            if box_y0 <= 0 < box_y1:
+                row = render_checkerboard_layer((box_size[0], 1), color1, color2, spacing_px, offset=(box_x0, 0))
+                layer.paste(row, (0, -box_y0))
+        return layer
+    raise ValueError(f"不支持的图案类型: {pattern_type}")
+
+def paste_masked(image, box, mask, mask_origin, render_band):
+    """
+    把 render_band(band_box) 生成的图层按遮罩粘贴到 image 的 box 区域 (画布坐标)，逐条水平带处理。
+    mask_origin 为遮罩左上角在画布中的坐标；遮罩全为0的带直接跳过，不生成图层。
+    """
+    x0, y0, x1, y1 = box
+    for top in range(y0, y1, FILL_BAND_ROWS):
+        band_box = (x0, top, x1, min(y1, top + FILL_BAND_ROWS))
+        band_mask = crop_image(mask, (x0 - mask_origin[0], band_box[1] - mask_origin[1],
+                                      x1 - mask_origin[0], band_box[3] - mask_origin[1]))
+        if band_mask.getbbox() is None: continue
+        with task_metrics.stage("pattern"):
+            layer = render_band(band_box)
+        with task_metrics.stage("paste"):
+            image.paste(layer, band_box, band_mask)
+
+def solid_band_renderer(color, width):
+    """返回供 paste_masked 使用的纯色带生成函数，所有带共用同一个纯色图层"""
+    band = Image.new(_layer_mode(color), (width, FILL_BAND_ROWS), color)
+    def render_band(band_box):
+        rows = band_box[3] - band_box[1]
+        return band if rows == FILL_BAND_ROWS else crop_image(band, (0, 0, width, rows))
+    return render_band
+
+def border_band_regions(image_size, inner_bbox, inner_shape_type, inner_corner_radius_px, has_valid_inner_area):
+    """
+    返回覆盖边框遮罩 (外框挖掉内框) 的矩形区域列表 [(x0, y0, x1, y1), ...] (右/下边界不含)。
+    各区域互不重叠。内框为 (圆角) 矩形时只包含四条边框带和圆角处的小方块，其余情况返回整张画布。
+    """
+    width, height = image_size
+    if not has_valid_inner_area or inner_shape_type != 'rectangle':
+        return [(0, 0, width, height)]
+    x0, y0, x1, y1 = inner_bbox # 内框 bbox 的右/下边界是包含的
+    regions = [(0, 0, width, y0), (0, y1 + 1, width, height), # 上、下
+               (0, y0, x0, y1 + 1), (x1 + 1, y0, width, y1 + 1)] # 左、右
+    if inner_corner_radius_px > 0: # 圆角外侧的四个角落 (以内框中线为界，互不重叠)
+        r = inner_corner_radius_px + 2
+        mid_x, mid_y = (x0 + x1 + 1) // 2, (y0 + y1 + 1) // 2
+        left, right = (x0, min(x0 + r, mid_x)), (max(x1 + 1 - r, mid_x), x1 + 1)
+        top, bottom = (y0, min(y0 + r, mid_y)), (max(y1 + 1 - r, mid_y), y1 + 1)
+        regions += [(cx0, cy0, cx1, cy1) for cx0, cx1 in (left, right) for cy0, cy1 in (top, bottom)]
+    return [box for box in regions if box[0] < box[2] and box[1] < box[3]]
+
+def _draw_inner_shape(draw_context, bbox, inner_shape_type, inner_corner_radius_px):
+    """在遮罩上以白色 (255) 填充内框形状"""
+    if inner_shape_type == 'rectangle':
+        if inner_corner_radius_px > 0: # 使用圆角矩形
+            draw_context.rounded_rectangle(bbox, radius=inner_corner_radius_px, fill=255) # 白色填充
+        else: # 使用普通矩形
+            draw_context.rectangle(bbox, fill=255)
+    elif inner_shape_type == 'ellipse':
+        draw_context.ellipse(bbox, fill=255)
+    else: # 处理不支持的形状
+        logging.warning("不支持的内框形状: %s。默认使用矩形内框。", inner_shape_type)
+        draw_context.rectangle(bbox, fill=255)
+
+def _draw_outer_shape(draw_context, bbox, outer_shape_type):
+    """在遮罩上以白色 (255) 填充外框形状"""
+    if outer_shape_type == 'rectangle':
+        draw_context.rectangle(bbox, fill=255) # 白色填充
+    elif outer_shape_type == 'ellipse':
+        draw_context.ellipse(bbox, fill=255)
+    else: # 处理不支持的形状
+        logging.warning("不支持的外框形状: %s。默认使用矩形遮罩。", outer_shape_type)
+        draw_context.rectangle(bbox, fill=255)
+
+def build_masks(image_size, inner_size, inner_corner_radius_px, outer_shape_type, inner_shape_type):
+    """
+    生成 (border_mask, inner_mask)，均为 'L' 模式。
+    border_mask 覆盖整张画布 (外框形状挖掉内框形状)；inner_mask 只有内框 bbox 大小
+    (Pillow 的 bbox 右/下边界是包含的，故宽高各 +1)，内框不存在时为 None。
+    """
+    canvas_width_px, canvas_height_px = image_size
+    inner_width_px, inner_height_px = inner_size
+    # 将内框居中
+    inner_x0 = round((canvas_width_px - inner_width_px) / 2.0)
+    inner_y0 = round((canvas_height_px - inner_height_px) / 2.0)
+    inner_box = (inner_x0, inner_y0, inner_x0 + inner_width_px + 1, inner_y0 + inner_height_px + 1)
+    outer_bbox = [0, 0, canvas_width_px, canvas_height_px]
+
+    # 创建内框遮罩 (在局部坐标中绘制白色内框形状)
+    inner_mask = None
+    if inner_width_px > 0 and inner_height_px > 0:
+        inner_mask = Image.new('L', (inner_width_px + 1, inner_height_px + 1), 0) # 黑色背景
+        _draw_inner_shape(ImageDraw.Draw(inner_mask), [0, 0, inner_width_px, inner_height_px],
+                          inner_shape_type, inner_corner_radius_px)
+
+    # 创建边框遮罩 (外框形状挖掉内框形状的区域)
+    border_mask = Image.new('L', image_size, 0) # 'L' 模式 (灰度), 黑色背景
+    # 在遮罩上绘制白色外框形状
+    _draw_outer_shape(ImageDraw.Draw(border_mask), outer_bbox, outer_shape_type)
+    # 用内框遮罩挖洞 (填充为黑色)，无需再次绘制内框形状
+    if inner_mask is not None:
+        border_mask.paste(0, inner_box, inner_mask)
+    return border_mask, inner_mask
+
+def _masks_nbytes(masks):
+    """遮罩占用的字节数 ('L' 模式每像素1字节)"""
+    return sum(mask.width * mask.height for mask in masks if mask is not None)
+
+def get_masks(image_size, inner_size, inner_corner_radius_px, outer_shape_type, inner_shape_type):
+    """通过 MASK_CACHE 获取 build_masks 的结果，键为像素几何参数"""
+    radius_key = inner_corner_radius_px if inner_shape_type == 'rectangle' else 0 # 圆角只对矩形内框有效
+    key = (tuple(image_size), tuple(inner_size), radius_key, outer_shape_type, inner_shape_type)
+    return MASK_CACHE.get_or_create(
+        key, lambda: build_masks(image_size, inner_size, inner_corner_radius_px, outer_shape_type, inner_shape_type),
+        _masks_nbytes)
 
 # --- 核心图像生成函数 (修改后) ---
 def create_bordered_image( # 轻微重命名，移除 'interactive'
@@ -70,15 +409,17 @@ def create_bordered_image( # 轻微重命名，移除 'interactive'
     outer_border_pattern_spacing_px: int, outer_stroke_color: tuple or None, outer_stroke_width_px: int,
     inner_fill_type: str, inner_fill_color1: tuple, inner_fill_color2: tuple or None,
     inner_fill_pattern_spacing_px: int, inner_stroke_color: tuple or None, inner_stroke_width_px: int,
-    diagonal_line_width_px: int
+    diagonal_line_width_px: int,
+    canvas_mode: str = 'RGBA' # 'RGBA'，或 'L' (所有颜色参数均为调色板下标，见 style_palette)
 ) -> Image.Image | None: # 返回 PIL Image 对象或在失败时返回 None
     """
     根据提供的像素尺寸和样式参数生成带边框的图像。
     返回一个 PIL Image 对象，如果发生错误则返回 None。
+    canvas_mode='L' 时返回的是调色板下标图像 (下标0为透明)，由 to_palette_image 转为 'P' 模式。
     """
     canvas_width_px = outer_width_px
     canvas_height_px = outer_height_px
-    logging.info(f"开始生成图像: 画布={canvas_width_px}x{canvas_height_px}px, 内框={inner_width_px}x{inner_height_px}px")
+    logging.debug("开始生成图像: 画布=%sx%spx, 内框=%sx%spx", canvas_width_px, canvas_height_px, inner_width_px, inner_height_px)
 
     # --- 参数验证 (从原始脚本复制并调整，使用 logging) ---
     if canvas_width_px <= 0 or canvas_height_px <= 0: logging.error("无效的画布尺寸。"); return None
@@ -96,7 +437,6 @@ def create_bordered_image( # 轻微重命名，移除 'interactive'
     inner_y1 = inner_y0 + inner_height_px
 
     # 定义绘图用的边界框 (Pillow 通常使用 [x0, y0, x1, y1])
-    outer_bbox = [0, 0, canvas_width_px, canvas_height_px]
     inner_bbox = [inner_x0, inner_y0, inner_x1, inner_y1]
 
     has_valid_inner_area = (inner_width_px > 0 and inner_height_px > 0) # 内框是否有有效面积
@@ -112,146 +452,249 @@ def create_bordered_image( # 轻微重命名，移除 'interactive'
     elif not has_valid_inner_area: # 如果没有内框，圆角无意义
         inner_corner_radius_px = 0
 
+    # 边框遮罩所覆盖的区域，用于限制图案的绘制范围
+    border_regions = border_band_regions((canvas_width_px, canvas_height_px), inner_bbox, inner_shape_type,
+                                         inner_corner_radius_px, has_valid_inner_area)
+    # 内框遮罩只覆盖内框 bbox (Pillow 的 bbox 右/下边界是包含的，故 +1)
+    inner_box = (inner_x0, inner_y0, inner_x1 + 1, inner_y1 + 1)
+
     # --- 创建图像和遮罩 (Masks) (从原始脚本复制并调整) ---
     try:
-        image = Image.new('RGBA', (canvas_width_px, canvas_height_px), (0, 0, 0, 0)) # 创建透明画布
+        with task_metrics.stage("canvas"):
+            image = Image.new(canvas_mode, (canvas_width_px, canvas_height_px), 0) # 创建透明画布
         image_size = (canvas_width_px, canvas_height_px)
         draw = ImageDraw.Draw(image)
 
-        # 创建边框遮罩 (外框形状挖掉内框形状的区域)
-        border_mask = Image.new('L', image_size, 0) # 'L' 模式 (灰度), 黑色背景
-        border_mask_draw = ImageDraw.Draw(border_mask)
-        # 在遮罩上绘制白色外框形状
-        if outer_shape_type == 'rectangle':
-            border_mask_draw.rectangle(outer_bbox, fill=255) # 白色填充
-        elif outer_shape_type == 'ellipse':
-            border_mask_draw.ellipse(outer_bbox, fill=255)
-        else: # 处理不支持的形状
-            logging.warning(f"不支持的外框形状: {outer_shape_type}。默认使用矩形遮罩。")
-            border_mask_draw.rectangle(outer_bbox, fill=255)
-
-        # 如果有内框区域，在边框遮罩上挖掉内框形状 (填充为黑色)
-        if has_valid_inner_area:
-            if inner_shape_type == 'rectangle':
-                if inner_corner_radius_px > 0: # 使用圆角矩形
-                    border_mask_draw.rounded_rectangle(inner_bbox, radius=inner_corner_radius_px, fill=0) # 黑色填充 (挖洞)
-                else: # 使用普通矩形
-                    border_mask_draw.rectangle(inner_bbox, fill=0)
-            elif inner_shape_type == 'ellipse':
-                border_mask_draw.ellipse(inner_bbox, fill=0)
-            else: # 处理不支持的形状
-                logging.warning(f"不支持的内框形状: {inner_shape_type}。默认使用矩形挖洞。")
-                border_mask_draw.rectangle(inner_bbox, fill=0)
-
-        # 创建内框遮罩 (内框形状的区域)
-        inner_mask = None
-        if has_valid_inner_area:
-            inner_mask = Image.new('L', image_size, 0) # 黑色背景
-            inner_mask_draw = ImageDraw.Draw(inner_mask)
-            # 在遮罩上绘制白色内框形状
-            if inner_shape_type == 'rectangle':
-                if inner_corner_radius_px > 0:
-                    inner_mask_draw.rounded_rectangle(inner_bbox, radius=inner_corner_radius_px, fill=255) # 白色填充
-                else:
-                    inner_mask_draw.rectangle(inner_bbox, fill=255)
-            elif inner_shape_type == 'ellipse':
-                inner_mask_draw.ellipse(inner_bbox, fill=255)
-            else: # 处理不支持的形状
-                logging.warning(f"不支持的内框形状: {inner_shape_type}。默认使用矩形内框遮罩。")
-                inner_mask_draw.rectangle(inner_bbox, fill=255)
-
+        # 获取边框遮罩和内框遮罩 (几何参数相同的请求共享缓存中的遮罩，不得修改)
+        with task_metrics.stage("masks"):
+            border_mask, inner_mask = get_masks(image_size, (inner_width_px, inner_height_px), inner_corner_radius_px,
+                                                outer_shape_type, inner_shape_type)
 
         # --- 绘制边框填充 (使用边框遮罩) ---
         # 检查边框是否可见、颜色是否有效 (RGBA 且 alpha > 0)
-        if has_visible_border and outer_border_color1 and isinstance(outer_border_color1, tuple) and len(outer_border_color1) == 4 and outer_border_color1[3] > 0:
+        if has_visible_border and _is_drawable_color(outer_border_color1):
             if outer_border_type == 'solid':
-                # 创建纯色图层，并使用 border_mask 将其粘贴到主图像上
-                border_layer = Image.new('RGBA', image_size, outer_border_color1)
-                image.paste(border_layer, (0, 0), border_mask)
+                # 只在边框带区域内逐带粘贴纯色，无需创建整幅纯色图层
+                for region in border_regions:
+                    paste_masked(image, region, border_mask, (0, 0), solid_band_renderer(outer_border_color1, region[2] - region[0]))
             elif outer_border_type in ['diagonal', 'checkerboard']:
-                # 创建透明的图案图层
-                border_pattern_layer = Image.new('RGBA', image_size, (0,0,0,0))
-                border_pattern_draw = ImageDraw.Draw(border_pattern_layer)
-                # 绘制图案
-                if outer_border_type == 'diagonal':
-                    space_px = max(1, outer_border_pattern_spacing_px)
-                    line_px = max(1, diagonal_line_width_px)
-                    # 确保 color2 也是有效的元组或 None
-                    valid_color2 = outer_border_color2 if isinstance(outer_border_color2, tuple) and len(outer_border_color2) == 4 else None
-                    draw_diagonal_lines(border_pattern_draw, image_size, outer_border_color1, valid_color2, space_px, line_px)
-                elif outer_border_type == 'checkerboard':
-                    check_px = max(1, outer_border_pattern_spacing_px)
-                    valid_color2 = outer_border_color2 if isinstance(outer_border_color2, tuple) and len(outer_border_color2) == 4 else (0,0,0,0) # Provide default transparent if None
-                    draw_checkerboard(border_pattern_draw, image_size, outer_border_color1, valid_color2, check_px)
-                # 使用 border_mask 将图案图层粘贴到主图像上
-                image.paste(border_pattern_layer, (0, 0), border_mask)
+                # 只在边框带区域内逐带生成图案并粘贴，避免整幅图案图层
+                for region in border_regions:
+                    paste_masked(image, region, border_mask, (0, 0), functools.partial(
+                        render_pattern_layer, outer_border_type, image_size, outer_border_color1, outer_border_color2,
+                        outer_border_pattern_spacing_px, diagonal_line_width_px))
             else:
-                logging.warning(f"不支持的边框填充类型: {outer_border_type}。边框未绘制。")
+                logging.warning("不支持的边框填充类型: %s。边框未绘制。", outer_border_type)
 
-        # --- 绘制内框填充 (使用内框遮罩) ---
+        # --- 绘制内框填充 (使用内框遮罩，只作用于内框 bbox 区域) ---
         # 检查内框是否存在、遮罩是否存在、颜色是否有效
-        if has_valid_inner_area and inner_mask and inner_fill_color1 and isinstance(inner_fill_color1, tuple) and len(inner_fill_color1) == 4 and inner_fill_color1[3] > 0:
+        if has_valid_inner_area and inner_mask and _is_drawable_color(inner_fill_color1):
             if inner_fill_type == 'solid':
-                inner_fill_layer = Image.new('RGBA', image_size, inner_fill_color1)
-                image.paste(inner_fill_layer, (0, 0), inner_mask)
+                paste_masked(image, inner_box, inner_mask, inner_box[:2], solid_band_renderer(inner_fill_color1, inner_box[2] - inner_box[0]))
             elif inner_fill_type in ['diagonal', 'checkerboard']:
-                inner_pattern_layer = Image.new('RGBA', image_size, (0,0,0,0))
-                inner_pattern_draw = ImageDraw.Draw(inner_pattern_layer)
-                if inner_fill_type == 'diagonal':
-                    space_px = max(1, inner_fill_pattern_spacing_px)
-                    line_px = max(1, diagonal_line_width_px)
-                    valid_color2 = inner_fill_color2 if isinstance(inner_fill_color2, tuple) and len(inner_fill_color2) == 4 else None
-                    draw_diagonal_lines(inner_pattern_draw, image_size, inner_fill_color1, valid_color2, space_px, line_px)
-                elif inner_fill_type == 'checkerboard':
-                    check_px = max(1, inner_fill_pattern_spacing_px)
-                    valid_color2 = inner_fill_color2 if isinstance(inner_fill_color2, tuple) and len(inner_fill_color2) == 4 else (0,0,0,0)
-                    draw_checkerboard(inner_pattern_draw, image_size, inner_fill_color1, valid_color2, check_px)
-                image.paste(inner_pattern_layer, (0, 0), inner_mask)
+                paste_masked(image, inner_box, inner_mask, inner_box[:2], functools.partial(
+                    render_pattern_layer, inner_fill_type, image_size, inner_fill_color1, inner_fill_color2,
+                    inner_fill_pattern_spacing_px, diagonal_line_width_px))
             else:
-                 logging.warning(f"不支持的内框填充类型: {inner_fill_type}。内框填充未绘制。")
-
-        # --- 绘制内框描边 ---
-        if has_valid_inner_area and inner_stroke_color and isinstance(inner_stroke_color, tuple) and len(inner_stroke_color) == 4 and inner_stroke_color[3] > 0 and inner_stroke_width_px > 0:
-            try:
-                # 计算描边用的边界框 (比内框稍大)
-                offset = inner_stroke_width_px / 2.0
-                stroke_x0 = inner_x0 - offset
-                stroke_y0 = inner_y0 - offset
-                stroke_x1 = inner_x1 + offset
-                stroke_y1 = inner_y1 + offset
-                # 使用 [x0, y0, x1, y1] 格式
-                stroke_bbox = [round(stroke_x0), round(stroke_y0), round(stroke_x1), round(stroke_y1)]
-
-                # 确保描边边界框有效
-                if stroke_bbox[0] < stroke_bbox[2] and stroke_bbox[1] < stroke_bbox[3]:
-                    if inner_shape_type == 'rectangle':
-                        stroke_radius = inner_corner_radius_px + offset # 相应调整圆角半径
-                        stroke_radius = max(0, round(stroke_radius))
-                        # 直接在主画布上绘制描边轮廓
-                        draw.rounded_rectangle(stroke_bbox, radius=stroke_radius, outline=inner_stroke_color, width=inner_stroke_width_px)
-                    elif inner_shape_type == 'ellipse':
-                        draw.ellipse(stroke_bbox, outline=inner_stroke_color, width=inner_stroke_width_px)
-            except Exception as e:
-                logging.error(f"绘制内框描边失败: {e}")
-
-        # --- 绘制外框描边 ---
-        if outer_stroke_color and isinstance(outer_stroke_color, tuple) and len(outer_stroke_color) == 4 and outer_stroke_color[3] > 0 and outer_stroke_width_px > 0:
-            try:
-                outer_stroke_bbox = [0, 0, canvas_width_px, canvas_height_px]
-                if outer_shape_type == 'rectangle':
-                    draw.rectangle(outer_stroke_bbox, outline=outer_stroke_color, width=outer_stroke_width_px)
-                elif outer_shape_type == 'ellipse':
-                    draw.ellipse(outer_stroke_bbox, outline=outer_stroke_color, width=outer_stroke_width_px)
-            except Exception as e:
-                logging.error(f"绘制外框描边失败: {e}")
+                 logging.warning("不支持的内框填充类型: %s。内框填充未绘制。", inner_fill_type)
+
+        with task_metrics.stage("stroke"):
+            # --- 绘制内框描边 ---
+            if has_valid_inner_area and _is_drawable_color(inner_stroke_color) and inner_stroke_width_px > 0:
+                try:
+                    # 计算描边用的边界框 (比内框稍大)
+                    offset = inner_stroke_width_px / 2.0
+                    stroke_x0 = inner_x0 - offset
+                    stroke_y0 = inner_y0 - offset
+                    stroke_x1 = inner_x1 + offset
+                    stroke_y1 = inner_y1 + offset
+                    # 使用 [x0, y0, x1, y1] 格式
+                    stroke_bbox = [round(stroke_x0), round(stroke_y0), round(stroke_x1), round(stroke_y1)]
+
+                    # 确保描边边界框有效
+                    if stroke_bbox[0] < stroke_bbox[2] and stroke_bbox[1] < stroke_bbox[3]:
+                        if inner_shape_type == 'rectangle':
+                            stroke_radius = inner_corner_radius_px + offset # 相应调整圆角半径
+                            stroke_radius = max(0, round(stroke_radius))
+                            # 直接在主画布上绘制描边轮廓
+                            draw.rounded_rectangle(stroke_bbox, radius=stroke_radius, outline=inner_stroke_color, width=inner_stroke_width_px)
+                        elif inner_shape_type == 'ellipse':
+                            draw.ellipse(stroke_bbox, outline=inner_stroke_color, width=inner_stroke_width_px)
+                except Exception as e:
+                    logging.error("绘制内框描边失败: %s", e)
 
-        logging.info("图像生成完成。")
+            # --- 绘制外框描边 ---
+            if _is_drawable_color(outer_stroke_color) and outer_stroke_width_px > 0:
+                try:
+                    outer_stroke_bbox = [0, 0, canvas_width_px, canvas_height_px]
+                    if outer_shape_type == 'rectangle':
+                        draw.rectangle(outer_stroke_bbox, outline=outer_stroke_color, width=outer_stroke_width_px)
+                    elif outer_shape_type == 'ellipse':
+                        draw.ellipse(outer_stroke_bbox, outline=outer_stroke_color, width=outer_stroke_width_px)
+                except Exception as e:
+                    logging.error("绘制外框描边失败: %s", e)
+
+        logging.debug("图像生成完成。")
         return image # 返回 PIL Image 对象
 
     except Exception as e:
-        logging.exception(f"图像创建过程中发生错误: {e}") # 记录完整的 traceback
+        logging.exception("图像创建过程中发生错误: %s", e) # 记录完整的 traceback
         return None
 
+def iter_bordered_bands(
+    outer_width_px: int, outer_height_px: int,
+    inner_width_px: int, inner_height_px: int,
+    inner_corner_radius_px: int,
+    outer_shape_type: str, inner_shape_type: str,
+    outer_border_type: str, outer_border_color1, outer_border_color2,
+    outer_border_pattern_spacing_px: int, outer_stroke_color, outer_stroke_width_px: int,
+    inner_fill_type: str, inner_fill_color1, inner_fill_color2,
+    inner_fill_pattern_spacing_px: int, inner_stroke_color, inner_stroke_width_px: int,
+    diagonal_line_width_px: int,
+    canvas_mode: str = 'RGBA',
+    band_rows: int = FILL_BAND_ROWS
+):
+    """
+    与 create_bordered_image 参数相同、输出逐像素一致，但按水平带逐条生成画布:
+    依次产出 (top, band)，band 为画布第 [top, top + band_rows) 行 (宽度为整个画布)。
+    遮罩、图案图层都只按带的大小生成 (不使用遮罩缓存)，峰值内存为 O(带高 × 宽)，与画布高度无关。
+    参数无效时抛出 ValueError。
+    """
+    width, height = outer_width_px, outer_height_px
+    if width <= 0 or height <= 0: raise ValueError("无效的画布尺寸。")
+    if inner_width_px < 0 or inner_height_px < 0: raise ValueError("内框尺寸不能为负数。")
+    band_rows = max(1, band_rows)
+    inner_corner_radius_px = max(0, inner_corner_radius_px)
+    outer_stroke_width_px = max(1, outer_stroke_width_px) # 描边至少1像素
+    inner_stroke_width_px = max(1, inner_stroke_width_px)
+    diagonal_line_width_px = max(1, diagonal_line_width_px)
+    image_size = (width, height)
+
+    # 坐标计算与 create_bordered_image 相同
+    inner_x0 = round((width - inner_width_px) / 2.0)
+    inner_y0 = round((height - inner_height_px) / 2.0)
+    inner_x1 = inner_x0 + inner_width_px
+    inner_y1 = inner_y0 + inner_height_px
+    has_valid_inner_area = (inner_width_px > 0 and inner_height_px > 0)
+    has_visible_border = (width - inner_width_px) / 2.0 > 0 or (height - inner_height_px) / 2.0 > 0
+    if has_valid_inner_area and inner_shape_type == 'rectangle':
+        inner_corner_radius_px = max(0, round(min(inner_corner_radius_px, inner_width_px / 2.0, inner_height_px / 2.0)))
+    elif not has_valid_inner_area:
+        inner_corner_radius_px = 0
+
+    draw_border = has_visible_border and _is_drawable_color(outer_border_color1)
+    if draw_border and outer_border_type not in ('solid', 'diagonal', 'checkerboard'):
+        logging.warning("不支持的边框填充类型: %s。边框未绘制。", outer_border_type)
+        draw_border = False
+    draw_inner = has_valid_inner_area and _is_drawable_color(inner_fill_color1)
+    if draw_inner and inner_fill_type not in ('solid', 'diagonal', 'checkerboard'):
+        logging.warning("不支持的内框填充类型: %s。内框填充未绘制。", inner_fill_type)
+        draw_inner = False
+    inner_stroke_bbox = None
+    if has_valid_inner_area and _is_drawable_color(inner_stroke_color) and inner_shape_type in ('rectangle', 'ellipse'):
+        offset = inner_stroke_width_px / 2.0
+        inner_stroke_bbox = [round(inner_x0 - offset), round(inner_y0 - offset), round(inner_x1 + offset), round(inner_y1 + offset)]
+        if not (inner_stroke_bbox[0] < inner_stroke_bbox[2] and inner_stroke_bbox[1] < inner_stroke_bbox[3]):
+            inner_stroke_bbox = None
+    draw_outer_stroke = _is_drawable_color(outer_stroke_color) and outer_shape_type in ('rectangle', 'ellipse')
+
+    def fill_layer(fill_type, color1, color2, spacing_px, box):
+        if fill_type == 'solid':
+            return Image.new(_layer_mode(color1), (box[2] - box[0], box[3] - box[1]), color1)
+        return render_pattern_layer(fill_type, image_size, color1, color2, spacing_px, diagonal_line_width_px, box=box)
+
+    for top in range(0, height, band_rows):
+        rows = min(band_rows, height - top)
+        box = (0, top, width, top + rows)
+        with task_metrics.stage("canvas"):
+            band = Image.new(canvas_mode, (width, rows), 0)
+        draw = ImageDraw.Draw(band)
+        # 遮罩: 在带坐标系中绘制 (内框 bbox 的右/下边界是包含的)
+        inner_mask = border_mask = None
+        with task_metrics.stage("masks"):
+            if has_valid_inner_area and inner_y0 < top + rows and inner_y1 >= top:
+                inner_mask = Image.new('L', (width, rows), 0)
+                _draw_inner_shape(ImageDraw.Draw(inner_mask), [inner_x0, inner_y0 - top, inner_x1, inner_y1 - top],
+                                  inner_shape_type, inner_corner_radius_px)
+            if draw_border:
+                border_mask = Image.new('L', (width, rows), 0)
+                _draw_outer_shape(ImageDraw.Draw(border_mask), [0, -top, width, height - top], outer_shape_type)
+                if inner_mask is not None:
+                    border_mask.paste(0, (0, 0, width, rows), inner_mask)
+                if border_mask.getbbox() is None:
+                    border_mask = None
+
+        if border_mask is not None:
+            with task_metrics.stage("pattern"):
+                layer = fill_layer(outer_border_type, outer_border_color1, outer_border_color2,
+                                   outer_border_pattern_spacing_px, box)
+            with task_metrics.stage("paste"):
+                band.paste(layer, (0, 0), border_mask)
+        if draw_inner and inner_mask is not None:
+            with task_metrics.stage("pattern"):
+                layer = fill_layer(inner_fill_type, inner_fill_color1, inner_fill_color2, inner_fill_pattern_spacing_px, box)
+            with task_metrics.stage("paste"):
+                band.paste(layer, (0, 0), inner_mask)
+
+        # 描边: 坐标平移到带坐标系，超出带的部分由 Pillow 裁剪
+        with task_metrics.stage("stroke"):
+            if inner_stroke_bbox is not None and inner_stroke_bbox[1] - inner_stroke_width_px < top + rows \
+                    and inner_stroke_bbox[3] + inner_stroke_width_px >= top:
+                stroke_bbox = [inner_stroke_bbox[0], inner_stroke_bbox[1] - top, inner_stroke_bbox[2], inner_stroke_bbox[3] - top]
+                if inner_shape_type == 'rectangle':
+                    stroke_radius = max(0, round(inner_corner_radius_px + inner_stroke_width_px / 2.0))
+                    draw.rounded_rectangle(stroke_bbox, radius=stroke_radius, outline=inner_stroke_color, width=inner_stroke_width_px)
+                else:
+                    draw.ellipse(stroke_bbox, outline=inner_stroke_color, width=inner_stroke_width_px)
+            if draw_outer_stroke:
+                outer_stroke_bbox = [0, -top, width, height - top]
+                if outer_shape_type == 'rectangle':
+                    draw.rectangle(outer_stroke_bbox, outline=outer_stroke_color, width=outer_stroke_width_px)
+                else:
+                    draw.ellipse(outer_stroke_bbox, outline=outer_stroke_color, width=outer_stroke_width_px)
+        yield top, band
+
+# --- 调色板输出 ---
+
+# 样式参数中的颜色字段
+STYLE_COLOR_KEYS = ("outer_border_color1", "outer_border_color2", "outer_stroke_color",
+                    "inner_fill_color1", "inner_fill_color2", "inner_stroke_color")
+
+def style_palette(style_params: dict) -> list | None:
+    """
+    返回样式的调色板 [(0, 0, 0, 0), 颜色1, 颜色2, ...]: 下标0为完全透明，其后为样式中所有可见颜色 (去重)。
+    单色样式 (只有一种可见颜色) 的调色板只有两项，下标图像即为覆盖遮罩。
+    绘制时不做抗锯齿、遮罩只有 0/255，因此输出像素只可能是这些颜色之一。
+    颜色超过 256 种时返回 None (只能输出 RGBA)。
+    """
+    palette = [(0, 0, 0, 0)]
+    for key in STYLE_COLOR_KEYS:
+        color = style_params.get(key)
+        if _is_drawable_color(color) and color not in palette:
+            palette.append(color)
+    return palette if len(palette) <= 256 else None
+
+def palette_indices(style_params: dict, palette: list) -> dict:
+    """把样式参数中的颜色替换为调色板下标 (不可见的颜色为0)，返回替换后的颜色字段"""
+    return {key: palette.index(style_params.get(key)) if _is_drawable_color(style_params.get(key)) else 0
+            for key in STYLE_COLOR_KEYS}
+
+def to_palette_image(index_image: Image.Image, palette: list) -> Image.Image:
+    """
+    把 canvas_mode='L' 生成的下标图像原地转为 'P' 模式: 写入 PLTE (RGB) 和 tRNS (每项的 alpha)。
+    调色板只包含实际用到的项数，编码器会据此选择 1/2/4/8 位的位深。
+    """
+    index_image.putpalette(bytes(channel for color in palette for channel in color[:3]), 'RGB')
+    index_image.info['transparency'] = bytes(color[3] for color in palette)
+    return index_image
+
+def to_rgba_image(index_image: Image.Image, palette: list) -> Image.Image:
+    """
+    在编码时按调色板把下标图像展开为 RGBA (查表，与直接绘制 RGBA 的结果逐像素一致)。
+    单色样式的下标图像就是 0/1 遮罩，颜色在这里才被附加上去。
+    """
+    return to_palette_image(index_image, palette).convert('RGBA')
+
 # --- 预定义的样式参数 (供 main.py 使用) ---
 STYLE1_PARAMS = {
     "outer_border_type": 'diagonal',                    # 外框填充: 斜线
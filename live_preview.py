@@ -0,0 +1,110 @@
+# live_preview.py
+# -*- coding: utf-8 -*-
+"""
+实时预览会话 (与 Web 框架无关): 只渲染最新的参数。
+- 防抖: 收到参数后等待 debounce_seconds 内没有新参数才开始渲染，期间被覆盖的参数直接丢弃；
+- 取消: 渲染过程中收到新参数时取消当前渲染 (工作池中尚未开始的任务随之取消)；
+- 只发送最新结果: 渲染完成后才发送，发送过程不会被打断。
+因此服务端 CPU 开销与用户实际看到的预览数量成正比，而不是与输入事件数量成正比。
+"""
+
+import asyncio
+import logging
+import threading
+
+
+class LivePreviewStats:
+    """所有会话共享的计数器"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sessions = 0
+        self.active_sessions = 0
+        self.updates = 0      # 收到的参数更新
+        self.debounced = 0    # 防抖期间被覆盖而未渲染的更新
+        self.cancelled = 0    # 渲染中被新参数取消的更新
+        self.delivered = 0    # 已发送结果的更新
+
+    def add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": self.sessions,
+                "active_sessions": self.active_sessions,
+                "updates": self.updates,
+                "debounced": self.debounced,
+                "cancelled": self.cancelled,
+                "delivered": self.delivered,
+            }
+
+
+LIVE_PREVIEW_STATS = LivePreviewStats()
+
+
+class PreviewSession:
+    """
+    一个连接上的预览会话。
+    render(update) 为协程，返回渲染结果 (可被取消)；deliver(update, result) 为协程，把结果发送给客户端。
+    调用者在一个任务中运行 run()，每收到一次参数调用 submit()，连接关闭时取消 run() 所在的任务。
+    """
+
+    def __init__(self, render, deliver, debounce_seconds: float = 0.05, stats: LivePreviewStats = LIVE_PREVIEW_STATS):
+        self.render = render
+        self.deliver = deliver
+        self.debounce_seconds = max(0.0, debounce_seconds)
+        self.stats = stats
+        self._pending = None # 尚未开始渲染的最新参数
+        self._job = None # 正在渲染的任务
+        self._wakeup = asyncio.Event()
+
+    def submit(self, update):
+        """提交新参数: 覆盖尚未渲染的参数，并取消正在进行的渲染"""
+        self.stats.add(updates=1)
+        if self._pending is not None:
+            self.stats.add(debounced=1)
+        self._pending = update
+        if self._job is not None and not self._job.done():
+            self._job.cancel()
+        self._wakeup.set()
+
+    async def _debounce(self):
+        """等待参数稳定: debounce_seconds 内没有新的 submit()"""
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.debounce_seconds)
+            except asyncio.TimeoutError:
+                return
+
+    async def run(self):
+        self.stats.add(sessions=1, active_sessions=1)
+        try:
+            while True:
+                await self._wakeup.wait()
+                await self._debounce()
+                update, self._pending = self._pending, None
+                if update is None:
+                    continue
+                self._job = asyncio.create_task(self.render(update))
+                try:
+                    # asyncio.wait 不会因 _job 被取消而抛出异常，只有 run() 本身被取消时才会
+                    await asyncio.wait({self._job})
+                except asyncio.CancelledError:
+                    self._job.cancel()
+                    raise
+                if self._job.cancelled():
+                    self.stats.add(cancelled=1)
+                    continue
+                if self._job.exception() is not None:
+                    logging.error("实时预览渲染失败: %r", self._job.exception())
+                    continue
+                result = self._job.result()
+                self._job = None
+                await self.deliver(update, result)
+                self.stats.add(delivered=1)
+        finally:
+            self.stats.add(active_sessions=-1)
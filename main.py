@@ -1,117 +1,490 @@
 # main.py
 # -*- coding: utf-8 -*-
-from fastapi import FastAPI, Form, HTTPException, Request # 从 FastAPI 导入所需组件
-from fastapi.responses import StreamingResponse, HTMLResponse # 用于返回流式响应(图片)和HTML响应
+from fastapi import FastAPI, Form, HTTPException, Request, WebSocket, WebSocketDisconnect # 从 FastAPI 导入所需组件
+from fastapi.responses import HTMLResponse, PlainTextResponse, Response, StreamingResponse # 用于返回HTML响应、图像响应和流式响应
 from fastapi.staticfiles import StaticFiles # 用于提供静态文件服务
 # from fastapi.templating import Jinja2Templates # 如果需要模板引擎则取消注释
-from PIL import Image # 导入 Pillow 库
-import io # 用于内存中的字节流操作
+import asyncio
+import functools
 import logging
+import os
+import time
+from contextlib import aclosing, asynccontextmanager, contextmanager
+from typing import Literal
+
+from pydantic import BaseModel, Field, ValidationError
 
 # 从我们重构的模块中导入函数和样式参数
 from image_generator import (
-    mm_to_pixels,
-    pt_to_pixels,
-    create_bordered_image,
+    MASK_CACHE,
     STYLE1_PARAMS,
     STYLE2_PARAMS
 )
+from admission import AdmissionController, AdmissionTimeoutError, CostTooHighError
+from batch_stream import MultipartWriter, ZipStreamWriter
+from live_preview import LIVE_PREVIEW_STATS, PreviewSession
+from metrics import RenderMetrics, dpi_bucket, stats_lines
+from png_encoder import ENCODER_STATS, resolve_png_profile
+from profiler import ProfileSettings, profiled_call, profiled_iter
+import request_log
+from request_log import RequestLog, configure_logging
+from render_pool import RenderPool, PoolSaturatedError
+from render_service import (OUTPUT_FORMATS, estimate_render_cost, iter_png_chunks, png_encoding_fields, render_png,
+                            render_vector, uses_strip_encoder, RenderError, warm_up as warm_up_renderer)
+from scene import Scene, build_scene
+from response_cache import ResponseCache, make_cache_key, etag_for_key, if_none_match_hits
+
+# 配置日志: 记录经队列由后台线程格式化和输出，同一位置的警告限流
+LOG_HANDLER = configure_logging(
+    level=os.environ.get("BORDER_LOG_LEVEL", "INFO"),
+    queue_size=int(os.environ.get("BORDER_LOG_QUEUE", "10000")),
+    rate_limit=int(os.environ.get("BORDER_LOG_RATE_LIMIT", "10")),
+)
+# 每个单图请求一条汇总记录；预览、缓存命中和 304 的成功请求按比例抽样
+REQUEST_LOG = RequestLog(
+    sample_rate=float(os.environ.get("BORDER_LOG_SAMPLE_RATE", "1")),
+    slow_seconds=float(os.environ.get("BORDER_LOG_SLOW_MS", "1000")) / 1000.0,
+)
+
+# 渲染流水线的指标 (各阶段耗时、请求计数)，由 /metrics 以 Prometheus 文本格式导出
+RENDER_METRICS = RenderMetrics()
 
-# 配置日志
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+def observe_task_metrics(samples: list):
+    """工作池任务结束时汇总其指标样本 (编码统计 + Prometheus 指标)"""
+    ENCODER_STATS.observe(samples)
+    RENDER_METRICS.observe(samples)
+
+# 渲染工作池: 渲染和 PNG 编码在线程池 (或进程池) 中执行，不阻塞事件循环
+RENDER_POOL = RenderPool(
+    backend=os.environ.get("BORDER_RENDER_BACKEND", "thread").strip().lower(),
+    max_workers=int(os.environ["BORDER_RENDER_WORKERS"]) if os.environ.get("BORDER_RENDER_WORKERS") else None,
+    max_queue=int(os.environ["BORDER_RENDER_QUEUE"]) if os.environ.get("BORDER_RENDER_QUEUE") else None,
+    preload=("render_service",), # 进程池后端: 工作进程预先导入渲染模块
+    initializer=warm_up_renderer,
+    on_metrics=observe_task_metrics, # 汇总工作线程/进程中的各阶段耗时、编码耗时和输出大小
+)
+# 队列已满时 503 响应的 Retry-After (秒)
+RETRY_AFTER_SECONDS = int(os.environ.get("BORDER_RETRY_AFTER_SECONDS", "1"))
+# 准入控制: 按估计的峰值内存为每个渲染任务预留预算，总量为 单个工作线程/进程的预算 × 工作线程/进程数
+ADMISSION = AdmissionController(
+    worker_budget_bytes=int(os.environ.get("BORDER_WORKER_MEMORY_BYTES", str(512 * 1024 * 1024))),
+    workers=RENDER_POOL.max_workers,
+    max_render_seconds=float(os.environ.get("BORDER_MAX_RENDER_SECONDS", "60")),
+    max_waiting=int(os.environ.get("BORDER_ADMISSION_QUEUE", "64")),
+    wait_timeout=float(os.environ.get("BORDER_ADMISSION_TIMEOUT", "30")),
+)
+# 性能剖析 (可选): 设置 BORDER_PROFILE_DIR 以及抽样比例或慢任务阈值后启用，剖析文件与请求参数一起保存到该目录
+PROFILE_SETTINGS = ProfileSettings(
+    directory=os.environ.get("BORDER_PROFILE_DIR", ""),
+    sample_percent=float(os.environ.get("BORDER_PROFILE_SAMPLE_PERCENT", "0")),
+    slow_seconds=float(os.environ.get("BORDER_PROFILE_SLOW_SECONDS", "0")),
+    interval_seconds=float(os.environ.get("BORDER_PROFILE_INTERVAL_MS", "5")) / 1000.0,
+    keep=int(os.environ.get("BORDER_PROFILE_KEEP", "200")),
+)
+# 超出预算的请求: 'reject' 返回 413 (错误信息中给出可用的最大 DPI)，'preview' 降低到预算内的最大 DPI 并以预览返回
+OVERSIZE_POLICY = os.environ.get("BORDER_OVERSIZE_POLICY", "reject").strip().lower()
+# 单图/批量请求允许的最大 DPI (实际上限由准入控制按估计开销决定)
+MAX_DPI = int(os.environ.get("BORDER_MAX_DPI", "2400"))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 进程池后端: 启动时预先创建并预热所有工作进程
+    worker_pids = await asyncio.to_thread(RENDER_POOL.warm_up)
+    if worker_pids:
+        logging.info("渲染工作进程已预热: %s", worker_pids)
+    yield
+    RENDER_POOL.shutdown() # 应用关闭时释放工作线程/进程
 
 # 创建 FastAPI 应用实例
-app = FastAPI(title="图像生成器 API", description="根据参数生成带边框的图像")
+app = FastAPI(title="图像生成器 API", description="根据参数生成带边框的图像", lifespan=lifespan)
 
 # 挂载静态文件目录
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
+# 已编码图像的响应缓存: 内存层 + 可选磁盘层 (设置 BORDER_RESPONSE_CACHE_DIR 启用)
+RESPONSE_CACHE = ResponseCache(
+    max_bytes=int(os.environ.get("BORDER_RESPONSE_CACHE_BYTES", str(64 * 1024 * 1024))),
+    disk_dir=os.environ.get("BORDER_RESPONSE_CACHE_DIR") or None,
+    disk_max_bytes=int(os.environ.get("BORDER_RESPONSE_CACHE_DISK_BYTES", str(1024 * 1024 * 1024))),
+)
+# 图像响应的 Cache-Control 头 (相同参数总是得到相同的图像)
+CACHE_CONTROL = os.environ.get("BORDER_CACHE_CONTROL", "public, max-age=86400")
+
+# 批量生成: 单个请求的最大任务数，以及单个批次同时占用的渲染任务数 (默认等于工作池并发数，批次自身不会挤满队列)
+BATCH_MAX_JOBS = int(os.environ.get("BORDER_BATCH_MAX_JOBS", "500"))
+BATCH_CONCURRENCY = max(1, int(os.environ.get("BORDER_BATCH_CONCURRENCY", "0")) or RENDER_POOL.max_workers)
+BATCH_STYLES = {"style1": STYLE1_PARAMS, "style2": STYLE2_PARAMS}
+
+# 预览: 低分辨率 PNG (用于交互式显示)，可按屏幕尺寸进一步缩小；使用最快的编码配置档
+PREVIEW_DPI = int(os.environ.get("BORDER_PREVIEW_DPI", "96"))
+PREVIEW_MIN_DPI = 10
+PREVIEW_PNG_PROFILE = resolve_png_profile(os.environ.get("BORDER_PREVIEW_PNG_PROFILE", "fast"))
+# 实时预览 (WebSocket): 参数在该时间内没有变化才开始渲染
+PREVIEW_DEBOUNCE_SECONDS = float(os.environ.get("BORDER_PREVIEW_DEBOUNCE_MS", "50")) / 1000.0
+
+# 按水平带生成的大画布 (见 render_service.STRIP_MIN_PIXELS) 边压缩边发送，设为 0 时等待整张图像编码完成。
+# 只用于线程池后端: 进程池后端的 stream() 在工作进程中收集全部块后一次传回 (不经共享内存)，
+# 不如 RENDER_POOL.run(render_png) 经共享内存传回整张 PNG
+STREAM_PNG = os.environ.get("BORDER_STREAM_PNG", "1").strip().lower() not in ('0', 'false', 'off', 'no') \
+    and RENDER_POOL.backend == 'thread'
+
 # --- 辅助函数：处理请求并生成图像 ---
-def process_image_request(style_params: dict, dpi: int,
-                          outer_width_mm: float, outer_height_mm: float, outer_shape_type: str,
-                          inner_width_mm: float, inner_height_mm: float, inner_shape_type: str,
-                          inner_corner_radius_mm: float):
+def make_scene(style_params: dict,
+               outer_width_mm: float, outer_height_mm: float, outer_shape_type: str,
+               inner_width_mm: float, inner_height_mm: float, inner_shape_type: str,
+               inner_corner_radius_mm: float) -> Scene:
+    """校验参数并构建场景 (每个请求只做一次)，参数无效时抛出 400。"""
+    try:
+        return build_scene(style_params, outer_width_mm, outer_height_mm, outer_shape_type,
+                           inner_width_mm, inner_height_mm, inner_shape_type, inner_corner_radius_mm)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"输入参数无效: {ve}")
+
+async def process_image_request(scene: Scene, dpi: int, png_profile: str | None = None,
+                                output_format: str = "png") -> bytes:
     """
-    处理通用的计算和调用图像生成器的逻辑。
-    返回包含 PNG 图像数据的 BytesIO 流，或者抛出 HTTPException。
+    在渲染工作池中执行 render_service.render_png (矢量格式为 render_vector)，避免阻塞事件循环。
+    返回图像字节，或者抛出 HTTPException (队列已满时为 503 并带 Retry-After)。
     """
-    try:
-        # --- 1. 计算像素值 ---
-        logging.info("开始计算像素值...")
-        outer_width_px = mm_to_pixels(outer_width_mm, dpi)
-        outer_height_px = mm_to_pixels(outer_height_mm, dpi)
-        inner_width_px = mm_to_pixels(inner_width_mm, dpi)
-        inner_height_px = mm_to_pixels(inner_height_mm, dpi)
-        # 仅当内框是矩形时计算圆角像素值
-        inner_corner_radius_px = mm_to_pixels(inner_corner_radius_mm, dpi) if inner_shape_type == 'rectangle' else 0
-
-        # 计算样式特定参数的像素值
-        stroke_width_px = pt_to_pixels(style_params["stroke_width_pt"], dpi)
-        diagonal_line_width_px = pt_to_pixels(style_params["diagonal_line_width_pt"], dpi)
-        outer_border_pattern_spacing_px = mm_to_pixels(style_params["outer_border_pattern_spacing_mm"], dpi)
-        inner_fill_pattern_spacing_px = mm_to_pixels(style_params["inner_fill_pattern_spacing_mm"], dpi)
-        # 确保图案间距至少为1像素 (如果原始毫米值>0)
-        if style_params["outer_border_pattern_spacing_mm"] > 0 and outer_border_pattern_spacing_px < 1:
-             outer_border_pattern_spacing_px = 1
-        if style_params["inner_fill_pattern_spacing_mm"] > 0 and inner_fill_pattern_spacing_px < 1:
-             inner_fill_pattern_spacing_px = 1
-        logging.info(f"计算得到的像素: 外框={outer_width_px}x{outer_height_px}, 内框={inner_width_px}x{inner_height_px}, 圆角={inner_corner_radius_px}, 描边={stroke_width_px}")
-
-        # --- 2. 计算调整后的 DPI 以便精确保存 ---
-        adjusted_dpi_w = (outer_width_px * 25.4 / outer_width_mm) if outer_width_mm > 0 else float(dpi)
-        adjusted_dpi_h = (outer_height_px * 25.4 / outer_height_mm) if outer_height_mm > 0 else float(dpi)
-        logging.info(f"输入 DPI: {dpi}, 调整后保存 DPI (宽, 高): ({adjusted_dpi_w:.2f}, {adjusted_dpi_h:.2f})")
-
-        # --- 3. 调用核心图像生成函数 ---
-        logging.info(f"调用 create_bordered_image, 外形='{outer_shape_type}', 内形='{inner_shape_type}'")
-        image_obj = create_bordered_image(
-            outer_width_px=outer_width_px, outer_height_px=outer_height_px,
-            inner_width_px=inner_width_px, inner_height_px=inner_height_px,
-            inner_corner_radius_px=inner_corner_radius_px,
-            outer_shape_type=outer_shape_type, inner_shape_type=inner_shape_type,
-            # 直接从选定的样式字典传递样式参数
-            outer_border_type=style_params["outer_border_type"],
-            outer_border_color1=style_params["outer_border_color1"],
-            outer_border_color2=style_params["outer_border_color2"],
-            outer_border_pattern_spacing_px=outer_border_pattern_spacing_px,
-            outer_stroke_color=style_params["outer_stroke_color"],
-            outer_stroke_width_px=stroke_width_px, # 使用计算得到的像素值
-            inner_fill_type=style_params["inner_fill_type"],
-            inner_fill_color1=style_params["inner_fill_color1"],
-            inner_fill_color2=style_params["inner_fill_color2"],
-            inner_fill_pattern_spacing_px=inner_fill_pattern_spacing_px,
-            inner_stroke_color=style_params["inner_stroke_color"],
-            inner_stroke_width_px=stroke_width_px, # 使用计算得到的像素值
-            diagonal_line_width_px=diagonal_line_width_px # 使用计算得到的像素值
-        )
-
-        # 检查图像是否成功生成
-        if not isinstance(image_obj, Image.Image):
-            logging.error("核心函数 create_bordered_image 未返回有效的 Image 对象。")
-            raise HTTPException(status_code=500, detail="图像生成失败 (内部错误)")
-
-        # --- 4. 将图像保存到内存缓冲区 ---
-        logging.info("将图像保存到内存缓冲区...")
-        img_byte_arr = io.BytesIO() # 创建内存字节流对象
-        # 使用调整后的 DPI 保存为 PNG 格式
-        image_obj.save(img_byte_arr, format='PNG', dpi=(adjusted_dpi_w, adjusted_dpi_h))
-        img_byte_arr.seek(0) # 将流的位置重置到开头，以便读取
-        logging.info("图像已保存到内存。")
-        return img_byte_arr
+    cost = estimate_render_cost(scene, dpi, png_profile, output_format)
+    with render_errors():
+        release = await reserve(cost) # 预留估计的内存，预算不足时排队；任务在工作池中结束时才释放
+        started = time.perf_counter()
+        try:
+            if output_format != "png":
+                # 矢量输出直接使用毫米参数，与 DPI 和 PNG 编码配置档无关
+                return await RENDER_POOL.run(profiled(render_vector, scene, dpi, None, output_format), scene, output_format,
+                                             release=release)
+            return await RENDER_POOL.run(profiled(render_png, scene, dpi, png_profile), scene, dpi, png_profile=png_profile,
+                                         release=release)
+        finally:
+            request_log.timing("render", time.perf_counter() - started) # 工作池排队 + 渲染 + 编码
+
+def profiled(fn, scene: Scene, dpi: int, png_profile: str | None, output_format: str = "png", stream: bool = False):
+    """
+    启用性能剖析时把渲染函数包装为在工作线程/进程中采集剖析的调用 (记录请求参数)，未启用时原样返回 fn。
+    stream=True 用于 RenderPool.stream 的生成器函数。
+    """
+    if not PROFILE_SETTINGS.enabled:
+        return fn
+    params = {"scene": scene.cache_fields(), "dpi": dpi, "output_format": output_format,
+              "png_profile": resolve_png_profile(png_profile) if output_format == "png" else None}
+    return functools.partial(profiled_iter if stream else profiled_call, PROFILE_SETTINGS, params, fn)
 
+async def reserve(cost):
+    """
+    等待准入并按估计开销预留内存 (等待时间计入 admission 阶段)，返回释放预留的函数。
+    释放函数作为 release 交给 RenderPool.run / stream，在工作池中的任务真正结束时才调用:
+    等待方被取消 (客户端断开、实时预览被新参数取代) 后，已开始的渲染仍在占用内存，预留也随之保留。
+    """
+    started = time.perf_counter()
+    await ADMISSION.acquire(cost)
+    waited = time.perf_counter() - started
+    RENDER_METRICS.observe_stage("admission", waited)
+    request_log.timing("admission", waited)
+    return functools.partial(ADMISSION.release, cost)
+
+@contextmanager
+def render_errors():
+    """把渲染过程中的异常转换为 HTTPException (队列已满时为 503 并带 Retry-After)"""
+    try:
+        yield
+    except HTTPException:
+        raise
+    except (PoolSaturatedError, AdmissionTimeoutError) as pe:
+        logging.warning("渲染队列已满，拒绝请求: %s", pe)
+        raise HTTPException(status_code=503, detail="服务器繁忙，请稍后重试",
+                            headers={"Retry-After": str(RETRY_AFTER_SECONDS)})
+    except CostTooHighError as ce:
+        raise HTTPException(status_code=413, detail=f"图像过大: {ce}")
     except ValueError as ve: # 捕获像无效数字格式这样的特定错误
-        logging.error(f"处理过程中发生值错误: {ve}")
+        logging.error("处理过程中发生值错误: %s", ve)
         raise HTTPException(status_code=400, detail=f"输入参数无效: {ve}") # 返回 400 Bad Request
+    except RenderError as re:
+        raise HTTPException(status_code=500, detail=str(re))
     except Exception as e:
-        logging.exception(f"处理图像请求时发生意外错误: {e}") # 记录完整的错误堆栈
+        logging.exception("处理图像请求时发生意外错误: %s", e) # 记录完整的错误堆栈
         raise HTTPException(status_code=500, detail=f"图像生成时发生意外错误: {str(e)}") # 返回 500 Internal Server Error
 
+def admissible_dpi(scene: Scene, dpi: int, png_profile: str | None = None, output_format: str = "png",
+                   downscale: bool = False) -> int:
+    """
+    按估计开销 (render_service.estimate_render_cost) 检查请求能否被接受，返回实际使用的 DPI。
+    超出单个工作线程/进程的预算时: downscale=True 返回预算内的最大 DPI，否则抛出 413 (错误信息给出该 DPI)。
+    """
+    cost = estimate_render_cost(scene, dpi, png_profile, output_format)
+    if ADMISSION.fits(cost):
+        return dpi
+    # 开销随 DPI 单调增加，二分查找预算内的最大 DPI
+    best, low, high = None, PREVIEW_MIN_DPI, dpi - 1
+    while low <= high:
+        middle = (low + high) // 2
+        if ADMISSION.fits(estimate_render_cost(scene, middle, png_profile, output_format)):
+            best, low = middle, middle + 1
+        else:
+            high = middle - 1
+    if downscale and best is not None:
+        ADMISSION.add(downscaled=1)
+        logging.warning("估计开销超出预算 (内存 %.0f MB, CPU %.1f 秒)，DPI 由 %d 降为 %d",
+                        cost.peak_bytes / 2**20, cost.cpu_seconds, dpi, best)
+        return best
+    ADMISSION.add(oversized=1)
+    logging.warning("估计开销超出预算，拒绝请求: DPI=%d, 内存 %.0f MB, CPU %.1f 秒", dpi, cost.peak_bytes / 2**20, cost.cpu_seconds)
+    hint = f"，当前尺寸下可用的最大 DPI 为 {best}" if best is not None else ""
+    raise HTTPException(status_code=413, detail=f"图像过大: 预计需要 {cost.peak_bytes / 2**20:.0f} MB 内存、"
+                                                f"{cost.cpu_seconds:.1f} 秒 CPU 时间，超出服务器限制{hint}")
+
+def image_cache_key(scene: Scene, dpi: int, png_profile: str | None = None, output_format: str = "png") -> str:
+    """
+    由场景、输出格式、实际使用的编码配置档和编码路径 (像素格式、是否按水平带编码) 得到响应缓存键 (同时用作 ETag)。
+    矢量格式与 DPI 和编码配置档无关，不同 DPI 的请求共享同一个键。
+    """
+    vector = output_format != "png"
+    return make_cache_key(
+        scene=scene.cache_fields(), dpi=None if vector else dpi,
+        png_profile=None if vector else resolve_png_profile(png_profile), output_format=output_format,
+        png_encoding=None if vector else png_encoding_fields(scene, dpi),
+    )
+
+async def render_cached(cache_key: str, scene: Scene, dpi: int, png_profile: str | None = None,
+                        output_format: str = "png") -> bytes:
+    """先查询响应缓存，未命中时才通过 process_image_request 在工作池中渲染并编码，结果写回缓存。"""
+    body = await RESPONSE_CACHE.get(cache_key)
+    if body is not None:
+        request_log.note(cache="hit")
+        return body
+    request_log.note(cache="miss")
+    body = await process_image_request(scene, dpi, png_profile, output_format)
+    await RESPONSE_CACHE.put(cache_key, body)
+    return body
+
+async def stream_png_response(cache_key: str, scene: Scene, dpi: int, png_profile: str | None,
+                              headers: dict) -> StreamingResponse:
+    """
+    大画布的流式响应: 工作线程按水平带渲染并压缩，每得到一个 IDAT 块就发送给客户端，
+    客户端和代理无需等待整张图像编码完成即可开始接收。
+    ETag 由缓存键决定，因此响应头可以立即发送；发送完整的字节同时写入响应缓存。
+    """
+    cost = estimate_render_cost(scene, dpi, png_profile)
+    request_log.note(cache="miss", stream=True)
+
+    async def admitted_chunks():
+        # 预留的内存在工作池中的任务结束 (流结束，或客户端断开后工作线程停止) 时释放
+        release = await reserve(cost)
+        async with aclosing(RENDER_POOL.stream(profiled(iter_png_chunks, scene, dpi, png_profile, stream=True),
+                                             scene, dpi, png_profile, release=release)) as chunks:
+            async for chunk in chunks:
+                yield chunk
+
+    chunks = admitted_chunks()
+    started = time.perf_counter()
+    with render_errors():
+        # 第一个块 (PNG 文件头) 表示工作池已接受任务，之后才发送响应头
+        first = await chunks.__anext__()
+    request_log.timing("render", time.perf_counter() - started) # 其余块的耗时由 finish_after_body 补记
+
+    async def body():
+        parts = [first]
+        yield first
+        try:
+            async for chunk in chunks:
+                parts.append(chunk)
+                yield chunk
+        except Exception as e:
+            # 响应头已发送，只能中断连接
+            logging.exception("流式生成图像时发生错误，连接中断: %s", e)
+            raise
+        finally:
+            await chunks.aclose()
+        await RESPONSE_CACHE.put(cache_key, b"".join(parts))
+
+    return StreamingResponse(body(), media_type=OUTPUT_FORMATS["png"], headers=headers)
+
+def finish_after_body(response: Response, tracked, entry: request_log.RequestEntry) -> Response:
+    """
+    流式响应的请求在响应体发送完毕 (或中断) 时才结束: 推迟请求计数/耗时 (tracked) 和汇总记录 (entry)，
+    由包装后的响应体在结束时补记渲染耗时 (含发送)、字节数和结果。其他响应原样返回。
+    """
+    if not isinstance(response, StreamingResponse):
+        return response
+    tracked.deferred = entry.deferred = True
+    chunks = response.body_iterator
+
+    async def body():
+        started = time.perf_counter()
+        sent = 0
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    sent += len(chunk)
+                    yield chunk
+        except Exception:
+            tracked.status_code = entry.status_code = 500
+            raise
+        except BaseException: # 客户端断开
+            entry.fields["stream"] = "closed"
+            raise
+        finally:
+            entry.fields["bytes"] = sent
+            entry.timings["render"] = entry.timings.get("render", 0.0) + time.perf_counter() - started
+            RENDER_METRICS.finish_request(tracked)
+            REQUEST_LOG.finish(entry)
+
+    response.body_iterator = body()
+    return response
+
+def preview_dpi(scene: Scene, max_px: int | None = None) -> int:
+    """预览使用的 DPI: 不超过 PREVIEW_DPI，指定 max_px 时长边不超过 max_px 像素"""
+    dpi = PREVIEW_DPI
+    if max_px:
+        dpi = min(dpi, int(scene.fit_dpi(max_px)))
+    return max(PREVIEW_MIN_DPI, dpi)
+
+async def build_image_response(request: Request, scene: Scene, dpi: int, png_profile: str | None = None,
+                               output_format: str = "png", preview: bool = False,
+                               preview_max_px: int | None = None) -> Response:
+    """
+    按参数哈希查询响应缓存，未命中时渲染并编码。
+    响应带有强 ETag 和 Cache-Control；If-None-Match 匹配时直接返回 304。
+    preview=True 时忽略 dpi/png_profile/output_format，返回低分辨率 PNG 预览 (X-Preview-DPI 头为实际 DPI)。
+    """
+    extra_headers = {}
+    if preview:
+        dpi, png_profile, output_format = preview_dpi(scene, preview_max_px), PREVIEW_PNG_PROFILE, "png"
+        extra_headers["X-Preview-DPI"] = str(dpi)
+    output_format = (output_format or "png").strip().lower()
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"输入参数无效: 不支持的输出格式 '{output_format}' (可选: {', '.join(OUTPUT_FORMATS)})")
+    try:
+        png_profile = resolve_png_profile(png_profile)
+    except ValueError as ve:
+        raise HTTPException(status_code=400, detail=f"输入参数无效: {ve}")
+    # 超出预算的预览总是降低分辨率；其它请求按 OVERSIZE_POLICY 降低分辨率或拒绝
+    admitted_dpi = admissible_dpi(scene, dpi, png_profile, output_format, downscale=preview or OVERSIZE_POLICY == "preview")
+    if admitted_dpi != dpi:
+        dpi = admitted_dpi
+        extra_headers["X-Preview-DPI"] = str(dpi)
+    request_log.note(render_dpi=dpi, format=output_format, png_profile=png_profile if output_format == "png" else None)
+    cache_key = image_cache_key(scene, dpi, png_profile, output_format)
+    headers = {"ETag": etag_for_key(cache_key), "Cache-Control": CACHE_CONTROL, **extra_headers}
+    # 键由参数决定，客户端持有相同 ETag 时其副本必然有效，无需查询缓存
+    if if_none_match_hits(request.headers.get("if-none-match"), headers["ETag"]):
+        request_log.note(cache="not_modified")
+        return Response(status_code=304, headers=headers)
+
+    if output_format == "png" and STREAM_PNG and uses_strip_encoder(scene.rasterize(dpi)):
+        if (body := await RESPONSE_CACHE.get(cache_key)) is None:
+            return await stream_png_response(cache_key, scene, dpi, png_profile, headers)
+        request_log.note(cache="hit")
+    else:
+        body = await render_cached(cache_key, scene, dpi, png_profile, output_format)
+    request_log.note(bytes=len(body))
+    return Response(content=body, media_type=OUTPUT_FORMATS[output_format], headers=headers)
+
+# --- 批量生成 ---
+
+class BatchJob(BaseModel):
+    """批量请求中的一个任务: 样式 + 与单图端点相同的几何参数"""
+    style: Literal["style1", "style2"] = Field(description="样式名")
+    dpi: int = Field(300, ge=72, le=MAX_DPI, description="分辨率 (DPI)")
+    outer_width_mm: float = Field(60.0, gt=0, description="外框宽度 (mm)")
+    outer_height_mm: float = Field(92.0, gt=0, description="外框高度 (mm)")
+    outer_shape_type: str = Field('rectangle', description="外框形状 ('rectangle' 或 'ellipse')")
+    inner_width_mm: float = Field(54.0, ge=0, description="内框宽度 (mm)")
+    inner_height_mm: float = Field(86.0, ge=0, description="内框高度 (mm)")
+    inner_shape_type: str = Field('rectangle', description="内框形状 ('rectangle' 或 'ellipse')")
+    inner_corner_radius_mm: float = Field(3.18, ge=0, description="内框圆角半径 (mm, 仅矩形有效)")
+    png_profile: Literal["fast", "balanced", "smallest"] | None = Field(None, description="PNG 编码配置档，为空时使用服务端默认档")
+    output_format: Literal["png", "svg", "pdf"] = Field("png", description="输出格式 (svg/pdf 为矢量输出，与 DPI 无关)")
+
+    def geometry(self) -> tuple:
+        """几何参数 (含 DPI)，用于调度排序"""
+        return (self.dpi, self.outer_width_mm, self.outer_height_mm, self.outer_shape_type,
+                self.inner_width_mm, self.inner_height_mm, self.inner_shape_type, self.inner_corner_radius_mm)
+
+    def scene(self) -> Scene:
+        """校验参数并构建场景，参数无效时抛出 HTTPException (400)"""
+        return make_scene(BATCH_STYLES[self.style], self.outer_width_mm, self.outer_height_mm, self.outer_shape_type,
+                          self.inner_width_mm, self.inner_height_mm, self.inner_shape_type, self.inner_corner_radius_mm)
+
+    def filename(self, index: int) -> str:
+        if self.output_format != "png":
+            return f"{index:03d}_{self.style}_{self.outer_width_mm:g}x{self.outer_height_mm:g}mm.{self.output_format}"
+        return f"{index:03d}_{self.style}_{self.outer_width_mm:g}x{self.outer_height_mm:g}mm_{self.dpi}dpi.png"
+
+class BatchRequest(BaseModel):
+    jobs: list[BatchJob] = Field(min_length=1, max_length=BATCH_MAX_JOBS, description="任务列表")
+    format: Literal["multipart", "zip"] = Field("multipart", description="返回格式: multipart/mixed 或 ZIP 归档")
+
+async def run_batch(jobs: list[BatchJob]):
+    """
+    并发执行批量任务，按完成顺序逐个产出 (index, cache_key, body, error)。
+    最多 BATCH_CONCURRENCY 个任务同时渲染；已完成但尚未被取走的结果最多一个，
+    因此内存占用与批次大小无关。几何参数相同的任务相邻调度，以便共享遮罩缓存。
+    """
+    # 按几何参数 (含 DPI) 排序调度顺序，样式1/样式2 的同尺寸任务会先后命中同一份遮罩
+    order = iter(sorted(range(len(jobs)), key=lambda i: jobs[i].geometry()))
+    results = asyncio.Queue(maxsize=1)
+
+    async def worker():
+        for index in order: # 所有 worker 共享同一个迭代器，依次领取任务
+            job = jobs[index]
+            png_profile = resolve_png_profile(job.png_profile)
+            cache_key = None
+            try:
+                scene = job.scene()
+                cache_key = image_cache_key(scene, job.dpi, png_profile, job.output_format)
+                body = await render_cached(cache_key, scene, job.dpi, png_profile, job.output_format)
+            except HTTPException as he:
+                await results.put((index, cache_key, None, he))
+                continue
+            await results.put((index, cache_key, body, None))
+
+    workers = [asyncio.create_task(worker()) for _ in range(min(BATCH_CONCURRENCY, len(jobs)))]
+    try:
+        for _ in range(len(jobs)):
+            yield await results.get()
+    finally:
+        # 客户端断开或生成器提前关闭时取消尚未完成的任务
+        for task in workers:
+            task.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+
+# --- 实时预览 ---
+
+class PreviewUpdate(BaseModel):
+    """实时预览的一次参数更新: 与单图端点相同的几何参数 + 需要预览的样式"""
+    id: int | None = Field(None, description="客户端序号，原样附在结果中")
+    styles: list[Literal["style1", "style2"]] = Field(["style1", "style2"], min_length=1, description="需要预览的样式")
+    outer_width_mm: float = Field(60.0, gt=0, description="外框宽度 (mm)")
+    outer_height_mm: float = Field(92.0, gt=0, description="外框高度 (mm)")
+    outer_shape_type: str = Field('rectangle', description="外框形状 ('rectangle' 或 'ellipse')")
+    inner_width_mm: float = Field(54.0, ge=0, description="内框宽度 (mm)")
+    inner_height_mm: float = Field(86.0, ge=0, description="内框高度 (mm)")
+    inner_shape_type: str = Field('rectangle', description="内框形状 ('rectangle' 或 'ellipse')")
+    inner_corner_radius_mm: float = Field(3.18, ge=0, description="内框圆角半径 (mm, 仅矩形有效)")
+    preview_max_px: int | None = Field(None, ge=16, le=4096, description="预览图像长边的最大像素数")
+
+async def render_preview_update(update: PreviewUpdate) -> list:
+    """并发渲染一次更新中各样式的预览 (经响应缓存)，返回 [(style, dpi, cache_key, body, error)]"""
+    async def render_style(style):
+        try:
+            scene = make_scene(BATCH_STYLES[style], update.outer_width_mm, update.outer_height_mm, update.outer_shape_type,
+                               update.inner_width_mm, update.inner_height_mm, update.inner_shape_type,
+                               update.inner_corner_radius_mm)
+            dpi = admissible_dpi(scene, preview_dpi(scene, update.preview_max_px), PREVIEW_PNG_PROFILE, downscale=True)
+            cache_key = image_cache_key(scene, dpi, PREVIEW_PNG_PROFILE)
+            return style, dpi, cache_key, await render_cached(cache_key, scene, dpi, PREVIEW_PNG_PROFILE), None
+        except HTTPException as he:
+            return style, None, None, None, he
+    return await asyncio.gather(*(render_style(style) for style in dict.fromkeys(update.styles)))
+
 # --- API 端点 (Endpoints) ---
 
 @app.get("/", response_class=HTMLResponse, summary="获取主页界面")
 async def get_index_page(request: Request):
     """提供主要的 HTML 用户界面。"""
-    logging.info("请求访问主页 /")
+    logging.debug("请求访问主页 /")
     try:
         # 直接读取并返回 static 目录下的 HTML 文件内容
         with open("static/index.html", "r", encoding="utf-8") as f:
@@ -121,53 +494,167 @@ async def get_index_page(request: Request):
         logging.error("无法找到 static/index.html 文件")
         raise HTTPException(status_code=500, detail="服务器内部错误: 无法加载界面文件。")
 
-@app.post("/generate_image_style1/", response_class=StreamingResponse, summary="生成样式1的图像")
+@app.post("/generate_image_style1/", response_class=Response, summary="生成样式1的图像")
 async def generate_image_style1(
+    request: Request,
     # 使用 Form(...) 从 HTML 表单接收数据
-    dpi: int = Form(300, ge=72, le=1200, description="分辨率 (DPI)"),
+    dpi: int = Form(300, ge=72, le=MAX_DPI, description="分辨率 (DPI)"),
     outer_width_mm: float = Form(60.0, gt=0, description="外框宽度 (mm)"),
     outer_height_mm: float = Form(92.0, gt=0, description="外框高度 (mm)"),
     outer_shape_type: str = Form('rectangle', description="外框形状 ('rectangle' 或 'ellipse')"),
     inner_width_mm: float = Form(54.0, ge=0, description="内框宽度 (mm)"),
     inner_height_mm: float = Form(86.0, ge=0, description="内框高度 (mm)"),
     inner_shape_type: str = Form('rectangle', description="内框形状 ('rectangle' 或 'ellipse')"),
-    inner_corner_radius_mm: float = Form(3.18, ge=0, description="内框圆角半径 (mm, 仅矩形有效)")
+    inner_corner_radius_mm: float = Form(3.18, ge=0, description="内框圆角半径 (mm, 仅矩形有效)"),
+    png_profile: str | None = Form(None, description="PNG 编码配置档 ('fast'、'balanced' 或 'smallest'，为空时使用服务端默认档)"),
+    output_format: str = Form('png', description="输出格式 ('png'、'svg' 或 'pdf'；矢量格式与 DPI 无关)"),
+    preview: bool = Form(False, description="返回低分辨率 PNG 预览 (忽略 dpi、png_profile 和 output_format)"),
+    preview_max_px: int | None = Form(None, ge=16, le=4096, description="预览图像长边的最大像素数 (例如显示区域宽度)")
 ):
     """根据传入的几何参数，使用预设的样式1生成图像。"""
-    logging.info(f"收到生成样式1图像的请求, DPI={dpi}, 外框={outer_width_mm}x{outer_height_mm} ({outer_shape_type})")
-    # 调用辅助函数处理请求
-    img_buffer = process_image_request(
-        STYLE1_PARAMS, dpi, outer_width_mm, outer_height_mm, outer_shape_type,
-        inner_width_mm, inner_height_mm, inner_shape_type, inner_corner_radius_mm
-    )
-    # 返回包含图像数据的流式响应
-    return StreamingResponse(img_buffer, media_type="image/png")
+    # 调用辅助函数处理请求 (带响应缓存和条件请求支持)，请求计数和耗时见 /metrics，每个请求一条汇总日志
+    with RENDER_METRICS.track_request("style1", dpi_bucket(dpi, preview)) as tracked, \
+            REQUEST_LOG.track("style1", dpi=dpi, outer_mm=(outer_width_mm, outer_height_mm), outer_shape=outer_shape_type,
+                              inner_mm=(inner_width_mm, inner_height_mm), inner_shape=inner_shape_type,
+                              preview=preview or None) as entry:
+        scene = make_scene(STYLE1_PARAMS, outer_width_mm, outer_height_mm, outer_shape_type,
+                           inner_width_mm, inner_height_mm, inner_shape_type, inner_corner_radius_mm)
+        response = await build_image_response(request, scene, dpi, png_profile, output_format, preview, preview_max_px)
+        tracked.status_code = entry.status_code = response.status_code
+        response = finish_after_body(response, tracked, entry)
+    return response
 
-@app.post("/generate_image_style2/", response_class=StreamingResponse, summary="生成样式2的图像")
+@app.post("/generate_image_style2/", response_class=Response, summary="生成样式2的图像")
 async def generate_image_style2(
+    request: Request,
     # 参数与样式1完全相同，因为几何形状是共享的
-    dpi: int = Form(300, ge=72, le=1200, description="分辨率 (DPI)"),
+    dpi: int = Form(300, ge=72, le=MAX_DPI, description="分辨率 (DPI)"),
     outer_width_mm: float = Form(60.0, gt=0, description="外框宽度 (mm)"),
     outer_height_mm: float = Form(92.0, gt=0, description="外框高度 (mm)"),
     outer_shape_type: str = Form('rectangle', description="外框形状 ('rectangle' 或 'ellipse')"),
     inner_width_mm: float = Form(54.0, ge=0, description="内框宽度 (mm)"),
     inner_height_mm: float = Form(86.0, ge=0, description="内框高度 (mm)"),
     inner_shape_type: str = Form('rectangle', description="内框形状 ('rectangle' 或 'ellipse')"),
-    inner_corner_radius_mm: float = Form(3.18, ge=0, description="内框圆角半径 (mm, 仅矩形有效)")
+    inner_corner_radius_mm: float = Form(3.18, ge=0, description="内框圆角半径 (mm, 仅矩形有效)"),
+    png_profile: str | None = Form(None, description="PNG 编码配置档 ('fast'、'balanced' 或 'smallest'，为空时使用服务端默认档)"),
+    output_format: str = Form('png', description="输出格式 ('png'、'svg' 或 'pdf'；矢量格式与 DPI 无关)"),
+    preview: bool = Form(False, description="返回低分辨率 PNG 预览 (忽略 dpi、png_profile 和 output_format)"),
+    preview_max_px: int | None = Form(None, ge=16, le=4096, description="预览图像长边的最大像素数 (例如显示区域宽度)")
 ):
     """根据传入的几何参数，使用预设的样式2生成图像。"""
-    logging.info(f"收到生成样式2图像的请求, DPI={dpi}, 外框={outer_width_mm}x{outer_height_mm} ({outer_shape_type})")
-    # 调用辅助函数处理请求
-    img_buffer = process_image_request(
-        STYLE2_PARAMS, dpi, outer_width_mm, outer_height_mm, outer_shape_type,
-        inner_width_mm, inner_height_mm, inner_shape_type, inner_corner_radius_mm
-    )
-    # 返回包含图像数据的流式响应
-    return StreamingResponse(img_buffer, media_type="image/png")
+    # 调用辅助函数处理请求 (带响应缓存和条件请求支持)，请求计数和耗时见 /metrics，每个请求一条汇总日志
+    with RENDER_METRICS.track_request("style2", dpi_bucket(dpi, preview)) as tracked, \
+            REQUEST_LOG.track("style2", dpi=dpi, outer_mm=(outer_width_mm, outer_height_mm), outer_shape=outer_shape_type,
+                              inner_mm=(inner_width_mm, inner_height_mm), inner_shape=inner_shape_type,
+                              preview=preview or None) as entry:
+        scene = make_scene(STYLE2_PARAMS, outer_width_mm, outer_height_mm, outer_shape_type,
+                           inner_width_mm, inner_height_mm, inner_shape_type, inner_corner_radius_mm)
+        response = await build_image_response(request, scene, dpi, png_profile, output_format, preview, preview_max_px)
+        tracked.status_code = entry.status_code = response.status_code
+        response = finish_after_body(response, tracked, entry)
+    return response
+
+@app.post("/generate_batch/", summary="批量生成图像 (流式返回)")
+async def generate_batch(batch: BatchRequest):
+    """
+    接收 JSON 任务列表，在服务端并发渲染，每个任务完成后立即写入响应 (分块传输)，
+    整个批次不会在内存中缓冲。
+    format="multipart": 每个任务一个 multipart/mixed 分段，X-Batch-Index 头给出任务在请求中的序号。
+    format="zip": 流式写出的 ZIP 归档，末尾附带 manifest.json。
+    单个任务失败时对应的分段/条目为 JSON 错误信息，不影响其余任务。
+    """
+    jobs = batch.jobs
+    logging.info("收到批量生成请求, 任务数=%d, 格式=%s", len(jobs), batch.format)
+    headers = {"X-Batch-Jobs": str(len(jobs))}
+    if batch.format == "zip":
+        writer = ZipStreamWriter()
+        headers["Content-Disposition"] = 'attachment; filename="borders.zip"'
+    else:
+        writer = MultipartWriter()
+
+    async def stream():
+        failed = 0
+        async for index, cache_key, body, error in run_batch(jobs):
+            if error is None:
+                yield writer.add_image(index, jobs[index].filename(index), etag_for_key(cache_key), body,
+                                       OUTPUT_FORMATS[jobs[index].output_format])
+            else:
+                failed += 1
+                yield writer.add_error(index, {"index": index, "status_code": error.status_code, "detail": error.detail})
+            del body # 已写入响应，不再持有图像字节
+        yield writer.close()
+        logging.info("批量生成完成, 任务数=%d, 失败=%d", len(jobs), failed)
+
+    return StreamingResponse(stream(), media_type=writer.content_type, headers=headers)
+
+@app.websocket("/ws/preview")
+async def preview_socket(websocket: WebSocket):
+    """
+    实时预览通道。客户端每次参数变化时发送一条 JSON (字段见 PreviewUpdate)；
+    服务端防抖后只渲染最新参数，渲染中收到新参数时取消当前渲染。
+    每个样式的结果为一条 JSON 文本消息 {"type": "preview", "id", "style", "dpi", "etag", "bytes"}，
+    紧接着一条二进制消息 (PNG)；失败时为 {"type": "error", "id", "style", "status_code", "detail"}。
+客户端发送的消息无效 (不是文本或不符合 PreviewUpdate) 时回复 id 为 null 的错误消息，连接保持打开。
+    """
+    await websocket.accept()
+
+    async def deliver(update: PreviewUpdate, results: list):
+        for style, dpi, cache_key, body, error in results:
+            if error is not None:
+                await websocket.send_json({"type": "error", "id": update.id, "style": style,
+                                           "status_code": error.status_code, "detail": error.detail})
+                continue
+            await websocket.send_json({"type": "preview", "id": update.id, "style": style, "dpi": dpi,
+                                       "etag": etag_for_key(cache_key), "bytes": len(body)})
+            await websocket.send_bytes(body)
+
+    session = PreviewSession(render_preview_update, deliver, PREVIEW_DEBOUNCE_SECONDS)
+    session_task = asyncio.create_task(session.run())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if message.get("text") is None: # 二进制帧: 回复错误，连接保持打开
+                await websocket.send_json({"type": "error", "id": None, "status_code": 400,
+                                           "detail": "参数应为 JSON 文本消息，不接受二进制消息"})
+                continue
+            try:
+                update = PreviewUpdate.model_validate_json(message["text"])
+            except ValidationError as ve:
+                await websocket.send_json({"type": "error", "id": None, "status_code": 422,
+                                           "detail": ve.errors(include_url=False, include_context=False)})
+                continue
+            session.submit(update)
+    except WebSocketDisconnect:
+        logging.info("实时预览连接已关闭")
+    finally:
+        session_task.cancel()
+        await asyncio.gather(session_task, return_exceptions=True)
 
 # --- 可选：添加一个简单的健康检查端点 ---
 @app.get("/health", summary="服务健康检查")
 async def health_check():
     """检查服务是否正常运行。"""
     logging.debug("健康检查 /health")
-    return {"status": "ok", "message": "服务运行正常"}
\ No newline at end of file
+    return {"status": "ok", "message": "服务运行正常"}
+
+def runtime_stats() -> dict:
+    """各组件的运行时计数器 (/stats 和 /metrics 共用)"""
+    return {"mask_cache": MASK_CACHE.stats(), "response_cache": RESPONSE_CACHE.stats(), "render_pool": RENDER_POOL.stats(),
+            "png_encoder": ENCODER_STATS.stats(), "live_preview": LIVE_PREVIEW_STATS.stats(),
+            "admission": ADMISSION.stats(), **({"logging": LOG_HANDLER.stats()} if LOG_HANDLER is not None else {})}
+
+@app.get("/stats", summary="运行时统计")
+async def get_stats():
+    """返回缓存、渲染工作池等运行时计数器，便于观察命中率、队列深度和内存占用。"""
+    return runtime_stats()
+
+@app.get("/metrics", response_class=PlainTextResponse, summary="Prometheus 指标")
+async def get_metrics():
+    """
+    Prometheus 文本格式的指标: 各渲染阶段 (遮罩、图案、粘贴、描边、调色板转换、编码、等待准入) 的耗时直方图、
+    工作池排队/执行耗时、按样式/DPI 区间/结果的请求计数，以及 /stats 中的全部数值计数器。
+    """
+    lines = RENDER_METRICS.render_lines() + stats_lines(runtime_stats())
+    return PlainTextResponse("\n".join(lines) + "\n", media_type="text/plain; version=0.0.4; charset=utf-8")
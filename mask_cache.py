@@ -0,0 +1,89 @@
+# mask_cache.py
+# -*- coding: utf-8 -*-
+"""
+进程内的 LRU 缓存，按总字节数限制容量。
+用于在样式1/样式2等几何参数相同的请求之间共享边框/内框遮罩。
+"""
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class MaskCache:
+    """
+    按字节数限制容量的线程安全 LRU 缓存。
+    同一个键的并发请求会合并: 后到的请求等待第一个请求的计算结果，而不是重复计算。
+    缓存的值会被多个请求共享，调用者不得修改。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max(0, int(max_bytes))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> (value, nbytes)，按最近使用排序
+        self._pending = {} # key -> Future，正在计算中的键
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.coalesced = 0 # 等待其他请求计算结果的次数
+
+    def get_or_create(self, key, factory, size_of):
+        """
+        返回 key 对应的值；未命中时调用 factory() 计算，并按 size_of(value) 的字节数入缓存。
+        factory 抛出的异常会传递给所有等待该键的调用者，且不会被缓存。
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            future = self._pending.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._pending[key] = Future()
+            else:
+                self.coalesced += 1
+        if not owner:
+            return future.result() # 等待正在进行的相同计算
+
+        try:
+            value = factory()
+        except BaseException as e:
+            with self._lock:
+                del self._pending[key]
+            future.set_exception(e)
+            raise
+        nbytes = size_of(value)
+        with self._lock:
+            del self._pending[key]
+            if self.max_bytes and nbytes <= self.max_bytes:
+                self._entries[key] = (value, nbytes)
+                self._bytes += nbytes
+                while self._bytes > self.max_bytes: # 淘汰最久未使用的条目
+                    _, (_, evicted_bytes) = self._entries.popitem(last=False)
+                    self._bytes -= evicted_bytes
+                    self.evictions += 1
+        future.set_result(value)
+        return value
+
+    def clear(self):
+        """清空缓存 (不影响正在进行的计算和计数器)"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """返回命中/未命中/淘汰等计数器和当前占用"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
@@ -0,0 +1,187 @@
+# metrics.py
+# -*- coding: utf-8 -*-
+"""
+Prometheus 文本格式 (0.0.4) 的指标导出，不依赖第三方库。
+- Counter / Histogram: 带标签，线程安全 (工作池的 on_metrics 回调在工作线程或进程池的管理线程中调用)；
+- RenderMetrics: 汇总 task_metrics 样本 (各渲染阶段、PNG 编码、工作池排队/执行耗时) 和单图请求的计数与耗时；
+- stats_lines: 把 /stats 中的数值计数器展开为 untyped 指标。
+"""
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+# 耗时直方图的默认桶上界 (秒)
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# 请求计数的 DPI 区间上界
+DPI_BUCKETS = (150, 300, 600, 1200, 2400)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(int(value))
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._series = {} # 标签值 -> [各桶计数 (非累计), 总和, 样本数]
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = next((i for i, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += bucket_count
+                    le = 'le="' + _number(bound) + '"'
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def dpi_bucket(dpi: int, preview: bool = False) -> str:
+    """请求计数的 DPI 标签: 'preview'，或 DPI 所在区间的上界 ('le_300' 等)"""
+    if preview:
+        return "preview"
+    for bound in DPI_BUCKETS:
+        if dpi <= bound:
+            return f"le_{bound}"
+    return f"gt_{DPI_BUCKETS[-1]}"
+
+
+def request_outcome(status_code: int) -> str:
+    """HTTP 状态码 -> 请求结果标签"""
+    if status_code < 300:
+        return "ok"
+    return {304: "not_modified", 400: "bad_request", 413: "too_large", 422: "bad_request",
+            503: "busy"}.get(status_code, "error")
+
+
+class RenderMetrics:
+    """渲染流水线的指标集合"""
+
+    def __init__(self, prefix: str = "border"):
+        self.stage_seconds = Histogram(
+            f"{prefix}_render_stage_seconds", "每个任务在各渲染阶段的耗时 (秒)", ("stage",))
+        self.pool_wait_seconds = Histogram(
+            f"{prefix}_render_pool_wait_seconds", "任务在渲染工作池中排队的时间 (秒)")
+        self.pool_run_seconds = Histogram(
+            f"{prefix}_render_pool_run_seconds", "任务在渲染工作线程/进程中执行的时间 (秒)")
+        self.requests = Counter(
+            f"{prefix}_requests_total", "单图请求数 (按样式、DPI 区间和结果)",
+            ("style", "dpi_bucket", "outcome"))
+        self.request_seconds = Histogram(
+            f"{prefix}_request_seconds", "单图请求的耗时 (秒，流式响应到响应体发送完毕为止)", ("style",))
+
+    def observe(self, samples: list):
+        """汇总一个任务的 task_metrics 样本 (用作工作池的 on_metrics 回调)"""
+        for name, fields in samples:
+            if name == "render_stage":
+                self.stage_seconds.observe(fields["seconds"], stage=fields["stage"])
+            elif name == "png_encode":
+                self.stage_seconds.observe(fields["seconds"], stage="encode")
+            elif name == "pool_task":
+                self.pool_wait_seconds.observe(fields["wait_seconds"])
+                self.pool_run_seconds.observe(fields["run_seconds"])
+
+    def observe_stage(self, stage: str, seconds: float):
+        """记录在事件循环中测得的阶段耗时 (例如等待准入)"""
+        self.stage_seconds.observe(seconds, stage=stage)
+
+    @contextmanager
+    def track_request(self, style: str, dpi_bucket_label: str):
+        """
+        with metrics.track_request(style, dpi_bucket(dpi)) as tracked: ...; tracked.status_code = response.status_code
+        记录请求计数和耗时；代码块抛出的异常按其 status_code 属性 (没有时为 500) 计入结果。
+        代码块中设置 tracked.deferred = True 时 (例如流式响应) 不在代码块结束时记录，由调用者之后调用 finish_request。
+        """
+        tracked = SimpleNamespace(status_code=200, deferred=False, style=style, dpi_bucket=dpi_bucket_label,
+                                  started=time.perf_counter())
+        try:
+            yield tracked
+        except Exception as e:
+            tracked.status_code = getattr(e, "status_code", 500)
+            tracked.deferred = False
+            raise
+        finally:
+            if not tracked.deferred:
+                self.finish_request(tracked)
+
+    def finish_request(self, tracked):
+        """记录 track_request 产生的请求的计数和耗时 (到调用时为止)"""
+        self.requests.inc(style=tracked.style, dpi_bucket=tracked.dpi_bucket, outcome=request_outcome(tracked.status_code))
+        self.request_seconds.observe(time.perf_counter() - tracked.started, style=tracked.style)
+
+    def render_lines(self) -> list:
+        lines = []
+        for metric in (self.requests, self.request_seconds, self.stage_seconds, self.pool_wait_seconds, self.pool_run_seconds):
+            lines.extend(metric.render())
+        return lines
+
+
+def stats_lines(stats: dict, prefix: str = "border") -> list:
+    """把 /stats 的嵌套字典中的数值展开为 untyped 指标 (名称由各层键拼接)，忽略字符串等非数值"""
+    lines = []
+
+    def walk(value, name):
+        if isinstance(value, dict):
+            for key, child in value.items():
+                walk(child, f"{name}_{re.sub(r'[^a-zA-Z0-9_]', '_', str(key))}")
+        elif isinstance(value, (int, float)):
+            lines.append(f"# TYPE {name} untyped")
+            lines.append(f"{name} {_number(value)}")
+
+    walk(stats, prefix)
+    return lines
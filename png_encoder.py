@@ -0,0 +1,217 @@
+# png_encoder.py
+# -*- coding: utf-8 -*-
+"""
+PNG 编码配置档: 在编码耗时和输出大小之间取舍。
+    fast      compress_level=1 + Z_RLE 策略: 编码最快，大面积纯色/重复图案仍能压缩得较小
+    balanced  Pillow 默认设置 (compress_level=6)，输出与以往完全一致
+    smallest  optimize=True (compress_level=9): 输出最小，编码最慢
+服务端默认档可用环境变量 BORDER_PNG_PROFILE 设置，每个请求也可以单独指定。
+
+PngStreamWriter 是增量编码器: 逐条写入图像行，压缩数据攒够一定大小即作为一个 IDAT 块输出，
+用于按水平带生成的大画布 (见 image_generator.iter_bordered_bands)，无需在内存中保留整幅图像。
+"""
+
+import io
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+
+import task_metrics
+
+PNG_PROFILES = {
+    "fast": {"compress_level": 1, "compress_type": zlib.Z_RLE},
+    "balanced": {"compress_level": 6},
+    "smallest": {"optimize": True},
+}
+
+DEFAULT_PNG_PROFILE = os.environ.get("BORDER_PNG_PROFILE", "balanced").strip().lower()
+if DEFAULT_PNG_PROFILE not in PNG_PROFILES:
+    logging.warning("未知的 PNG 编码配置档: %s，使用 balanced", DEFAULT_PNG_PROFILE)
+    DEFAULT_PNG_PROFILE = "balanced"
+
+
+def resolve_png_profile(name: str | None) -> str:
+    """返回有效的配置档名称；name 为空时使用服务端默认档，未知名称抛出 ValueError"""
+    if not name:
+        return DEFAULT_PNG_PROFILE
+    name = name.strip().lower()
+    if name not in PNG_PROFILES:
+        raise ValueError(f"不支持的 PNG 编码配置档: {name} (可选: {', '.join(PNG_PROFILES)})")
+    return name
+
+
+def encode_png(image, profile: str | None = None, dpi: tuple | None = None) -> bytes:
+    """按配置档把图像编码为 PNG 字节，并记录编码耗时和输出大小"""
+    profile = resolve_png_profile(profile)
+    options = dict(PNG_PROFILES[profile])
+    if dpi is not None:
+        options["dpi"] = dpi
+    started = time.perf_counter()
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', **options)
+    body = buffer.getvalue()
+    task_metrics.record(
+        "png_encode", profile=profile, seconds=time.perf_counter() - started,
+        bytes=len(body), raw_bytes=image.width * image.height * len(image.getbands()),
+    )
+    return body
+
+
+def _zlib_options(profile: str) -> tuple:
+    """配置档对应的 zlib (压缩级别, 策略)，与 Pillow 的 PNG 编码参数含义相同"""
+    options = PNG_PROFILES[profile]
+    level = options.get("compress_level", 9 if options.get("optimize") else 6)
+    return level, options.get("compress_type", zlib.Z_DEFAULT_STRATEGY)
+
+
+def _png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+class PngStreamWriter:
+    """
+    增量 PNG 编码器。
+    mode 为 'P' (需要 palette: RGBA 元组列表，按项数选择 1/2/4/8 位位深，透明度写入 tRNS) 或 'RGBA'。
+    header() 返回文件头和元数据块；write_rows(image) 写入若干整行 (宽度须与画布一致，'P' 模式可传入 'L' 下标图像)，
+    返回已经可以输出的 IDAT 块 (可能为空)；close() 返回剩余数据和 IEND，并记录编码指标。
+    每一行使用 None 滤波 (调色板图像推荐的做法，与 Pillow 对调色板图像的选择一致)。
+    """
+
+    def __init__(self, size: tuple, mode: str, profile: str | None = None, dpi: tuple | None = None,
+                 palette: list | None = None, chunk_bytes: int = 64 * 1024):
+        self.width, self.height = size
+        self.mode = mode
+        self.profile = resolve_png_profile(profile)
+        self.dpi = dpi
+        self.chunk_bytes = max(1, chunk_bytes)
+        if mode == 'P':
+            if not palette or len(palette) > 256:
+                raise ValueError("调色板模式需要 1-256 项的调色板")
+            self.palette = palette
+            self.bit_depth = next(bits for bits in (1, 2, 4, 8) if len(palette) <= 1 << bits)
+            self._raw_mode = 'P' if self.bit_depth == 8 else f'P;{self.bit_depth}'
+        elif mode == 'RGBA':
+            self.palette = None
+            self.bit_depth = 8
+            self._raw_mode = 'RGBA'
+        else:
+            raise ValueError(f"不支持的图像模式: {mode}")
+        level, strategy = _zlib_options(self.profile)
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 15, 9, strategy)
+        self._pending = [] # 尚未输出的压缩数据
+        self._pending_bytes = 0
+        self._rows_written = 0
+        self.bytes_written = 0
+        self.seconds = 0.0 # 累计编码耗时 (不含图像生成)
+
+    def _emit(self, data: bytes) -> bytes:
+        self.bytes_written += len(data)
+        return data
+
+    def header(self) -> bytes:
+        color_type = 3 if self.mode == 'P' else 6
+        chunks = [b"\x89PNG\r\n\x1a\n",
+                  _png_chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, self.bit_depth, color_type, 0, 0, 0))]
+        if self.palette is not None:
+            chunks.append(_png_chunk(b"PLTE", bytes(channel for color in self.palette for channel in color[:3])))
+            alphas = bytes(color[3] for color in self.palette).rstrip(b"\xff") # 末尾不透明的项可以省略
+            if alphas:
+                chunks.append(_png_chunk(b"tRNS", alphas))
+        if self.dpi is not None:
+            # pHYs: 每米像素数 (与 Pillow 的换算一致)
+            chunks.append(_png_chunk(b"pHYs", struct.pack(">IIB", int(self.dpi[0] / 0.0254 + 0.5), int(self.dpi[1] / 0.0254 + 0.5), 1)))
+        return self._emit(b"".join(chunks))
+
+    def write_rows(self, image) -> bytes:
+        """写入图像的所有行，返回已攒够的 IDAT 块"""
+        started = time.perf_counter()
+        if image.width != self.width:
+            raise ValueError(f"行宽不一致: {image.width} != {self.width}")
+        if self.mode == 'P' and image.mode == 'L':
+            if self.bit_depth == 8:
+                data = image.tobytes() # 'L' 的字节即为下标
+            else:
+                image = image.copy()
+                image.putpalette(b"\x00\x00\x00" * len(self.palette)) # 只为按位打包下标，颜色不参与
+                data = image.tobytes('raw', self._raw_mode)
+        else:
+            data = image.tobytes('raw', self._raw_mode)
+        stride = len(data) // image.height if image.height else 0
+        # 每行前加一个滤波类型字节 (0 = None)
+        rows = bytearray(len(data) + image.height)
+        for row in range(image.height):
+            start = row * (stride + 1)
+            rows[start + 1:start + 1 + stride] = data[row * stride:(row + 1) * stride]
+        self._rows_written += image.height
+        compressed = self._compressor.compress(bytes(rows))
+        out = b""
+        if compressed:
+            self._pending.append(compressed)
+            self._pending_bytes += len(compressed)
+            if self._pending_bytes >= self.chunk_bytes:
+                out = _png_chunk(b"IDAT", b"".join(self._pending))
+                self._pending.clear()
+                self._pending_bytes = 0
+        self.seconds += time.perf_counter() - started
+        return self._emit(out)
+
+    def close(self) -> bytes:
+        """输出剩余的压缩数据和 IEND，并记录 png_encode 指标"""
+        if self._rows_written != self.height:
+            raise ValueError(f"写入的行数 ({self._rows_written}) 与图像高度 ({self.height}) 不一致")
+        started = time.perf_counter()
+        self._pending.append(self._compressor.flush())
+        out = _png_chunk(b"IDAT", b"".join(self._pending)) + _png_chunk(b"IEND", b"")
+        self._pending.clear()
+        self.seconds += time.perf_counter() - started
+        out = self._emit(out)
+        channels = 1 if self.mode == 'P' else 4
+        task_metrics.record(
+            "png_encode", profile=self.profile, seconds=self.seconds,
+            bytes=self.bytes_written, raw_bytes=self.width * self.height * channels,
+        )
+        return out
+
+
+class EncoderStats:
+    """按配置档汇总编码次数、耗时和输出大小 (线程安全)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._profiles = {}
+
+    def observe(self, samples: list):
+        """汇总 task_metrics 样本中的 png_encode 记录"""
+        with self._lock:
+            for name, fields in samples:
+                if name != "png_encode": continue
+                entry = self._profiles.setdefault(fields["profile"], {
+                    "count": 0, "seconds_total": 0.0, "seconds_max": 0.0, "bytes_total": 0, "raw_bytes_total": 0,
+                })
+                entry["count"] += 1
+                entry["seconds_total"] += fields["seconds"]
+                entry["seconds_max"] = max(entry["seconds_max"], fields["seconds"])
+                entry["bytes_total"] += fields["bytes"]
+                entry["raw_bytes_total"] += fields["raw_bytes"]
+
+    def stats(self) -> dict:
+        """返回每个配置档的计数器，以及平均耗时、平均大小和压缩率"""
+        with self._lock:
+            result = {"default_profile": DEFAULT_PNG_PROFILE}
+            for profile, entry in self._profiles.items():
+                count = entry["count"]
+                result[profile] = {
+                    **entry,
+                    "seconds_total": round(entry["seconds_total"], 6),
+                    "seconds_max": round(entry["seconds_max"], 6),
+                    "seconds_avg": round(entry["seconds_total"] / count, 6),
+                    "bytes_avg": entry["bytes_total"] // count,
+                    "compression_ratio": round(entry["raw_bytes_total"] / entry["bytes_total"], 2) if entry["bytes_total"] else 0.0,
+                }
+            return result
+
+
+ENCODER_STATS = EncoderStats()
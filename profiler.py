@@ -0,0 +1,189 @@
+# profiler.py
+# -*- coding: utf-8 -*-
+"""
+渲染任务的性能剖析 (可选，默认关闭)，用于事后分析个别特别慢的请求。
+渲染任务在工作线程/进程中经 profiled_call / profiled_iter 执行:
+- 抽样: 按 sample_percent 随机选中的任务用 cProfile 完整剖析，保存为 .prof (pstats 格式)；
+- 慢任务: 执行时间超过 slow_seconds 的任务由采样线程 (每个进程一个) 周期性采集调用栈，保存为 .folded
+  (折叠栈格式，可用于 flamegraph.pl / speedscope)。任务事先无法判断快慢，因此只采集超过阈值之后的部分。
+每个剖析文件旁边有同名的 .json，记录请求参数、耗时和结果。同一进程同时只运行一个 cProfile (Python 3.12 起不允许多个)，
+此时被抽中的其他任务改为按慢任务处理。未启用时调用者直接提交原函数，渲染路径上没有任何额外开销。
+"""
+
+import cProfile
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class ProfileSettings:
+    directory: str # 剖析文件的保存目录
+    sample_percent: float = 0.0 # 用 cProfile 剖析的任务比例 (0-100)
+    slow_seconds: float = 0.0 # 执行时间超过该值的任务采集调用栈 (0 为不采集)
+    interval_seconds: float = 0.005 # 调用栈的采样间隔
+    keep: int = 200 # 最多保留的剖析数 (超出时删除最旧的)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory) and (self.sample_percent > 0 or self.slow_seconds > 0)
+
+
+# 同一进程同时只运行一个 cProfile
+_PROFILE_LOCK = threading.Lock()
+_SAMPLER_LOCK = threading.Lock()
+_SAMPLER = None
+
+
+class StackSampler:
+    """采样线程: 周期性采集已超过阈值的任务线程的调用栈；没有进行中的任务时休眠"""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = max(0.001, interval_seconds)
+        self._condition = threading.Condition()
+        self._active = {} # 线程 id -> (开始采样的时间, 调用栈计数)
+        threading.Thread(target=self._run, name="render-profiler", daemon=True).start()
+
+    def begin(self, threshold: float) -> Counter:
+        """开始监视当前线程；执行时间超过 threshold 秒后开始采样"""
+        counts = Counter()
+        with self._condition:
+            self._active[threading.get_ident()] = (time.perf_counter() + threshold, counts)
+            self._condition.notify()
+        return counts
+
+    def end(self):
+        """停止监视当前线程 (之后 begin() 返回的计数不再变化)"""
+        with self._condition:
+            self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._active:
+                    self._condition.wait()
+            time.sleep(self.interval_seconds)
+            now = time.perf_counter()
+            with self._condition:
+                due = [(ident, counts) for ident, (sample_after, counts) in self._active.items() if now >= sample_after]
+                if due:
+                    frames = sys._current_frames()
+                    for ident, counts in due:
+                        frame = frames.get(ident)
+                        if frame is not None:
+                            counts[_fold(frame)] += 1
+
+
+def _fold(frame) -> str:
+    """调用栈 -> 折叠格式 'outer;...;inner' (每层为 文件名:函数名)"""
+    names = []
+    while frame is not None:
+        names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+def _sampler(interval_seconds: float) -> StackSampler:
+    global _SAMPLER
+    with _SAMPLER_LOCK:
+        if _SAMPLER is None:
+            _SAMPLER = StackSampler(interval_seconds)
+        return _SAMPLER
+
+
+@contextmanager
+def _profiling(settings: ProfileSettings, params: dict):
+    profile = None
+    if settings.sample_percent > 0 and random.random() * 100 < settings.sample_percent \
+            and _PROFILE_LOCK.acquire(blocking=False):
+        profile = cProfile.Profile()
+    sampler = _sampler(settings.interval_seconds) if profile is None and settings.slow_seconds > 0 else None
+    counts = sampler.begin(settings.slow_seconds) if sampler is not None else None
+    outcome = "ok"
+    started = time.perf_counter()
+    try:
+        if profile is not None:
+            profile.enable()
+        yield
+    except GeneratorExit: # 流式输出被提前关闭 (客户端断开)
+        outcome = "closed"
+        raise
+    except BaseException as e:
+        outcome = type(e).__name__
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        if profile is not None:
+            profile.disable()
+            _PROFILE_LOCK.release()
+        if sampler is not None:
+            sampler.end()
+        if profile is not None or counts:
+            try:
+                save_profile(settings, params, seconds, outcome, profile, counts)
+            except OSError as e:
+                logging.warning("保存性能剖析失败: %s", e)
+
+
+def profiled_call(settings: ProfileSettings, params: dict, fn, *args, **kwargs):
+    """在工作线程/进程中执行 fn(*args, **kwargs)，按 settings 采集性能剖析"""
+    with _profiling(settings, params):
+        return fn(*args, **kwargs)
+
+
+def profiled_iter(settings: ProfileSettings, params: dict, fn, *args, **kwargs):
+    """profiled_call 的生成器版本 (用于 RenderPool.stream 的流式输出)"""
+    with _profiling(settings, params):
+        yield from fn(*args, **kwargs)
+
+
+def save_profile(settings: ProfileSettings, params: dict, seconds: float, outcome: str,
+                 profile: cProfile.Profile | None = None, counts: Counter | None = None) -> str:
+    """保存剖析文件 (.prof 或 .folded) 和记录请求参数的 .json，返回不含扩展名的路径"""
+    os.makedirs(settings.directory, exist_ok=True)
+    now = time.time()
+    stamp = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+    name = f"{stamp}-{seconds * 1000:.0f}ms-{uuid.uuid4().hex[:8]}"
+    path = os.path.join(settings.directory, name)
+    if profile is not None:
+        profile_file = name + ".prof"
+        profile.dump_stats(path + ".prof")
+    else:
+        profile_file = name + ".folded"
+        with open(path + ".folded", 'w', encoding='utf-8') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in counts.most_common())
+    info = {
+        "trigger": "sample" if profile is not None else "slow",
+        "profile": profile_file,
+        "seconds": round(seconds, 6),
+        "outcome": outcome,
+        "pid": os.getpid(),
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "params": params,
+    }
+    if counts is not None:
+        info.update(samples=sum(counts.values()), interval_seconds=settings.interval_seconds)
+    with open(path + ".json", 'w', encoding='utf-8') as f:
+        json.dump(info, f, ensure_ascii=False, indent=2)
+    logging.info("已保存性能剖析: %s.json (%s, %.2f 秒)", path, info['trigger'], seconds)
+    prune_profiles(settings.directory, settings.keep)
+    return path
+
+
+def prune_profiles(directory: str, keep: int):
+    """只保留最新的 keep 个剖析 (文件名以时间开头)"""
+    names = sorted(entry[:-5] for entry in os.listdir(directory) if entry.endswith(".json"))
+    for name in names[:max(0, len(names) - keep)]:
+        for extension in (".json", ".prof", ".folded"):
+            try:
+                os.remove(os.path.join(directory, name + extension))
+            except FileNotFoundError: # 其他工作进程已删除
+                pass
@@ -0,0 +1,330 @@
+# render_pool.py
+# -*- coding: utf-8 -*-
+"""
+把 CPU 密集的渲染/编码任务从 asyncio 事件循环转移到线程池或进程池中执行。
+排队任务数有上限，队列已满时立即拒绝 (由调用者返回 503)，而不是让延迟无限增长。
+
+进程池后端使用预先启动、预先导入模块的工作进程 (forkserver)，
+较大的字节结果通过 multiprocessing.shared_memory 传回，而不是经由管道 pickle。
+"""
+
+import asyncio
+import importlib
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import CancelledError, ThreadPoolExecutor, ProcessPoolExecutor, wait
+from multiprocessing import resource_tracker, shared_memory
+
+import task_metrics
+
+# 大于该字节数的 bytes 结果通过共享内存传回主进程
+SHM_MIN_BYTES = 64 * 1024
+# stream(): 工作线程最多领先消费者的元素数 (背压)
+STREAM_BUFFER_ITEMS = 4
+# stream(): 工作线程等待队列空间时检查消费者是否已离开的间隔 (秒)
+STREAM_PUT_POLL_SECONDS = 0.5
+
+
+class PoolSaturatedError(Exception):
+    """渲染队列已满，请求被拒绝"""
+
+
+def _timed_call(fn, args, kwargs):
+    """
+    在工作线程/进程中执行任务，返回 (开始时间, 结果, 任务指标样本)。
+    开始时间使用 time.monotonic，跨进程可比；样本见 task_metrics。
+    """
+    task_metrics.drain() # 丢弃之前任务残留的样本
+    started = time.monotonic()
+    result = fn(*args, **kwargs)
+    return started, result, task_metrics.drain()
+
+
+def _timed_call_shm(fn, args, kwargs):
+    """
+    在工作进程中执行任务。较大的 bytes 结果写入一块新的共享内存，只返回其名称和长度；
+    共享内存由主进程读取后负责释放 (unlink)。
+    """
+    started, result, samples = _timed_call(fn, args, kwargs)
+    if not isinstance(result, (bytes, bytearray)) or len(result) < SHM_MIN_BYTES:
+        return started, ('inline', result), samples
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(create=True, size=len(result), track=False)
+    else:
+        shm = shared_memory.SharedMemory(create=True, size=len(result))
+        # 所有权交给主进程，避免工作进程退出时被 resource_tracker 提前回收
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    shm.buf[:len(result)] = result
+    shm.close()
+    return started, ('shm', shm.name, len(result)), samples
+
+
+def _read_shm_result(payload):
+    """在主进程中还原 _timed_call_shm 的结果，并释放共享内存"""
+    if payload[0] == 'inline':
+        return payload[1]
+    _, name, size = payload
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(shm.buf[:size])
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _discard_shm_result(future):
+    """等待方已被取消时，在任务结束后释放其共享内存结果"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, payload, _ = future.result()
+    if payload[0] == 'shm':
+        _read_shm_result(payload)
+
+
+def _call_in_loop(loop, callback):
+    """在事件循环线程中调用 callback (事件循环已关闭时忽略)"""
+    try:
+        loop.call_soon_threadsafe(callback)
+    except RuntimeError:
+        pass
+
+
+def _put_threadsafe(loop, queue, item, stop) -> bool:
+    """
+    从工作线程向事件循环中的 asyncio.Queue 放入 item，队列满时等待 (背压)。
+    分段等待并检查 stop 和事件循环状态: 消费者已离开或事件循环已关闭时放弃，返回 False，
+    避免工作线程永远阻塞 (进而使 shutdown(wait=True) 挂起)。
+    """
+    try:
+        future = asyncio.run_coroutine_threadsafe(queue.put(item), loop)
+    except RuntimeError: # 事件循环已关闭
+        return False
+    while True:
+        try:
+            future.result(timeout=STREAM_PUT_POLL_SECONDS)
+            return True
+        except TimeoutError:
+            if loop.is_closed(): # 无法再取消 put
+                return False
+            if stop.is_set():
+                future.cancel()
+                return False
+        except CancelledError: # 事件循环关闭时取消了尚未完成的 put
+            return False
+
+
+def _collect_items(fn, args, kwargs):
+    """在工作进程中完整执行生成器函数，返回其全部元素"""
+    return list(fn(*args, **kwargs))
+
+
+def _init_worker(preload, initializer):
+    """工作进程初始化: 导入预加载模块并执行预热函数"""
+    for module_name in preload:
+        importlib.import_module(module_name)
+    if initializer is not None:
+        initializer()
+
+
+def _warm_task():
+    """预热任务: 短暂占用工作进程，使并发提交的预热任务分散到不同进程"""
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class RenderPool:
+    """
+    可配置的渲染工作池。
+    backend: 'thread' (默认，Pillow 绘制和 zlib 压缩会释放 GIL) 或 'process'。
+    max_queue: 除正在执行的任务外，最多允许排队等待的任务数。
+    preload: 进程池后端中预先导入的模块名 (由 forkserver 导入一次，工作进程 fork 后直接可用)。
+    initializer: 进程池后端中每个工作进程启动时执行的预热函数 (须可被 pickle)。
+    on_metrics: 每个任务成功结束时以该任务的 task_metrics 样本列表调用 (在主进程中)。
+    """
+
+    def __init__(self, backend: str = 'thread', max_workers: int | None = None, max_queue: int | None = None,
+                 preload: tuple = (), initializer=None, on_metrics=None):
+        self.backend = backend if backend in ('thread', 'process') else 'thread'
+        self.max_workers = max(1, max_workers or os.cpu_count() or 1)
+        self.max_queue = max(0, max_queue if max_queue is not None else 2 * self.max_workers)
+        self.preload = tuple(preload)
+        self.initializer = initializer
+        self.on_metrics = on_metrics
+        self._executor = None
+        self._lock = threading.Lock()
+        self._inflight = 0 # 已提交但尚未完成的任务数 (执行中 + 排队中)
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0 # 任务在队列中等待的总时间
+        self.wait_seconds_max = 0.0
+        self.run_seconds_total = 0.0 # 任务执行的总时间
+        self.shm_transfers = 0 # 通过共享内存传回的结果数
+        self.shm_bytes = 0
+
+    def _get_executor(self):
+        if self._executor is None:
+            if self.backend == 'process':
+                # forkserver 只导入一次预加载模块，之后每个工作进程都从它 fork 出来；
+                # 不直接 fork 当前进程，避免继承事件循环和其他线程的状态
+                if 'forkserver' in multiprocessing.get_all_start_methods():
+                    mp_context = multiprocessing.get_context('forkserver')
+                    mp_context.set_forkserver_preload(list(self.preload))
+                else:
+                    mp_context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=mp_context,
+                                                     initializer=_init_worker, initargs=(self.preload, self.initializer))
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='render')
+        return self._executor
+
+    def _on_done(self, submitted_at, future):
+        """任务结束时 (在工作线程或进程池的管理线程中) 更新计数器"""
+        finished = time.monotonic()
+        with self._lock:
+            self._inflight -= 1
+            if future.cancelled() or future.exception() is not None:
+                self.failed += 1
+                return
+            started, _, samples = future.result()
+            waited = max(0.0, started - submitted_at)
+            self.completed += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+            self.run_seconds_total += finished - started
+        if self.on_metrics is not None:
+            # 附加该任务的排队/执行耗时
+            self.on_metrics(samples + [("pool_task", {"wait_seconds": waited, "run_seconds": finished - started})])
+
+    async def run(self, fn, *args, release=None, **kwargs):
+        """
+        在工作池中执行 fn(*args, **kwargs) 并等待结果。
+        正在执行和排队的任务总数达到上限时抛出 PoolSaturatedError。
+        等待方被取消时，尚未开始的任务会被取消；已开始的任务仍会执行完毕并继续占用名额，避免过载。
+        release: 任务真正结束 (完成、失败或开始前被取消) 或被拒绝时，在事件循环线程中调用一次 (不传给 fn)。
+        用于释放为任务预留的资源 (例如准入控制的内存预算)：等待方被取消时已开始的任务仍在占用这些资源。
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            saturated = self._inflight >= self.max_workers + self.max_queue
+            if saturated:
+                self.rejected += 1
+                inflight = self._inflight
+            else:
+                self._inflight += 1
+                self.submitted += 1
+        if saturated:
+            if release is not None:
+                release()
+            raise PoolSaturatedError(f"渲染队列已满 ({inflight} 个任务进行中)")
+        submitted_at = time.monotonic()
+        call = _timed_call_shm if self.backend == 'process' else _timed_call
+        try:
+            future = self._get_executor().submit(call, fn, args, kwargs)
+        except BaseException:
+            with self._lock:
+                self._inflight -= 1
+            if release is not None:
+                release()
+            raise
+        future.add_done_callback(lambda f: self._on_done(submitted_at, f))
+        if release is not None:
+            future.add_done_callback(lambda f: _call_in_loop(loop, release))
+        try:
+            _, result, _ = await asyncio.wrap_future(future)
+        except asyncio.CancelledError:
+            if self.backend == 'process':
+                future.add_done_callback(_discard_shm_result)
+            raise
+        if self.backend == 'process':
+            if result[0] == 'shm':
+                with self._lock:
+                    self.shm_transfers += 1
+                    self.shm_bytes += result[2]
+            result = _read_shm_result(result)
+        return result
+
+    async def stream(self, fn, *args, release=None, **kwargs):
+        """
+        在工作池中执行生成器函数 fn(*args, **kwargs)，以异步生成器逐个产出其元素。
+        线程池后端: 元素经有界队列传回，消费者跟不上时工作线程等待 (背压)；
+        消费者提前关闭时，工作线程在产出下一个元素时停止。
+        进程池后端: 生成器在工作进程中完整执行，全部元素一次传回后再逐个产出。
+        名额、计数和 release 与 run() 相同，队列已满时在产出第一个元素前抛出 PoolSaturatedError。
+        """
+        if self.backend == 'process':
+            for item in await self.run(_collect_items, fn, args, kwargs, release=release):
+                yield item
+            return
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue(maxsize=STREAM_BUFFER_ITEMS)
+        stop = threading.Event()
+
+        def produce():
+            for item in fn(*args, **kwargs):
+                if stop.is_set() or not _put_threadsafe(loop, queue, item, stop):
+                    return
+
+        task = asyncio.ensure_future(self.run(produce, release=release))
+        # 消费者提前离开时任务仍会结束，取走其异常以免产生未处理警告
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        try:
+            while True:
+                getter = asyncio.ensure_future(queue.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter in done:
+                    yield getter.result()
+                    continue
+                getter.cancel()
+                while not queue.empty(): # 任务已结束，取走剩余元素
+                    yield queue.get_nowait()
+                task.result() # 任务失败时抛出其异常
+                return
+        finally:
+            stop.set()
+            while not queue.empty(): # 释放可能正在等待队列空间的工作线程
+                queue.get_nowait()
+
+    def warm_up(self):
+        """
+        预先启动所有工作进程并完成初始化 (阻塞直到完成)，避免首批请求承担进程启动和模块导入开销。
+        线程池后端无需预热。
+        """
+        if self.backend != 'process':
+            return
+        executor = self._get_executor()
+        done, _ = wait([executor.submit(_warm_task) for _ in range(self.max_workers)])
+        pids = {future.result() for future in done}
+        return sorted(pids)
+
+    def shutdown(self):
+        """关闭工作池 (等待正在执行的任务结束)"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """返回队列深度、等待时间等计数器"""
+        with self._lock:
+            inflight = self._inflight
+            return {
+                "backend": self.backend,
+                "max_workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "inflight": inflight,
+                "queue_depth": max(0, inflight - self.max_workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.completed, 6) if self.completed else 0.0,
+                "run_seconds_total": round(self.run_seconds_total, 6),
+                "shm_transfers": self.shm_transfers,
+                "shm_bytes": self.shm_bytes,
+            }
@@ -0,0 +1,232 @@
+# render_service.py
+# -*- coding: utf-8 -*-
+"""
+与 Web 框架无关的渲染入口: 输入为 scene.Scene (毫米/磅参数，已校验)。
+render_png 把场景换算为像素，调用 create_bordered_image 并编码为 PNG；
+render_vector 直接由场景生成矢量输出 (SVG / PDF，见 vector_renderer)。
+只抛出普通异常 (可被 pickle)，因此既可以在线程池中运行，也可以在子进程中运行。
+"""
+
+from PIL import Image # 导入 Pillow 库
+import logging
+import os
+from dataclasses import dataclass
+
+from image_generator import (
+    PALETTE_OUTPUT,
+    PATTERN_TILING,
+    STYLE_COLOR_KEYS,
+    create_bordered_image,
+    iter_bordered_bands,
+    style_palette,
+    palette_indices,
+    to_palette_image,
+    to_rgba_image,
+)
+import task_metrics
+from png_encoder import PngStreamWriter, encode_png, resolve_png_profile
+from scene import RasterGeometry, Scene, build_scene
+from vector_renderer import build_vector_design, render_svg, render_pdf
+
+# 输出格式 -> 响应的 Content-Type
+OUTPUT_FORMATS = {"png": "image/png", "svg": "image/svg+xml", "pdf": "application/pdf"}
+VECTOR_ENCODERS = {"svg": render_svg, "pdf": render_pdf}
+
+# 像素数不小于该值的画布按水平带生成并增量编码 (峰值内存 O(带高 × 宽))，而不是一次生成整幅图像
+STRIP_MIN_PIXELS = int(os.environ.get("BORDER_STRIP_MIN_PIXELS", str(16 * 1024 * 1024)))
+# 每条水平带的行数
+STRIP_ROWS = max(1, int(os.environ.get("BORDER_STRIP_ROWS", "256")))
+
+
+class RenderError(RuntimeError):
+    """图像生成失败 (内部错误)"""
+
+
+@dataclass(frozen=True, slots=True)
+class RenderCost:
+    """渲染之前由参数估计的开销 (见 estimate_render_cost)，用于准入控制"""
+    pixels: int
+    peak_bytes: int # 工作线程/进程中的峰值内存
+    cpu_seconds: float # 生成 + 编码的 CPU 时间
+    strip: bool # 是否按水平带生成
+
+
+# 开销模型的系数 (按实测校准，只需数量级正确)。palette: 索引 PNG 输出；rgba: RGBA 输出
+COST_BYTES_PER_PIXEL = {"palette": 3.5, "rgba": 7.5} # 整幅生成: 画布 + 遮罩 + 编码前的模式转换
+COST_BAND_BYTES_PER_PIXEL = {"palette": 7.0, "rgba": 24.0} # 按带生成: 一条带内的全部图层
+COST_OUTPUT_BYTES_PER_PIXEL = 0.05 # 压缩后的 PNG (流式响应同时写入缓存)
+COST_FIXED_BYTES = 4 * 1024 * 1024
+COST_NS_PER_PIXEL = {"palette": 11.0, "rgba": 65.0}
+COST_PATTERN_NS_PER_PIXEL = {"diagonal": 3.0, "checkerboard": 2.0} # 图案填充的额外开销 (按所占面积计)
+COST_UNTILED_DIAGONAL_NS_MM = 7.5 # 关闭图案平铺时斜线的额外开销 (ns/像素)，与间距 (mm) 成反比
+COST_PROFILE_FACTOR = {"fast": 1.0, "balanced": 1.0, "smallest": 1.8}
+VECTOR_RENDER_COST = RenderCost(pixels=0, peak_bytes=COST_FIXED_BYTES, cpu_seconds=0.01, strip=False)
+
+
+def _canvas_arguments(scene: Scene, geometry) -> tuple:
+    """
+    返回 (调色板或 None, create_bordered_image / iter_bordered_bands 的参数)。
+    样式颜色不超过 255 种时在单通道的调色板下标上绘制 (内存为 RGBA 的 1/4)，颜色在编码时才附加；
+    否则直接绘制 RGBA。
+    """
+    style_params = scene.style.as_params()
+    palette = style_palette(style_params)
+    if palette:
+        colors = palette_indices(style_params, palette)
+    else:
+        colors = {key: style_params[key] for key in STYLE_COLOR_KEYS}
+    return palette, dict(
+        outer_width_px=geometry.outer_width_px, outer_height_px=geometry.outer_height_px,
+        inner_width_px=geometry.inner_width_px, inner_height_px=geometry.inner_height_px,
+        inner_corner_radius_px=geometry.inner_corner_radius_px,
+        outer_shape_type=scene.outer_shape_type, inner_shape_type=scene.inner_shape_type,
+        # 样式参数 (颜色为 RGBA 元组或调色板下标)
+        outer_border_type=scene.style.outer_border_type,
+        outer_border_pattern_spacing_px=geometry.outer_border_pattern_spacing_px,
+        outer_stroke_width_px=geometry.stroke_width_px,
+        inner_fill_type=scene.style.inner_fill_type,
+        inner_fill_pattern_spacing_px=geometry.inner_fill_pattern_spacing_px,
+        inner_stroke_width_px=geometry.stroke_width_px,
+        diagonal_line_width_px=geometry.diagonal_line_width_px,
+        canvas_mode='L' if palette else 'RGBA',
+        **colors
+    )
+
+
+def uses_strip_encoder(geometry: RasterGeometry) -> bool:
+    """画布是否按水平带生成 (见 iter_png_chunks)；此时 PNG 可以边生成边发送"""
+    return geometry.outer_width_px * geometry.outer_height_px >= STRIP_MIN_PIXELS
+
+
+def png_output_mode(scene: Scene) -> str:
+    """PNG 的像素格式: 'palette' (带 tRNS 的索引 PNG) 或 'rgba'，由样式颜色数和 PALETTE_OUTPUT 决定"""
+    return "palette" if PALETTE_OUTPUT and style_palette(scene.style.as_params()) else "rgba"
+
+
+def png_encoding_fields(scene: Scene, dpi: int) -> dict:
+    """
+    影响 PNG 字节的服务端设置 (用于响应缓存键和 ETag): 像素格式、图案是否平铺，以及是否按水平带编码和每带的行数
+    (决定 IDAT 块的划分)。修改 BORDER_PALETTE_OUTPUT / BORDER_PATTERN_TILING / BORDER_STRIP_* 后
+    旧的缓存条目和 ETag 随之失效。
+    """
+    strip = uses_strip_encoder(scene.rasterize(dpi))
+    return {"output_mode": png_output_mode(scene), "pattern_tiling": PATTERN_TILING,
+            "strip_rows": STRIP_ROWS if strip else None}
+
+
+def estimate_render_cost(scene: Scene, dpi: int, png_profile: str | None = None,
+                         output_format: str = "png") -> RenderCost:
+    """
+    不渲染、只由像素数、输出模式、填充类型和图案间距估计 render_png 的峰值内存和 CPU 时间。
+    矢量输出与分辨率无关，开销为常数。
+    """
+    if output_format != "png":
+        return VECTOR_RENDER_COST
+    geometry = scene.rasterize(dpi)
+    width, height = geometry.outer_width_px, geometry.outer_height_px
+    pixels = width * height
+    output = png_output_mode(scene)
+    strip = uses_strip_encoder(geometry)
+    if strip:
+        peak_bytes = width * min(STRIP_ROWS, height) * COST_BAND_BYTES_PER_PIXEL[output]
+    else:
+        peak_bytes = pixels * COST_BYTES_PER_PIXEL[output]
+    peak_bytes += pixels * COST_OUTPUT_BYTES_PER_PIXEL + COST_FIXED_BYTES
+
+    style = scene.style
+    inner_share = min(1.0, geometry.inner_width_px * geometry.inner_height_px / pixels) if pixels else 0.0
+    ns_per_pixel = COST_NS_PER_PIXEL[output] * COST_PROFILE_FACTOR[resolve_png_profile(png_profile)]
+    for fill_type, spacing_mm, share in (
+            (style.outer_border_type, style.outer_border_pattern_spacing_mm, 1.0 - inner_share),
+            (style.inner_fill_type, style.inner_fill_pattern_spacing_mm, inner_share)):
+        extra = COST_PATTERN_NS_PER_PIXEL.get(fill_type, 0.0)
+        if fill_type == 'diagonal' and not PATTERN_TILING and spacing_mm > 0:
+            extra += COST_UNTILED_DIAGONAL_NS_MM / spacing_mm
+        ns_per_pixel += extra * share
+    return RenderCost(pixels=pixels, peak_bytes=int(peak_bytes), cpu_seconds=pixels * ns_per_pixel * 1e-9, strip=strip)
+
+
+def iter_png_chunks(scene: Scene, dpi: int, png_profile: str | None = None, band_rows: int | None = None):
+    """
+    按水平带生成图像并增量编码，依次产出 PNG 字节块 (文件头、若干 IDAT 块、结尾)。
+    任意时刻只有一条带在内存中，解码后的像素与 render_png 一致。参数无效时抛出 ValueError。
+    """
+    geometry = scene.rasterize(dpi)
+    palette, arguments = _canvas_arguments(scene, geometry)
+    width, height = geometry.outer_width_px, geometry.outer_height_px
+    indexed = palette is not None and PALETTE_OUTPUT
+    writer = PngStreamWriter((width, height), 'P' if indexed else 'RGBA', png_profile, dpi=geometry.dpi,
+                             palette=palette if indexed else None)
+    logging.debug("按水平带生成图像: 画布=%dx%dpx, 每带 %d 行, %s PNG (配置档: %s)",
+                  width, height, band_rows or STRIP_ROWS, '索引' if indexed else 'RGBA', writer.profile)
+    yield writer.header()
+    for _, band in iter_bordered_bands(band_rows=band_rows or STRIP_ROWS, **arguments):
+        if palette is not None and not indexed:
+            with task_metrics.stage("palette"):
+                band = to_rgba_image(band, palette)
+        chunk = writer.write_rows(band)
+        if chunk:
+            yield chunk
+    yield writer.close()
+
+
+def render_png(scene: Scene, dpi: int, png_profile: str | None = None) -> bytes:
+    """
+    按 DPI 光栅化场景并返回 PNG 字节 (png_profile 为 png_encoder 中的编码配置档，为空时使用服务端默认档)。
+    像素数达到 STRIP_MIN_PIXELS 的画布改为按水平带生成 (见 iter_png_chunks)。
+    生成失败时抛出 RenderError。
+    """
+    # --- 1. 换算像素值和保存用的 DPI ---
+    geometry = scene.rasterize(dpi)
+    logging.debug("计算得到的像素: 外框=%dx%d, 内框=%dx%d, 圆角=%d, 描边=%d",
+                  geometry.outer_width_px, geometry.outer_height_px, geometry.inner_width_px, geometry.inner_height_px,
+                  geometry.inner_corner_radius_px, geometry.stroke_width_px)
+    logging.debug("输入 DPI: %d, 调整后保存 DPI (宽, 高): (%.2f, %.2f)", dpi, geometry.dpi[0], geometry.dpi[1])
+    if uses_strip_encoder(geometry):
+        # 压缩后的数据通常远小于画布，拼接后返回
+        return b"".join(iter_png_chunks(scene, dpi, png_profile))
+
+    # --- 2. 调用核心图像生成函数 ---
+    palette, arguments = _canvas_arguments(scene, geometry)
+    logging.debug("调用 create_bordered_image, 外形='%s', 内形='%s', 调色板颜色数=%s",
+                  scene.outer_shape_type, scene.inner_shape_type, len(palette) if palette else 'RGBA')
+    image_obj = create_bordered_image(**arguments)
+
+    # 检查图像是否成功生成
+    if not isinstance(image_obj, Image.Image):
+        logging.error("核心函数 create_bordered_image 未返回有效的 Image 对象。")
+        raise RenderError("图像生成失败 (内部错误)")
+    if palette:
+        # 输出索引 PNG，或者展开为 RGBA (两者解码后的像素一致)
+        with task_metrics.stage("palette"):
+            image_obj = to_palette_image(image_obj, palette) if PALETTE_OUTPUT else to_rgba_image(image_obj, palette)
+
+    # --- 3. 按编码配置档编码为 PNG ---
+    logging.debug("将图像编码为 PNG (配置档: %s)...", png_profile or '默认')
+    # 使用调整后的 DPI 保存为 PNG 格式
+    body = encode_png(image_obj, png_profile, dpi=geometry.dpi)
+    logging.debug("图像已保存到内存。")
+    return body
+
+
+def render_vector(scene: Scene, output_format: str) -> bytes:
+    """
+    生成矢量图像 (output_format 为 'svg' 或 'pdf') 并返回其字节。
+    与 DPI 无关，耗时只与图元数量有关。格式不支持时抛出 ValueError。
+    """
+    encoder = VECTOR_ENCODERS.get(output_format)
+    if encoder is None:
+        raise ValueError(f"不支持的矢量格式: {output_format}")
+    design = build_vector_design(scene)
+    body = encoder(design)
+    logging.debug("矢量图像已生成: 格式=%s, 图元=%d, 大小=%d 字节", output_format, len(design['items']), len(body))
+    return body
+
+
+def warm_up():
+    """
+    工作进程预热: 渲染并编码一张很小的图像，
+    提前完成 Pillow 插件注册、numpy 初始化等一次性开销。
+    """
+    from image_generator import STYLE1_PARAMS
+    render_png(build_scene(STYLE1_PARAMS, 10.0, 10.0, 'rectangle', 6.0, 6.0, 'rectangle', 1.0), 72)
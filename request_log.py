@@ -0,0 +1,193 @@
+# request_log.py
+# -*- coding: utf-8 -*-
+"""
+低开销的日志配置和请求汇总日志。
+- configure_logging(): 根 logger 只挂一个 DeferredQueueHandler，记录入队后由 QueueListener 的后台线程格式化并输出，
+  处理请求的线程不做格式化和 I/O；队列满时丢弃记录而不是阻塞；
+- RateLimitFilter: 同一条日志语句 (logger + 源码位置) 的 WARNING 及以上记录在每个时间窗口内最多输出若干条，
+  被抑制的条数附加在窗口之后的第一条记录中 (例如负载过高时每个请求都会触发的 503 警告)；
+- RequestLog: 每个单图请求结束时输出一条汇总记录 (参数、缓存、状态码、各阶段耗时)，渲染过程中的进度信息为 DEBUG。
+  高频路径 (预览、缓存命中、304) 上成功且不慢的请求按 sample_rate 抽样，错误和慢请求总是记录。
+日志参数在后台线程中才格式化，因此只应传入不会再被修改的值 (用 %-格式而不是 f-string，级别未启用时也不会格式化)。
+"""
+
+import atexit
+import logging
+import logging.handlers
+import queue
+import random
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+# 汇总记录中按抽样处理的缓存结果
+HIGH_VOLUME_CACHE = ("hit", "not_modified")
+
+_current = ContextVar("request_log_entry", default=None)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler.prepare 默认在调用线程中格式化消息；这里原样入队，由 QueueListener 的线程格式化。
+    队列已满时丢弃记录 (计入 dropped)。
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "dropped": self.dropped,
+                "suppressed": sum(getattr(f, "suppressed", 0) for f in self.filters)}
+
+
+class RateLimitFilter(logging.Filter):
+    """同一条语句的 WARNING 及以上记录每 period 秒最多 burst 条"""
+
+    def __init__(self, burst: int = 10, period: float = 10.0):
+        super().__init__()
+        self.burst = burst
+        self.period = period
+        self._lock = threading.Lock()
+        self._windows = {} # (logger, 文件, 行号) -> [窗口开始时间, 已输出条数, 已抑制条数]
+        self.suppressed = 0
+
+    def filter(self, record) -> bool:
+        if record.levelno < logging.WARNING or self.burst <= 0:
+            return True
+        key = (record.name, record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.period:
+                suppressed = window[2] if window is not None else 0
+                window = self._windows[key] = [now, 0, 0]
+            else:
+                suppressed = 0
+            if window[1] >= self.burst:
+                window[2] += 1
+                self.suppressed += 1
+                return False
+            window[1] += 1
+        if suppressed:
+            record.msg = f"{record.msg} (此前 {self.period:g} 秒内另有 {suppressed} 条相同的日志被抑制)"
+        return True
+
+
+def configure_logging(level: str = "INFO", queue_size: int = 10000, rate_limit: int = 10,
+                      rate_period: float = 10.0) -> DeferredQueueHandler | None:
+    """
+    配置根 logger: 异步队列 + 输出到 stderr 的后台线程 + 警告限流。
+    与 logging.basicConfig 相同，根 logger 已有处理器时 (例如由部署环境配置) 只设置级别，返回 None。
+    """
+    root = logging.getLogger()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    if root.handlers:
+        return None
+    stream = logging.StreamHandler()
+    stream.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler = DeferredQueueHandler(queue.Queue(max(0, queue_size)))
+    handler.addFilter(RateLimitFilter(rate_limit, rate_period))
+    listener = logging.handlers.QueueListener(handler.queue, stream, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop) # 退出时输出队列中剩余的记录
+    root.addHandler(handler)
+    return handler
+
+
+class RequestEntry:
+    """一个请求的汇总字段和各阶段耗时 (由 note() / timing() 填写)"""
+
+    __slots__ = ("endpoint", "fields", "timings", "status_code", "started", "deferred")
+
+    def __init__(self, endpoint: str, fields: dict):
+        self.endpoint = endpoint
+        self.fields = fields
+        self.timings = {}
+        self.status_code = 200
+        self.started = time.perf_counter()
+        self.deferred = False # 为 True 时 track() 结束时不输出，由调用者之后调用 RequestLog.finish
+
+    def __str__(self):
+        # 只在后台线程格式化记录时调用；元组 (例如宽和高) 写为 60x92
+        parts = [f"{name}={'x'.join(f'{v:g}' for v in value) if isinstance(value, tuple) else value}"
+                 for name, value in self.fields.items() if value is not None]
+        parts.extend(f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.timings.items())
+        return " ".join(parts)
+
+
+def note(**fields):
+    """为当前请求的汇总记录添加字段 (不在请求中时忽略)"""
+    entry = _current.get()
+    if entry is not None:
+        entry.fields.update(fields)
+
+
+def timing(name: str, seconds: float):
+    """累加当前请求某个阶段的耗时 (不在请求中时忽略)"""
+    entry = _current.get()
+    if entry is not None:
+        entry.timings[name] = entry.timings.get(name, 0.0) + seconds
+
+
+class RequestLog:
+    def __init__(self, logger: str = "border.request", sample_rate: float = 1.0, slow_seconds: float = 1.0):
+        """
+        sample_rate: 高频路径 (预览、缓存命中、304) 上成功请求的记录比例 (0-1)；
+        slow_seconds: 耗时不少于该值的请求总是记录。
+        """
+        self.logger = logging.getLogger(logger)
+        self.sample_rate = min(1.0, max(0.0, sample_rate))
+        self.slow_seconds = slow_seconds
+
+    @contextmanager
+    def track(self, endpoint: str, **fields):
+        """
+        with request_log.track("style1", dpi=300, ...) as entry: ...; entry.status_code = response.status_code
+        代码块结束时输出汇总记录；抛出的异常按其 status_code 属性 (没有时为 500) 记录。
+        流式响应在代码块中设置 entry.deferred = True，响应体发送完毕后调用 finish(entry) 输出
+        (此时 note() / timing() 不再作用于该记录，应直接修改 entry.fields / entry.timings)。
+        """
+        entry = RequestEntry(endpoint, fields)
+        token = _current.set(entry)
+        try:
+            yield entry
+        except Exception as e:
+            entry.status_code = getattr(e, "status_code", 500)
+            entry.deferred = False
+            raise
+        finally:
+            _current.reset(token)
+            if not entry.deferred:
+                self.finish(entry)
+
+    def finish(self, entry: RequestEntry):
+        """输出 track() 产生的汇总记录，耗时到调用时为止"""
+        self.emit(entry, time.perf_counter() - entry.started)
+
+    def emit(self, entry: RequestEntry, seconds: float):
+        status = entry.status_code
+        if status >= 500 and status != 503: # 503 是负载过高时的主动拒绝
+            level = logging.ERROR
+        elif status >= 400:
+            level = logging.WARNING
+        else:
+            level = logging.INFO
+        if not self.logger.isEnabledFor(level):
+            return
+        high_volume = entry.fields.get("preview") or entry.fields.get("cache") in HIGH_VOLUME_CACHE
+        if level == logging.INFO and high_volume and seconds < self.slow_seconds and self.sample_rate < 1.0 \
+                and random.random() >= self.sample_rate:
+            return
+        self.logger.log(level, "请求 %s: 状态=%d, 耗时=%.1fms, %s", entry.endpoint, status, seconds * 1000, entry)
@@ -0,0 +1,219 @@
+# response_cache.py
+# -*- coding: utf-8 -*-
+"""
+按内容寻址的已编码图像缓存。
+键为请求参数 (样式、DPI、几何参数等) 规范化后的哈希，同时用作响应的强 ETag。
+包含一个按字节数限制的内存层，以及一个可选的、按总大小淘汰的磁盘层。
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# 渲染输出发生变化时递增，使旧的缓存条目和客户端持有的 ETag 失效
+RENDERER_VERSION = 4
+
+
+def make_cache_key(**params) -> str:
+    """
+    返回参数的规范化 SHA-256 十六进制摘要。
+    参数会按键排序后序列化为 JSON (元组视为列表)，因此与传参顺序无关。
+    """
+    canonical = json.dumps({"renderer_version": RENDERER_VERSION, **params},
+                           sort_keys=True, separators=(',', ':'), ensure_ascii=True)
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def etag_for_key(key: str) -> str:
+    """由缓存键得到强 ETag (带引号)"""
+    return f'"{key}"'
+
+
+def if_none_match_hits(if_none_match: str | None, etag: str) -> bool:
+    """判断 If-None-Match 请求头是否与 etag 匹配 (按 RFC 7232 使用弱比较，支持 '*')"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+class ResponseCache:
+    """
+    两级缓存: 内存 LRU (按总字节数限制) + 可选的磁盘目录 (按总字节数淘汰最久未访问的文件)。
+    磁盘层命中时会把内容提升到内存层。get/put 为协程: 内存层在事件循环中直接访问，
+    磁盘读写和淘汰在线程中执行 (asyncio.to_thread)，不阻塞事件循环。
+    磁盘层的大小和访问顺序记录在内存索引中 (启动时扫描一次目录)，淘汰时不再遍历目录；
+    其他进程写入同一目录的文件在本进程读到时加入索引。
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str | None = None, disk_max_bytes: int = 0):
+        self.max_bytes = max(0, int(max_bytes))
+        self.disk_dir = disk_dir or None
+        self.disk_max_bytes = max(0, int(disk_max_bytes))
+        self._lock = threading.Lock()
+        self._entries = OrderedDict() # key -> bytes，按最近使用排序
+        self._bytes = 0
+        self._disk_lock = threading.Lock()
+        self._disk_index = OrderedDict() # key -> 文件大小，按最近访问排序
+        self._disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            for path, size, _ in sorted(self._scan_disk(), key=lambda entry: entry[2]):
+                self._disk_index[os.path.basename(path)[:-4]] = size
+            self._disk_bytes = sum(self._disk_index.values())
+
+    # --- 内存层 ---
+
+    def _memory_put(self, key, body):
+        if not self.max_bytes or len(body) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= len(previous)
+            self._entries[key] = body
+            self._bytes += len(body)
+            while self._bytes > self.max_bytes: # 淘汰最久未使用的条目
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+
+    # --- 磁盘层 ---
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + '.bin')
+
+    def _scan_disk(self):
+        """返回磁盘层中所有条目的 (路径, 大小, 最后访问时间)"""
+        entries = []
+        for root, _, files in os.walk(self.disk_dir):
+            for name in files:
+                if not name.endswith('.bin'): continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, st.st_size, st.st_mtime))
+        return entries
+
+    def _disk_get(self, key):
+        """读取磁盘层的条目 (在线程中执行)"""
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                body = f.read()
+            os.utime(path) # 更新修改时间，作为重启后重建索引时的访问时间
+        except FileNotFoundError:
+            with self._disk_lock: # 已被淘汰 (可能由其他进程)
+                self._disk_bytes -= self._disk_index.pop(key, 0)
+            return None
+        except OSError as e:
+            logging.warning("读取磁盘缓存失败: %s: %s", path, e)
+            return None
+        with self._disk_lock:
+            if key in self._disk_index:
+                self._disk_index.move_to_end(key)
+            else: # 其他进程写入的文件
+                self._disk_index[key] = len(body)
+                self._disk_bytes += len(body)
+        return body
+
+    def _disk_put(self, key, body):
+        """写入磁盘层的条目，超出上限时淘汰 (在线程中执行)"""
+        if not self.disk_max_bytes or len(body) > self.disk_max_bytes:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先写临时文件再原子替换，避免其他进程读到不完整的内容
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning("写入磁盘缓存失败: %s: %s", path, e)
+            return
+        with self._disk_lock:
+            self._disk_bytes += len(body) - self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(body)
+            evicted = self._select_disk_evictions() if self._disk_bytes > self.disk_max_bytes else []
+        for evicted_key in evicted: # 在锁外删除文件
+            try:
+                os.remove(self._disk_path(evicted_key))
+            except OSError:
+                pass
+
+    def _select_disk_evictions(self) -> list:
+        """
+        从索引中移除最久未访问的条目，直到总大小降到上限的 90% 以下，返回被移除的键
+        (调用者需持有 _disk_lock，并在释放锁后删除对应的文件)
+        """
+        evicted = []
+        target = self.disk_max_bytes * 0.9
+        while self._disk_index and self._disk_bytes > target:
+            key, size = self._disk_index.popitem(last=False)
+            self._disk_bytes -= size
+            evicted.append(key)
+        self.disk_evictions += len(evicted)
+        return evicted
+
+    # --- 公共接口 ---
+
+    async def get(self, key: str) -> bytes | None:
+        """按键查找，依次查询内存层和磁盘层；未命中返回 None"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.memory_hits += 1
+                return body
+        if self.disk_dir:
+            body = await asyncio.to_thread(self._disk_get, key)
+            if body is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                self._memory_put(key, body)
+                return body
+        with self._lock:
+            self.misses += 1
+        return None
+
+    async def put(self, key: str, body: bytes):
+        """写入内存层和 (如果启用) 磁盘层"""
+        self._memory_put(key, body)
+        if self.disk_dir:
+            await asyncio.to_thread(self._disk_put, key, body)
+
+    def stats(self) -> dict:
+        """返回各层的命中/未命中/淘汰计数器和当前占用"""
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk_evictions": self.disk_evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes if self.disk_dir else 0,
+            }
@@ -0,0 +1,169 @@
+# scene.py
+# -*- coding: utf-8 -*-
+"""
+与分辨率无关的场景描述: 由毫米/磅参数和样式构建一次 (同时完成参数校验)，之后只读。
+光栅渲染 (render_service.render_png)、矢量渲染 (vector_renderer) 和预览渲染都从同一个 Scene 出发，
+同一个 Scene 可以按不同 DPI / 格式多次输出。
+Scene 是冻结的 dataclass，可哈希，可直接作为内存缓存的键；cache_fields() 给出可序列化的字段，用于响应缓存键。
+"""
+
+import math
+from dataclasses import dataclass, asdict, fields
+
+from image_generator import mm_to_pixels, pt_to_pixels
+
+PT_TO_MM = 25.4 / 72.0
+
+
+@dataclass(frozen=True, slots=True)
+class SceneStyle:
+    """样式参数 (与 STYLE1_PARAMS / STYLE2_PARAMS 的键一致)，颜色为 RGBA 元组或 None"""
+    outer_border_type: str
+    outer_border_color1: tuple | None
+    outer_border_color2: tuple | None
+    outer_border_pattern_spacing_mm: float
+    outer_stroke_color: tuple | None
+    inner_fill_type: str
+    inner_fill_color1: tuple | None
+    inner_fill_color2: tuple | None
+    inner_fill_pattern_spacing_mm: float
+    inner_stroke_color: tuple | None
+    stroke_width_pt: float
+    diagonal_line_width_pt: float
+
+    @classmethod
+    def from_params(cls, style_params: dict) -> "SceneStyle":
+        """由样式字典构建 (列表形式的颜色转为元组，以保证可哈希)"""
+        values = {}
+        for field in fields(cls):
+            value = style_params[field.name]
+            values[field.name] = tuple(value) if isinstance(value, list) else value
+        return cls(**values)
+
+    def as_params(self) -> dict:
+        """还原为样式字典"""
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+
+@dataclass(frozen=True, slots=True)
+class RasterGeometry:
+    """场景在某个 DPI 下的像素参数 (create_bordered_image 的几何参数 + 保存用的实际 DPI)"""
+    outer_width_px: int
+    outer_height_px: int
+    inner_width_px: int
+    inner_height_px: int
+    inner_corner_radius_px: int
+    stroke_width_px: int
+    diagonal_line_width_px: int
+    outer_border_pattern_spacing_px: int
+    inner_fill_pattern_spacing_px: int
+    dpi: tuple # 调整后的 (水平, 垂直) DPI，使像素尺寸精确对应毫米尺寸
+
+
+@dataclass(frozen=True, slots=True)
+class Scene:
+    """
+    一张图像的完整描述 (毫米/磅)。形状类型原样保存，不支持的形状由各渲染器按矩形处理。
+    inner_corner_radius_mm 只对矩形内框有效 (其它形状为 0)，未按内框尺寸截断:
+    光栅路径在像素上截断 (与以往的舍入一致)，矢量路径使用 corner_radius_mm。
+    """
+    style: SceneStyle
+    outer_width_mm: float
+    outer_height_mm: float
+    outer_shape_type: str
+    inner_width_mm: float
+    inner_height_mm: float
+    inner_shape_type: str
+    inner_corner_radius_mm: float
+
+    # --- 派生几何 (毫米) ---
+
+    @property
+    def has_inner_area(self) -> bool:
+        return self.inner_width_mm > 0 and self.inner_height_mm > 0
+
+    @property
+    def has_visible_border(self) -> bool:
+        return self.inner_width_mm < self.outer_width_mm or self.inner_height_mm < self.outer_height_mm
+
+    @property
+    def inner_box_mm(self) -> tuple:
+        """居中的内框 (x0, y0, x1, y1)"""
+        x0 = (self.outer_width_mm - self.inner_width_mm) / 2.0
+        y0 = (self.outer_height_mm - self.inner_height_mm) / 2.0
+        return (x0, y0, x0 + self.inner_width_mm, y0 + self.inner_height_mm)
+
+    @property
+    def corner_radius_mm(self) -> float:
+        """截断到内框短边一半的圆角半径"""
+        if not self.has_inner_area:
+            return 0.0
+        return min(self.inner_corner_radius_mm, self.inner_width_mm / 2.0, self.inner_height_mm / 2.0)
+
+    @property
+    def stroke_width_mm(self) -> float:
+        return self.style.stroke_width_pt * PT_TO_MM
+
+    @property
+    def diagonal_line_width_mm(self) -> float:
+        return self.style.diagonal_line_width_pt * PT_TO_MM
+
+    # --- 输出 ---
+
+    def fit_dpi(self, max_px: int) -> float:
+        """使图像长边不超过 max_px 像素的 DPI (用于按屏幕尺寸生成预览)"""
+        return max_px * 25.4 / max(self.outer_width_mm, self.outer_height_mm)
+
+    def rasterize(self, dpi: int) -> RasterGeometry:
+        """换算为指定 DPI 下的像素参数"""
+        style = self.style
+        outer_width_px = mm_to_pixels(self.outer_width_mm, dpi)
+        outer_height_px = mm_to_pixels(self.outer_height_mm, dpi)
+        outer_spacing_px = mm_to_pixels(style.outer_border_pattern_spacing_mm, dpi)
+        inner_spacing_px = mm_to_pixels(style.inner_fill_pattern_spacing_mm, dpi)
+        # 确保图案间距至少为1像素 (如果原始毫米值>0)
+        if style.outer_border_pattern_spacing_mm > 0 and outer_spacing_px < 1:
+            outer_spacing_px = 1
+        if style.inner_fill_pattern_spacing_mm > 0 and inner_spacing_px < 1:
+            inner_spacing_px = 1
+        return RasterGeometry(
+            outer_width_px=outer_width_px,
+            outer_height_px=outer_height_px,
+            inner_width_px=mm_to_pixels(self.inner_width_mm, dpi),
+            inner_height_px=mm_to_pixels(self.inner_height_mm, dpi),
+            inner_corner_radius_px=mm_to_pixels(self.inner_corner_radius_mm, dpi),
+            stroke_width_px=pt_to_pixels(style.stroke_width_pt, dpi),
+            diagonal_line_width_px=pt_to_pixels(style.diagonal_line_width_pt, dpi),
+            outer_border_pattern_spacing_px=outer_spacing_px,
+            inner_fill_pattern_spacing_px=inner_spacing_px,
+            dpi=(outer_width_px * 25.4 / self.outer_width_mm, outer_height_px * 25.4 / self.outer_height_mm),
+        )
+
+    def cache_fields(self) -> dict:
+        """可 JSON 序列化的全部字段 (用于 response_cache.make_cache_key)"""
+        return asdict(self)
+
+
+def build_scene(style_params: dict,
+                outer_width_mm: float, outer_height_mm: float, outer_shape_type: str,
+                inner_width_mm: float, inner_height_mm: float, inner_shape_type: str,
+                inner_corner_radius_mm: float) -> Scene:
+    """校验参数并构建 Scene。参数无效时抛出 ValueError。"""
+    values = {
+        "outer_width_mm": outer_width_mm, "outer_height_mm": outer_height_mm,
+        "inner_width_mm": inner_width_mm, "inner_height_mm": inner_height_mm,
+        "inner_corner_radius_mm": inner_corner_radius_mm,
+    }
+    for name, value in values.items():
+        values[name] = float(value)
+        if not math.isfinite(values[name]):
+            raise ValueError(f"{name} 必须是有限数值")
+    if values["outer_width_mm"] <= 0 or values["outer_height_mm"] <= 0:
+        raise ValueError("外框尺寸必须大于0")
+    if values["inner_width_mm"] < 0 or values["inner_height_mm"] < 0:
+        raise ValueError("内框尺寸不能为负数")
+    # 圆角只对矩形内框有意义
+    radius = values.pop("inner_corner_radius_mm")
+    radius = max(0.0, radius) if inner_shape_type == 'rectangle' else 0.0
+    return Scene(style=SceneStyle.from_params(style_params), outer_shape_type=outer_shape_type,
+                 inner_shape_type=inner_shape_type, inner_corner_radius_mm=radius, **values)
@@ -1,29 +1,30 @@
 // static/script.js
 
 document.addEventListener('DOMContentLoaded', () => {
-    // ... (获取 DOM 元素的部分不变) ...
     const form = document.getElementById('image-form');
     const generateButton = document.getElementById('generate-button');
-    const resultContainer1 = document.getElementById('result-style1');
-    const resultContainer2 = document.getElementById('result-style2');
-    const imgElement1 = document.getElementById('img-style1');
-    const imgElement2 = document.getElementById('img-style2');
-    const loadingIndicator1 = document.getElementById('loading-style1');
-    const loadingIndicator2 = document.getElementById('loading-style2');
-    const errorDisplay1 = document.getElementById('error-style1');
-    const errorDisplay2 = document.getElementById('error-style2');
-    const downloadLink1 = document.getElementById('download-style1');
-    const downloadLink2 = document.getElementById('download-style2');
     const innerShapeSelect = document.getElementById('inner_shape_type');
     const cornerRadiusGroup = document.getElementById('corner-radius-group');
     const cornerRadiusInput = document.getElementById('inner_corner_radius_mm');
 
-    let previousObjectURL1 = null;
-    let previousObjectURL2 = null;
+    // 每种样式的页面元素和状态: 提交时只请求低分辨率预览 (立即显示)，
+    // 点击下载时才按表单中的 DPI 请求完整分辨率的图像
+    const styles = ['style1', 'style2'].map((name, index) => ({
+        name,
+        label: `样式${index + 1}`,
+        endpoint: `/generate_image_${name}/`,
+        container: document.getElementById(`result-${name}`),
+        img: document.getElementById(`img-${name}`),
+        loading: document.getElementById(`loading-${name}`),
+        error: document.getElementById(`error-${name}`),
+        download: document.getElementById(`download-${name}`),
+        previewURL: null,   // 预览图像的 Object URL
+        fullURL: null,      // 完整分辨率图像的 Object URL (首次下载时获取)
+        formData: null,     // 生成预览时的表单参数，下载时使用相同参数
+    }));
 
     function toggleCornerRadiusInput() {
-        // ... (不变) ...
-         if (innerShapeSelect.value === 'rectangle') {
+        if (innerShapeSelect.value === 'rectangle') {
             cornerRadiusGroup.style.display = 'block';
             cornerRadiusInput.required = true;
         } else {
@@ -34,176 +35,174 @@ document.addEventListener('DOMContentLoaded', () => {
     toggleCornerRadiusInput();
     innerShapeSelect.addEventListener('change', toggleCornerRadiusInput);
 
-    function resetStatusDisplays() {
-        // ... (不变) ...
-        loadingIndicator1.style.display = 'none';
-        loadingIndicator2.style.display = 'none';
-        errorDisplay1.style.display = 'none';
-        errorDisplay2.style.display = 'none';
-        errorDisplay1.textContent = '';
-        errorDisplay2.textContent = '';
-        imgElement1.style.display = 'none';
-        imgElement1.src = '';
-        imgElement2.style.display = 'none';
-        imgElement2.src = '';
-        downloadLink1.style.display = 'none';
-        downloadLink1.href = '#';
-        downloadLink2.style.display = 'none';
-        downloadLink2.href = '#';
-
-        if (previousObjectURL1) {
-            URL.revokeObjectURL(previousObjectURL1);
-            console.log("已释放之前的 Object URL 1:", previousObjectURL1);
-            previousObjectURL1 = null;
+    function releaseObjectURLs(style) {
+        for (const key of ['previewURL', 'fullURL']) {
+            if (style[key]) {
+                URL.revokeObjectURL(style[key]);
+                console.log(`已释放之前的 Object URL (${style.label}):`, style[key]);
+                style[key] = null;
+            }
         }
-        if (previousObjectURL2) {
-            URL.revokeObjectURL(previousObjectURL2);
-            console.log("已释放之前的 Object URL 2:", previousObjectURL2);
-            previousObjectURL2 = null;
+    }
+
+    function resetStatusDisplays() {
+        for (const style of styles) {
+            style.loading.style.display = 'none';
+            style.error.style.display = 'none';
+            style.error.textContent = '';
+            style.img.style.display = 'none';
+            style.img.src = '';
+            style.download.style.display = 'none';
+            style.download.href = '#';
+            releaseObjectURLs(style);
+            style.formData = null;
+            style.container.style.display = 'block';
         }
-        resultContainer1.style.display = 'block';
-        resultContainer2.style.display = 'block';
         generateButton.disabled = false;
         generateButton.textContent = '生成图像';
     }
 
-    form.addEventListener('submit', async (event) => {
+    function showError(style, message) {
+        style.error.textContent = message;
+        style.error.style.display = 'block';
+    }
+
+    // 发送请求并返回图像 Blob；HTTP 错误时抛出带服务器错误信息的 Error
+    async function fetchImage(style, formData) {
+        const response = await fetch(style.endpoint, { method: 'POST', body: formData });
+        console.log(`${style.label} fetch 响应状态:`, response.status, response.ok);
+        if (!response.ok) {
+            let errorMessage = `服务器错误 (状态码: ${response.status})`;
+            try {
+                const errorJson = await response.json();
+                errorMessage = errorJson.detail || errorMessage;
+            } catch (e) { console.warn(`无法解析${style.label}的错误响应体为 JSON`); }
+            throw new Error(errorMessage);
+        }
+        const blob = await response.blob();
+        if (blob.size === 0) { // 检查返回的 Blob 是否为空
+            throw new Error("服务器返回了空的图像数据");
+        }
+        return blob;
+    }
+
+    // 生成并显示预览 (长边不超过显示区域的物理像素数)
+    async function renderPreview(style, formData) {
+        const previewData = new FormData();
+        for (const [key, value] of formData.entries()) previewData.append(key, value);
+        previewData.append('preview', 'true');
+        const displayWidth = style.container.clientWidth || 400;
+        previewData.append('preview_max_px', String(Math.min(4096, Math.max(16, Math.round(displayWidth * (window.devicePixelRatio || 1))))));
+
+        style.loading.style.display = 'block';
+        try {
+            const blob = await fetchImage(style, previewData);
+            style.previewURL = URL.createObjectURL(blob);
+            style.formData = formData;
+            style.img.src = style.previewURL;
+            style.img.style.display = 'block';
+            style.download.href = '#';
+            style.download.style.display = 'inline-block';
+            console.log(`${style.label} 预览已更新`);
+        } catch (error) {
+            console.error(`${style.label}预览生成失败:`, error);
+            showError(style, `${style.label}生成失败: ${error.message}`);
+        } finally {
+            style.loading.style.display = 'none';
+        }
+    }
+
+    // 点击下载: 第一次点击时请求完整分辨率图像，获取后再触发下载
+    async function handleDownload(style, event) {
+        if (style.fullURL) return; // 已获取，使用链接的默认下载行为
         event.preventDefault();
-        console.log("表单提交事件触发 - 开始");
-        resetStatusDisplays();
+        if (!style.formData) return;
+        const originalText = style.download.textContent;
+        style.download.textContent = '正在生成完整分辨率图像...';
+        try {
+            const blob = await fetchImage(style, style.formData);
+            style.fullURL = URL.createObjectURL(blob);
+            style.download.href = style.fullURL;
+            style.download.click();
+        } catch (error) {
+            console.error(`${style.label}完整图像生成失败:`, error);
+            showError(style, `${style.label}下载失败: ${error.message}`);
+        } finally {
+            style.download.textContent = originalText;
+        }
+    }
 
-        loadingIndicator1.style.display = 'block';
-        loadingIndicator2.style.display = 'block';
-        generateButton.disabled = true;
-        generateButton.textContent = '正在生成中...';
+    for (const style of styles) {
+        style.download.addEventListener('click', (event) => handleDownload(style, event));
+    }
 
-        const formData = new FormData(form);
-        const requestOptions = { method: 'POST', body: formData };
-
-        console.log("开始并行发送 fetch 请求...");
-        const results = await Promise.allSettled([
-            fetch('/generate_image_style1/', requestOptions),
-            fetch('/generate_image_style2/', requestOptions)
-        ]);
-        console.log("两个 fetch 请求已完成 (settled)。结果:", results);
-
-        // --- 处理样式1的请求结果 ---
-        console.log("--- 开始处理样式 1 ---");
-        const result1 = results[0];
-        if (result1.status === 'fulfilled') { // 请求成功完成
-            const response = result1.value;
-            console.log("样式1 fetch 响应状态:", response.status, response.ok);
-            if (response.ok) { // HTTP 状态 OK
-                try {
-                    console.log("样式1: 尝试获取 Blob...");
-                    const blob = await response.blob();
-                    console.log("样式1 Blob 获取成功:", blob);
-                    if (blob.size === 0) { // 检查返回的 Blob 是否为空
-                         console.error("样式1: 服务器返回了空的图像数据!");
-                         throw new Error("服务器返回了空的图像数据");
-                    }
-                    const objectURL = URL.createObjectURL(blob);
-                    console.log("样式1 Object URL 创建:", objectURL);
-                    previousObjectURL1 = objectURL; // 保存新 URL
-
-                    // 确认 DOM 元素存在
-                    if (!imgElement1 || !downloadLink1) {
-                        console.error("样式1: 无法找到 img 或 download 元素!");
-                        throw new Error("页面元素丢失");
-                    }
-
-                    imgElement1.src = objectURL;
-                    imgElement1.style.display = 'block';
-                    downloadLink1.href = objectURL;
-                    downloadLink1.style.display = 'inline-block';
-                    console.log("样式1 图像和下载链接已更新");
-                } catch (error) {
-                    console.error('处理样式1响应时出错:', error);
-                    errorDisplay1.textContent = `处理图像数据时出错: ${error.message}`;
-                    errorDisplay1.style.display = 'block';
-                    downloadLink1.style.display = 'none'; // 确保出错时隐藏下载
+    // --- 实时预览 (WebSocket): 修改参数时发送最新参数，服务端防抖并只返回最新的预览 ---
+    let previewSocket = null;
+    let updateId = 0;
+    let pendingHeader = null; // 收到的预览头部，下一条二进制消息为其 PNG
+
+    function connectPreviewSocket() {
+        const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
+        previewSocket = new WebSocket(`${protocol}//${window.location.host}/ws/preview`);
+        previewSocket.binaryType = 'blob';
+        previewSocket.addEventListener('message', (event) => {
+            if (typeof event.data === 'string') {
+                const message = JSON.parse(event.data);
+                if (message.type === 'preview') {
+                    pendingHeader = message;
+                } else if (message.type === 'error') {
+                    console.warn("实时预览失败:", message);
                 }
-            } else { // HTTP 状态不 OK
-                let errorMessage = `服务器错误 (状态码: ${response.status})`;
-                try {
-                    const errorJson = await response.json();
-                    errorMessage = errorJson.detail || errorMessage;
-                } catch (e) { console.warn("无法解析样式1的错误响应体为 JSON"); }
-                console.error('样式1请求失败:', errorMessage);
-                errorDisplay1.textContent = `样式1生成失败: ${errorMessage}`;
-                errorDisplay1.style.display = 'block';
-                downloadLink1.style.display = 'none';
+                return;
             }
-        } else { // 请求本身失败
-            console.error('样式1 fetch 请求失败:', result1.reason);
-            errorDisplay1.textContent = `样式1网络请求失败: ${result1.reason}`;
-            errorDisplay1.style.display = 'block';
-            downloadLink1.style.display = 'none';
+            const header = pendingHeader;
+            pendingHeader = null;
+            const style = header && styles.find((item) => item.name === header.style);
+            if (!style || header.id !== updateId) return; // 已过期的预览
+            releaseObjectURLs(style);
+            style.previewURL = URL.createObjectURL(event.data);
+            style.formData = new FormData(form);
+            style.img.src = style.previewURL;
+            style.img.style.display = 'block';
+            style.error.style.display = 'none';
+            style.download.href = '#';
+            style.download.style.display = 'inline-block';
+        });
+        previewSocket.addEventListener('close', () => { previewSocket = null; });
+    }
+
+    function sendPreviewUpdate() {
+        if (!form.checkValidity()) return;
+        if (!previewSocket) connectPreviewSocket();
+        const update = { id: ++updateId };
+        for (const [key, value] of new FormData(form).entries()) {
+            if (key.endsWith('_mm')) update[key] = Number(value);
+            else if (key.endsWith('_type')) update[key] = value;
         }
-        loadingIndicator1.style.display = 'none';
-        console.log("--- 样式 1 处理结束 ---");
-
-
-        // --- 处理样式2的请求结果 ---
-        console.log("--- 开始处理样式 2 ---");
-        const result2 = results[1];
-        if (result2.status === 'fulfilled') { // 请求成功完成
-            const response = result2.value;
-            console.log("样式2 fetch 响应状态:", response.status, response.ok);
-             if (response.ok) { // HTTP 状态 OK
-                try {
-                    console.log("样式2: 尝试获取 Blob...");
-                    const blob = await response.blob();
-                    console.log("样式2 Blob 获取成功:", blob);
-                     if (blob.size === 0) {
-                         console.error("样式2: 服务器返回了空的图像数据!");
-                         throw new Error("服务器返回了空的图像数据");
-                    }
-                    const objectURL = URL.createObjectURL(blob);
-                    console.log("样式2 Object URL 创建:", objectURL);
-                    previousObjectURL2 = objectURL; // 保存新 URL
-
-                    // 确认 DOM 元素存在
-                    if (!imgElement2 || !downloadLink2) {
-                        console.error("样式2: 无法找到 img 或 download 元素!");
-                        throw new Error("页面元素丢失");
-                    }
-
-                    imgElement2.src = objectURL;
-                    imgElement2.style.display = 'block';
-                    downloadLink2.href = objectURL;
-                    downloadLink2.style.display = 'inline-block';
-                    console.log("样式2 图像和下载链接已更新");
-                } catch (error) {
-                    console.error('处理样式2响应时出错:', error);
-                    errorDisplay2.textContent = `处理图像数据时出错: ${error.message}`;
-                    errorDisplay2.style.display = 'block';
-                    downloadLink2.style.display = 'none'; // 确保出错时隐藏下载
-                }
-            } else { // HTTP 状态不 OK
-                let errorMessage = `服务器错误 (状态码: ${response.status})`;
-                try {
-                    const errorJson = await response.json();
-                    errorMessage = errorJson.detail || errorMessage;
-                } catch (e) { console.warn("无法解析样式2的错误响应体为 JSON"); }
-                console.error('样式2请求失败:', errorMessage);
-                errorDisplay2.textContent = `样式2生成失败: ${errorMessage}`;
-                errorDisplay2.style.display = 'block';
-                downloadLink2.style.display = 'none';
-            }
-        } else { // 请求本身失败
-            console.error('样式2 fetch 请求失败:', result2.reason);
-            errorDisplay2.textContent = `样式2网络请求失败: ${result2.reason}`;
-            errorDisplay2.style.display = 'block';
-            downloadLink2.style.display = 'none';
+        const displayWidth = styles[0].container.clientWidth || 400;
+        update.preview_max_px = Math.min(4096, Math.max(16, Math.round(displayWidth * (window.devicePixelRatio || 1))));
+        const payload = JSON.stringify(update);
+        if (previewSocket.readyState === WebSocket.OPEN) {
+            previewSocket.send(payload);
+        } else {
+            previewSocket.addEventListener('open', () => previewSocket.send(payload), { once: true });
         }
-        loadingIndicator2.style.display = 'none';
-        console.log("--- 样式 2 处理结束 ---");
+    }
+    form.addEventListener('input', sendPreviewUpdate);
+
+    form.addEventListener('submit', async (event) => {
+        event.preventDefault();
+        console.log("表单提交事件触发 - 开始");
+        resetStatusDisplays();
+        generateButton.disabled = true;
+        generateButton.textContent = '正在生成预览...';
 
+        const formData = new FormData(form);
+        await Promise.allSettled(styles.map((style) => renderPreview(style, formData)));
 
         // 所有处理完成后，重新启用提交按钮
         generateButton.disabled = false;
         generateButton.textContent = '生成图像';
         console.log("所有处理完成，按钮已恢复");
     });
-});
\ No newline at end of file
+});
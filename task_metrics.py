@@ -0,0 +1,45 @@
+# task_metrics.py
+# -*- coding: utf-8 -*-
+"""
+渲染任务内部的指标采集。
+渲染代码在工作线程/进程中调用 record() 记录样本；工作池在任务结束时用 drain() 取出样本，
+随任务结果一起交回主进程汇总。因此线程池和进程池后端的指标都能在主进程中看到。
+各渲染阶段 (遮罩、图案、粘贴、描边等) 的耗时用 stage() 累加，drain() 时每个阶段合并为一个 render_stage 样本。
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+_local = threading.local()
+
+
+def record(name: str, **fields):
+    """为当前线程正在执行的任务记录一个样本"""
+    samples = getattr(_local, 'samples', None)
+    if samples is None:
+        samples = _local.samples = []
+    samples.append((name, fields))
+
+
+@contextmanager
+def stage(name: str):
+    """with stage("masks"): ... 把代码块的耗时累加到当前任务的该阶段 (同一阶段可多次进入，例如逐带处理)"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stages = getattr(_local, 'stages', None)
+        if stages is None:
+            stages = _local.stages = {}
+        stages[name] = stages.get(name, 0.0) + time.perf_counter() - started
+
+
+def drain() -> list:
+    """取出并清空当前线程记录的样本 [(name, fields), ...] (各阶段的累计耗时为 render_stage 样本)"""
+    samples = getattr(_local, 'samples', None) or []
+    stages = getattr(_local, 'stages', None) or {}
+    _local.samples = []
+    _local.stages = {}
+    samples.extend(("render_stage", {"stage": name, "seconds": seconds}) for name, seconds in stages.items())
+    return samples
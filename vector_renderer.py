@@ -0,0 +1,300 @@
+# vector_renderer.py
+# -*- coding: utf-8 -*-
+"""
+矢量输出 (SVG / 单页 PDF)，直接由场景 (scene.Scene，毫米/磅) 生成，与 DPI 无关。
+设计与 image_generator.create_bordered_image 相同: 边框填充 (外框形状挖掉内框形状)、内框填充、内框描边、外框描边。
+斜线和棋盘格使用平铺图案 (SVG <pattern> / PDF 平铺图案)，因此输出大小只与图元数量有关，而与图案密度无关。
+不依赖第三方库。
+"""
+
+import zlib
+
+from scene import Scene
+
+MM_TO_PT = 72.0 / 25.4
+# 用三次贝塞尔曲线逼近四分之一圆弧的控制点系数
+KAPPA = 0.5522847498
+
+
+def _num(value: float) -> str:
+    """数字格式化: 最多4位小数，去掉多余的0"""
+    text = f"{value:.4f}".rstrip('0').rstrip('.')
+    return text if text not in ('', '-0') else '0'
+
+
+def _visible(color) -> bool:
+    """颜色是否为 RGBA 元组且透明度大于0"""
+    return isinstance(color, tuple) and len(color) == 4 and color[3] > 0
+
+
+# --- 路径: [('M', x, y), ('L', x, y), ('C', x1, y1, x2, y2, x, y), ('Z',)]，单位为毫米，y 轴向下 ---
+
+def rect_path(x0, y0, x1, y1, radius=0.0) -> list:
+    """(圆角) 矩形路径"""
+    radius = max(0.0, min(radius, (x1 - x0) / 2.0, (y1 - y0) / 2.0))
+    if radius <= 0:
+        return [('M', x0, y0), ('L', x1, y0), ('L', x1, y1), ('L', x0, y1), ('Z',)]
+    k = radius * (1 - KAPPA)
+    return [
+        ('M', x0 + radius, y0), ('L', x1 - radius, y0),
+        ('C', x1 - k, y0, x1, y0 + k, x1, y0 + radius), ('L', x1, y1 - radius),
+        ('C', x1, y1 - k, x1 - k, y1, x1 - radius, y1), ('L', x0 + radius, y1),
+        ('C', x0 + k, y1, x0, y1 - k, x0, y1 - radius), ('L', x0, y0 + radius),
+        ('C', x0, y0 + k, x0 + k, y0, x0 + radius, y0), ('Z',),
+    ]
+
+
+def ellipse_path(x0, y0, x1, y1) -> list:
+    """内切于 bbox 的椭圆路径 (四段贝塞尔曲线)"""
+    cx, cy = (x0 + x1) / 2.0, (y0 + y1) / 2.0
+    rx, ry = (x1 - x0) / 2.0, (y1 - y0) / 2.0
+    kx, ky = rx * KAPPA, ry * KAPPA
+    return [
+        ('M', cx + rx, cy),
+        ('C', cx + rx, cy + ky, cx + kx, cy + ry, cx, cy + ry),
+        ('C', cx - kx, cy + ry, cx - rx, cy + ky, cx - rx, cy),
+        ('C', cx - rx, cy - ky, cx - kx, cy - ry, cx, cy - ry),
+        ('C', cx + kx, cy - ry, cx + rx, cy - ky, cx + rx, cy),
+        ('Z',),
+    ]
+
+
+# 绘制描边的形状；与光栅路径一致，其他 (不支持的) 形状按矩形填充但不描边
+STROKED_SHAPES = ('rectangle', 'ellipse')
+
+
+def shape_path(shape_type, box, radius=0.0) -> list:
+    """按形状类型生成路径 (不支持的形状按矩形处理，与光栅路径一致)"""
+    if shape_type == 'ellipse':
+        return ellipse_path(*box)
+    return rect_path(*box, radius=radius)
+
+
+def svg_path_data(path) -> str:
+    return ' '.join(op[0] + ' '.join(_num(v) for v in op[1:]) for op in path)
+
+
+def pdf_path_ops(path) -> str:
+    operators = {'M': 'm', 'L': 'l', 'C': 'c', 'Z': 'h'}
+    return ' '.join(' '.join([*(_num(v) for v in op[1:]), operators[op[0]]]) for op in path)
+
+
+# --- 设计: 由毫米/磅参数得到的图元列表 ---
+
+def build_vector_design(scene: Scene) -> dict:
+    """
+    由场景生成图元列表，返回 {'size': (宽, 高), 'items': [...]}，items 按绘制顺序排列:
+        ('fill', 路径列表, 裁剪路径或 None, 填充)   多个路径按奇偶规则填充
+        ('stroke', 路径, 颜色, 线宽)
+    填充为 ('solid', 颜色) / ('diagonal', 颜色, 间距, 线宽, 相位) / ('checkerboard', 颜色1, 颜色2, 格子尺寸)。
+    """
+    style = scene.style
+    width, height = scene.outer_width_mm, scene.outer_height_mm
+    stroke_width = scene.stroke_width_mm
+    line_width = max(scene.diagonal_line_width_mm, 1e-3)
+    outer_path = shape_path(scene.outer_shape_type, (0.0, 0.0, width, height))
+    inner_path = shape_path(scene.inner_shape_type, scene.inner_box_mm, scene.corner_radius_mm) if scene.has_inner_area else None
+
+    def fill_spec(fill_type, color1, color2, spacing_mm):
+        if not _visible(color1):
+            return None
+        if fill_type == 'solid':
+            return ('solid', color1)
+        if fill_type == 'diagonal':
+            spacing = max(float(spacing_mm), line_width)
+            # 与光栅路径相位一致: 线满足 x - y ≡ -2 * height (mod spacing)
+            return ('diagonal', color1, spacing, line_width, (-2.0 * height) % spacing)
+        if fill_type == 'checkerboard':
+            return ('checkerboard', color1, color2 if _visible(color2) else None, max(float(spacing_mm), 1e-2))
+        return None
+
+    items = []
+    border_fill = fill_spec(style.outer_border_type, style.outer_border_color1,
+                            style.outer_border_color2, style.outer_border_pattern_spacing_mm)
+    if scene.has_visible_border and border_fill:
+        paths = [outer_path] + ([inner_path] if inner_path else [])
+        items.append(('fill', paths, outer_path, border_fill))
+    inner_fill = fill_spec(style.inner_fill_type, style.inner_fill_color1,
+                           style.inner_fill_color2, style.inner_fill_pattern_spacing_mm)
+    if inner_path and inner_fill:
+        items.append(('fill', [inner_path], None, inner_fill))
+    # 内框描边以内框边缘为中线；外框描边完全位于画布内 (向内收缩半个线宽)
+    if inner_path and scene.inner_shape_type in STROKED_SHAPES and _visible(style.inner_stroke_color) and stroke_width > 0:
+        items.append(('stroke', inner_path, style.inner_stroke_color, stroke_width))
+    if scene.outer_shape_type in STROKED_SHAPES and _visible(style.outer_stroke_color) and stroke_width > 0:
+        half = stroke_width / 2.0
+        items.append(('stroke', shape_path(scene.outer_shape_type, (half, half, width - half, height - half)),
+                      style.outer_stroke_color, stroke_width))
+    return {"size": (width, height), "items": items}
+
+
+# --- SVG ---
+
+def _svg_color(attribute, color) -> str:
+    text = f'{attribute}="rgb({color[0]},{color[1]},{color[2]})"'
+    if color[3] < 255:
+        text += f' {attribute}-opacity="{_num(color[3] / 255.0)}"'
+    return text
+
+
+def _svg_pattern(pattern_id, fill) -> str:
+    if fill[0] == 'diagonal':
+        _, color, spacing, line_width, phase = fill
+        s, lw = spacing, line_width
+        # 图块内的线满足 u - v ≡ 0 (mod spacing)，三条线覆盖与图块相交的所有线段
+        d = ' '.join(f"M{_num(k - lw)} {_num(-lw)}L{_num(k + s + lw)} {_num(s + lw)}" for k in (-s, 0.0, s))
+        return (f'<pattern id="{pattern_id}" patternUnits="userSpaceOnUse" x="{_num(phase)}" y="0" '
+                f'width="{_num(s)}" height="{_num(s)}">'
+                f'<path d="{d}" fill="none" {_svg_color("stroke", color)} stroke-width="{_num(lw)}"/></pattern>')
+    _, color1, color2, cell = fill
+    cells = [(color1, 0, 0), (color1, cell, cell)] + ([(color2, cell, 0), (color2, 0, cell)] if color2 else [])
+    rects = ''.join(f'<rect x="{_num(x)}" y="{_num(y)}" width="{_num(cell)}" height="{_num(cell)}" {_svg_color("fill", color)}/>'
+                    for color, x, y in cells)
+    return (f'<pattern id="{pattern_id}" patternUnits="userSpaceOnUse" x="0" y="0" '
+            f'width="{_num(2 * cell)}" height="{_num(2 * cell)}">{rects}</pattern>')
+
+
+def render_svg(design: dict) -> bytes:
+    """把设计编码为 SVG (用户单位为毫米)"""
+    width, height = design["size"]
+    defs, body = [], []
+    for index, item in enumerate(design["items"]):
+        if item[0] == 'fill':
+            _, paths, clip, fill = item
+            if fill[0] == 'solid':
+                paint = _svg_color("fill", fill[1])
+            else:
+                defs.append(_svg_pattern(f"p{index}", fill))
+                paint = f'fill="url(#p{index})"'
+            clip_attr = ''
+            if clip is not None:
+                defs.append(f'<clipPath id="c{index}"><path d="{svg_path_data(clip)}"/></clipPath>')
+                clip_attr = f' clip-path="url(#c{index})"'
+            d = ' '.join(svg_path_data(path) for path in paths)
+            body.append(f'<path d="{d}" fill-rule="evenodd" {paint}{clip_attr}/>')
+        else:
+            _, path, color, stroke_width = item
+            body.append(f'<path d="{svg_path_data(path)}" fill="none" {_svg_color("stroke", color)} '
+                        f'stroke-width="{_num(stroke_width)}"/>')
+    svg = (f'<?xml version="1.0" encoding="UTF-8"?>\n'
+           f'<svg xmlns="http://www.w3.org/2000/svg" width="{_num(width)}mm" height="{_num(height)}mm" '
+           f'viewBox="0 0 {_num(width)} {_num(height)}">'
+           f'{"<defs>" + "".join(defs) + "</defs>" if defs else ""}{"".join(body)}</svg>\n')
+    return svg.encode('utf-8')
+
+
+# --- PDF ---
+
+class _PdfWriter:
+    """最小的 PDF 对象写入器: 按顺序分配对象编号，最后生成交叉引用表"""
+
+    def __init__(self):
+        self.objects = [] # 对象内容 (bytes)，编号为下标 + 1
+
+    def reserve(self) -> int:
+        self.objects.append(None)
+        return len(self.objects)
+
+    def set(self, number: int, content: bytes):
+        self.objects[number - 1] = content
+
+    def add(self, content: bytes) -> int:
+        number = self.reserve()
+        self.set(number, content)
+        return number
+
+    @staticmethod
+    def stream(dictionary: str, data: bytes) -> bytes:
+        data = zlib.compress(data)
+        return f"<< {dictionary} /Filter /FlateDecode /Length {len(data)} >>\nstream\n".encode('ascii') + data + b"\nendstream"
+
+    def tobytes(self, root: int) -> bytes:
+        out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, content in enumerate(self.objects, start=1):
+            offsets.append(len(out))
+            out += f"{number} 0 obj\n".encode('ascii') + content + b"\nendobj\n"
+        xref = len(out)
+        out += f"xref\n0 {len(self.objects) + 1}\n0000000000 65535 f \n".encode('ascii')
+        out += b"".join(f"{offset:010d} 00000 n \n".encode('ascii') for offset in offsets)
+        out += f"trailer\n<< /Size {len(self.objects) + 1} /Root {root} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode('ascii')
+        return bytes(out)
+
+
+class _PdfResources:
+    """收集透明度 (ExtGState) 资源"""
+
+    def __init__(self):
+        self.alphas = {}
+
+    def color(self, color, stroke=False) -> str:
+        ops = f"{_num(color[0] / 255)} {_num(color[1] / 255)} {_num(color[2] / 255)} {'RG' if stroke else 'rg'}"
+        if color[3] < 255:
+            name = self.alphas.setdefault((color[3], stroke), f"GS{len(self.alphas)}")
+            ops += f" /{name} gs"
+        return ops
+
+    def dictionary(self) -> str:
+        if not self.alphas:
+            return ""
+        states = ' '.join(f"/{name} << /{'CA' if stroke else 'ca'} {_num(alpha / 255)} >>"
+                          for (alpha, stroke), name in self.alphas.items())
+        return f"/ExtGState << {states} >>"
+
+
+def _pdf_pattern(writer, fill, page_height_pt) -> int:
+    """写入一个平铺图案对象 (图案空间单位为毫米、y 轴向下)，返回对象编号"""
+    resources = _PdfResources()
+    if fill[0] == 'diagonal':
+        _, color, spacing, line_width, phase = fill
+        s, lw = spacing, line_width
+        lines = ' '.join(f"{_num(k - lw)} {_num(-lw)} m {_num(k + s + lw)} {_num(s + lw)} l" for k in (-s, 0.0, s))
+        content = f"{resources.color(color, stroke=True)} {_num(lw)} w {lines} S"
+        step, origin_x = s, phase
+    else:
+        _, color1, color2, cell = fill
+        cells = [(color1, 0, 0), (color1, cell, cell)] + ([(color2, cell, 0), (color2, 0, cell)] if color2 else [])
+        content = ' '.join(f"q {resources.color(color)} {_num(x)} {_num(y)} {_num(cell)} {_num(cell)} re f Q"
+                           for color, x, y in cells)
+        step, origin_x = 2 * cell, 0.0
+    # 图案矩阵把图案空间映射到页面默认坐标系 (与内容流中的 cm 无关)，因此这里单独包含毫米换算和 y 翻转
+    matrix = f"{_num(MM_TO_PT)} 0 0 {_num(-MM_TO_PT)} {_num(origin_x * MM_TO_PT)} {_num(page_height_pt)}"
+    dictionary = (f"/Type /Pattern /PatternType 1 /PaintType 1 /TilingType 1 /BBox [0 0 {_num(step)} {_num(step)}] "
+                  f"/XStep {_num(step)} /YStep {_num(step)} /Matrix [{matrix}] /Resources << {resources.dictionary()} >>")
+    return writer.add(writer.stream(dictionary, content.encode('ascii')))
+
+
+def render_pdf(design: dict) -> bytes:
+    """把设计编码为单页 PDF (页面尺寸等于外框尺寸)"""
+    width, height = design["size"]
+    page_w, page_h = width * MM_TO_PT, height * MM_TO_PT
+    writer = _PdfWriter()
+    catalog, pages, page = writer.reserve(), writer.reserve(), writer.reserve()
+    resources = _PdfResources()
+    patterns = {}
+    # 内容流使用毫米单位、y 轴向下，与 SVG 及光栅坐标一致
+    ops = [f"{_num(MM_TO_PT)} 0 0 {_num(-MM_TO_PT)} 0 {_num(page_h)} cm"]
+    for item in design["items"]:
+        ops.append("q")
+        if item[0] == 'fill':
+            _, paths, clip, fill = item
+            if clip is not None:
+                ops.append(f"{pdf_path_ops(clip)} W n")
+            if fill[0] == 'solid':
+                ops.append(resources.color(fill[1]))
+            else:
+                name = f"P{len(patterns)}"
+                patterns[name] = _pdf_pattern(writer, fill, page_h)
+                ops.append(f"/Pattern cs /{name} scn")
+            ops.append(f"{' '.join(pdf_path_ops(path) for path in paths)} f*")
+        else:
+            _, path, color, stroke_width = item
+            ops.append(f"{resources.color(color, stroke=True)} {_num(stroke_width)} w {pdf_path_ops(path)} S")
+        ops.append("Q")
+    contents = writer.add(writer.stream("", '\n'.join(ops).encode('ascii')))
+    pattern_dict = f"/Pattern << {' '.join(f'/{name} {number} 0 R' for name, number in patterns.items())} >>" if patterns else ""
+    writer.set(page, (f"<< /Type /Page /Parent {pages} 0 R /MediaBox [0 0 {_num(page_w)} {_num(page_h)}] "
+                      f"/Resources << {resources.dictionary()} {pattern_dict} >> /Contents {contents} 0 R >>").encode('ascii'))
+    writer.set(pages, f"<< /Type /Pages /Kids [{page} 0 R] /Count 1 >>".encode('ascii'))
+    writer.set(catalog, f"<< /Type /Catalog /Pages {pages} 0 R >>".encode('ascii'))
+    return writer.tobytes(catalog)